@@ -0,0 +1,353 @@
+"""
+Benchmarks for the program generator.
+
+Each scenario synthesizes a tree of modules with a given shape (see benchmarks/synthesize_module_tree.py),
+turns some of them into local bare git repos that stand in for GitHub, then makes a program from them
+with make_program, once per build mode. The first build of each mode is cold (the repos have never been
+mirrored), the rest are warm. Each step is timed by utils/instrumentation.py, and the whole build end-to-end.
+
+Results are saved to benchmarks/results/, and compared with the previous results, so a regression
+in copying or merging modules shows up as a step that got slower.
+
+Usage:
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --scenario wide --scenario collisions --repeats 5
+    python -m benchmarks.run_benchmarks --baseline benchmarks/results/20241101-120000-000000.json --threshold 0.1
+"""
+import argparse
+import contextlib
+from datetime import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+
+from config.config import PULLED_REPOS_PATH
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from benchmarks.synthesize_module_tree import (
+    BENCHMARK_URL_PREFIX, DEFAULT_SHAPE, get_git_url_rewrite, make_bare_repos, synthesize_module_tree
+)
+from main import make_program
+from utils.content_store import ContentStore
+from utils.instrumentation import Instrumentation
+from utils.shared.get_formatted_datetime import get_formatted_datetime
+
+
+BENCHMARK_RESULTS_VERSION = 1
+BENCHMARK_RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+# Keys of DEFAULT_SHAPE to override, per scenario.
+SCENARIOS = {
+    "small": {"modules": 4, "files_per_module": 20, "file_size": 2048, "depth": 2,
+              "shared_files": 4, "shared_collisions": 2, "github_modules": 1},
+    "wide": {"modules": 32, "files_per_module": 40, "github_modules": 4},
+    "deep": {"modules": 6, "files_per_module": 300, "depth": 10, "file_size": 1024},
+    "large_files": {"modules": 4, "files_per_module": 8, "file_size": 4 * 1024 * 1024, "github_modules": 1},
+    "collisions": {"modules": 16, "files_per_module": 10, "shared_files": 40, "shared_collisions": 30},
+}
+
+BUILD_MODES = {"one_pass": False, "step_by_step": True}
+
+# A step is a regression if it got this much slower (as a fraction)...
+REGRESSION_THRESHOLD = 0.2
+# ...and by at least this many seconds, so noise in very short steps isn't reported.
+MIN_REGRESSION_SECONDS = 0.01
+
+
+def run_benchmarks(scenarios: dict[str, dict] = SCENARIOS,
+                   repeats: int = 3,
+                   modes: list[str] = None,
+                   work_path: Optional[str] = None
+                  ) -> dict:
+    """
+    Run every scenario in every build mode.
+
+    Example:
+    >>> results = run_benchmarks({"small": SCENARIOS["small"]}, repeats=3)
+    >>> results["scenarios"]["small"]["modes"]["one_pass"]["warm"]
+    {'total': 0.0412, 'steps': {'exports': 0.0061, 'files': 0.0154, ...}}
+
+    Args:
+        scenarios: Dictionary mapping scenario names to their shapes. See DEFAULT_SHAPE.
+        repeats: Builds per mode. The first is cold. Of the rest, each step's fastest time is reported as warm,
+            like timeit, since anything slower is noise from the rest of the machine.
+        modes: Keys of BUILD_MODES to run. Defaults to all of them.
+        work_path: Folder to synthesize modules and make programs in. Defaults to a temporary folder,
+            which is removed afterwards.
+
+    Returns:
+        The results. Save them with save_results.
+    """
+    modes = modes or list(BUILD_MODES)
+    results = {
+        "version": BENCHMARK_RESULTS_VERSION,
+        "created": get_formatted_datetime(),
+        "commit": _get_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeats": repeats,
+        "scenarios": {},
+    }
+
+    with contextlib.ExitStack() as stack:
+        if work_path is None:
+            work_path = stack.enter_context(tempfile.TemporaryDirectory(prefix="make_canned_program_benchmark-"))
+        for scenario_name, shape in scenarios.items():
+            logger.info(f"Running benchmark scenario '{scenario_name}'")
+            results["scenarios"][scenario_name] = run_scenario(
+                scenario_name, shape, os.path.join(work_path, scenario_name), repeats, modes
+            )
+    return results
+
+
+def run_scenario(scenario_name: str, shape: dict, scenario_path: str, repeats: int, modes: list[str]) -> dict:
+    """
+    Run one scenario. See run_benchmarks.
+
+    Returns:
+        A dictionary with the scenario's full 'shape', how many 'files' and 'bytes' it synthesized,
+        and the cold and warm timings of each build mode under 'modes'.
+    """
+    shape = {**DEFAULT_SHAPE, **shape}
+    modules = synthesize_module_tree(os.path.join(scenario_path, "modules"), shape)
+    files, size = _count_files(os.path.join(scenario_path, "modules"))
+    github_module_names = sorted(module_name for module_name in modules if module_name.startswith("module_"))
+    github_module_names = github_module_names[len(github_module_names) - shape["github_modules"]:]
+    remotes_path = os.path.join(scenario_path, "remotes")
+    make_bare_repos(modules, github_module_names, remotes_path)
+
+    # Each mode gets its own content store, so the first build is cold and earlier runs don't slow it down.
+    # Mirrors are kept in PULLED_REPOS_PATH, like any other GitHub module's. A fresh URL per run and mode
+    # makes the first build cold there too, and what the run adds is removed afterwards.
+    run_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    mirrors_before = _list_mirrors()
+    scenario = {"shape": shape, "files": files, "bytes": size, "modes": {}}
+    try:
+        for mode in modes:
+            url_prefix = f"{BENCHMARK_URL_PREFIX}{scenario_name}-{mode}-{run_id}/"
+            chosen_modules = {
+                module_name: f"{url_prefix}{module_name}" if module_name in github_module_names else module_path
+                for module_name, module_path in modules.items()
+            }
+            content_store = ContentStore(os.path.join(scenario_path, "content_store", mode))
+            builds = []
+            with _environment(get_git_url_rewrite(remotes_path, url_prefix)):
+                for repeat in range(repeats):
+                    output_root = os.path.join(scenario_path, "programs", mode)
+                    os.makedirs(output_root, exist_ok=True)
+                    builds.append(_time_build(
+                        f"program_{repeat}", chosen_modules, output_root, BUILD_MODES[mode], content_store
+                    ))
+                    shutil.rmtree(os.path.join(output_root, f"program_{repeat}"), ignore_errors=True)
+            scenario["modes"][mode] = {"cold": builds[0], "warm": _get_fastest_build(builds[1:])}
+    finally:
+        _remove_new_mirrors(mirrors_before)
+    return scenario
+
+
+def compare_results(baseline: dict,
+                    current: dict,
+                    threshold: float = REGRESSION_THRESHOLD,
+                    min_seconds: float = MIN_REGRESSION_SECONDS
+                   ) -> list[dict]:
+    """
+    Compare two sets of results, step by step. Scenarios, modes and steps that aren't in both are skipped.
+
+    Example:
+    >>> compare_results(load_results(baseline_path), results)
+    [{'scenario': 'wide', 'mode': 'step_by_step', 'build': 'warm', 'step': 'copy',
+      'baseline': 0.212, 'current': 0.301, 'change': 0.42, 'regression': True}, ...]
+
+    Returns:
+        One dictionary per step timing (and per 'total'), with its 'change' as a fraction of the baseline,
+        and whether it's a 'regression'.
+    """
+    comparisons = []
+    for scenario_name, scenario in current["scenarios"].items():
+        baseline_scenario = baseline["scenarios"].get(scenario_name)
+        if baseline_scenario is None:
+            continue
+        if baseline_scenario["shape"] != scenario["shape"]:
+            logger.warning(f"Scenario '{scenario_name}' changed shape since the baseline. Skipping it.")
+            continue
+        for mode, builds in scenario["modes"].items():
+            for build, timings in builds.items():
+                baseline_timings = baseline_scenario["modes"].get(mode, {}).get(build)
+                if not timings or not baseline_timings:
+                    continue
+                steps = {"total": timings["total"], **timings["steps"]}
+                baseline_steps = {"total": baseline_timings["total"], **baseline_timings["steps"]}
+                for step, seconds in steps.items():
+                    if step not in baseline_steps:
+                        continue
+                    baseline_seconds = baseline_steps[step]
+                    change = (seconds - baseline_seconds) / baseline_seconds if baseline_seconds else 0.0
+                    comparisons.append({
+                        "scenario": scenario_name, "mode": mode, "build": build, "step": step,
+                        "baseline": baseline_seconds, "current": seconds, "change": round(change, 3),
+                        "regression": change > threshold and seconds - baseline_seconds >= min_seconds,
+                    })
+    return comparisons
+
+
+def format_results(results: dict, comparisons: Optional[list[dict]] = None) -> str:
+    """Format results as a table, one row per step, with the change from the baseline if there is one."""
+    changes = {
+        (comparison["scenario"], comparison["mode"], comparison["build"], comparison["step"]): comparison
+        for comparison in comparisons or []
+    }
+    lines = [f"{'scenario':<14}{'mode':<14}{'build':<7}{'step':<16}{'seconds':>10}{'change':>10}"]
+    for scenario_name, scenario in results["scenarios"].items():
+        for mode, builds in scenario["modes"].items():
+            for build, timings in builds.items():
+                if not timings:
+                    continue
+                for step, seconds in {"total": timings["total"], **timings["steps"]}.items():
+                    comparison = changes.get((scenario_name, mode, build, step))
+                    change = "" if comparison is None else f"{comparison['change']:+.0%}"
+                    if comparison is not None and comparison["regression"]:
+                        change += " !"
+                    lines.append(f"{scenario_name:<14}{mode:<14}{build:<7}{step:<16}{seconds:>10.4f}{change:>10}")
+    return "\n".join(lines)
+
+
+def save_results(results: dict, results_folder: str = BENCHMARK_RESULTS_FOLDER) -> str:
+    """Save results to a new file in the results folder. Returns its path."""
+    os.makedirs(results_folder, exist_ok=True)
+    # Microseconds, so two runs in the same second don't overwrite each other. Names sort by time.
+    results_path = os.path.join(results_folder, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    return results_path
+
+
+def load_results(results_path: str) -> dict:
+    """Load results saved by save_results."""
+    with open(results_path, "r") as f:
+        results = json.load(f)
+    if results.get("version") != BENCHMARK_RESULTS_VERSION:
+        raise ValueError(f"Unsupported benchmark results version in {results_path}: {results.get('version')}")
+    return results
+
+
+def find_latest_results(results_folder: str = BENCHMARK_RESULTS_FOLDER) -> Optional[str]:
+    """Get the path of the newest results in the results folder, if there are any."""
+    try:
+        names = sorted(name for name in os.listdir(results_folder) if name.endswith(".json"))
+    except FileNotFoundError:
+        return None
+    return os.path.join(results_folder, names[-1]) if names else None
+
+
+def _time_build(program_name: str,
+                chosen_modules: dict[str, str],
+                output_root: str,
+                step_by_step: bool,
+                content_store: ContentStore
+               ) -> dict:
+    instrumentation = Instrumentation()
+    started = time.perf_counter()
+    # Keep the step announcements out of the results.
+    with contextlib.redirect_stdout(io.StringIO()):
+        make_program(program_name, chosen_modules, output_root=output_root, interactive=False,
+                     step_by_step=step_by_step, instrumentation=instrumentation, content_store=content_store)
+    total = time.perf_counter() - started
+    steps = instrumentation.report()["programs"][program_name]
+    return {"total": round(total, 6), "steps": {step: metrics["wall_seconds"] for step, metrics in steps.items()}}
+
+
+def _get_fastest_build(builds: list[dict]) -> Optional[dict]:
+    if not builds:
+        return None
+    return {
+        "total": min(build["total"] for build in builds),
+        "steps": {step: min(build["steps"][step] for build in builds if step in build["steps"]) for step in builds[0]["steps"]},
+    }
+
+
+def _count_files(path: str) -> tuple[int, int]:
+    files, size = 0, 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            files += 1
+            size += os.lstat(os.path.join(root, filename)).st_size
+    return files, size
+
+
+def _list_mirrors() -> set[str]:
+    mirrors = set()
+    for folder in (PULLED_REPOS_PATH, os.path.join(PULLED_REPOS_PATH, "exports")):
+        if os.path.isdir(folder):
+            mirrors.update(os.path.join(folder, name) for name in os.listdir(folder))
+    return mirrors
+
+
+def _remove_new_mirrors(mirrors_before: set[str]) -> None:
+    for path in _list_mirrors() - mirrors_before:
+        if path != os.path.join(PULLED_REPOS_PATH, "exports"):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextlib.contextmanager
+def _environment(variables: dict[str, str]):
+    previous = {name: os.environ.get(name) for name in variables}
+    os.environ.update(variables)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _get_commit() -> Optional[str]:
+    try:
+        process = subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 capture_output=True, text=True, check=True)
+        return process.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the program generator on synthetic modules.")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run. Can be given more than once. Defaults to all of them.")
+    parser.add_argument("--mode", action="append", choices=list(BUILD_MODES),
+                        help="Build mode to run. Can be given more than once. Defaults to all of them.")
+    parser.add_argument("--repeats", type=int, default=3, help="Builds per mode. The first one is cold.")
+    parser.add_argument("--baseline", help="Results to compare with. Defaults to the latest saved results.")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Report a step as a regression if it got this much slower, as a fraction.")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the results.")
+    args = parser.parse_args()
+
+    baseline_path = args.baseline or find_latest_results()
+    scenarios = {name: SCENARIOS[name] for name in args.scenario} if args.scenario else SCENARIOS
+    results = run_benchmarks(scenarios, repeats=max(1, args.repeats), modes=args.mode)
+
+    comparisons = None
+    if baseline_path:
+        comparisons = compare_results(load_results(baseline_path), results, threshold=args.threshold)
+    print(format_results(results, comparisons))
+    if baseline_path:
+        print(f"\nCompared with {baseline_path}")
+    if not args.no_save:
+        print(f"Saved results to {save_results(results)}")
+
+    regressions = [comparison for comparison in comparisons or [] if comparison["regression"]]
+    if regressions:
+        print(f"\n{len(regressions)} step(s) got slower than the baseline by more than {args.threshold:.0%}.")
+        sys.exit(1)
@@ -0,0 +1,147 @@
+import os
+from pathlib import Path
+import random
+import shutil
+import subprocess
+
+
+# Every shape key, and its default.
+DEFAULT_SHAPE = {
+    "modules": 8,            # Generic modules, on top of main, start, install, gitignore, logger, config and utils.
+    "files_per_module": 50,  # Python files in each generic module, spread over its subfolders.
+    "file_size": 4096,       # Bytes per file.
+    "depth": 3,              # Deepest subfolder nesting in a generic module.
+    "shared_files": 8,       # Files in each generic module's utils/shared.
+    "shared_collisions": 4,  # How many of those have the same name in every module, so merging them collides.
+    "github_modules": 2,     # How many of the generic modules are pulled from (local, bare) git repos instead of disk.
+    "seed": 0,
+}
+
+# Pulled by the program generator, but stood in for by local bare repos. See make_bare_repos.
+BENCHMARK_URL_PREFIX = "https://github.com/make-canned-program-benchmarks/"
+
+# Files of the modules every program includes. See ALWAYS_INCLUDE in main.py
+BASE_MODULE_FILES = {
+    "main": ["_main.py"],
+    "start": ["start.sh"],
+    "install": ["install.sh"],
+    "gitignore": ["_.gitignore"],
+    "logger": ["logger.py"],
+    "config": ["config.py"],
+    "utils": ["shared/next_step.py", "shared/make_sha256_hash.py"],
+}
+
+# Content is made from blocks of this size, so large files are quick to make.
+BLOCK_SIZE = 64 * 1024
+
+
+def synthesize_module_tree(modules_path: str, shape: dict = None) -> dict[str, str]:
+    """
+    Make a folder of synthetic modules with a given shape, for benchmarking. The same shape always gives
+    the same files, with the same contents.
+
+    Example:
+    >>> modules = synthesize_module_tree("/tmp/benchmark/modules", {"modules": 2, "files_per_module": 3})
+    >>> modules
+    {'main': '/tmp/benchmark/modules/main', ..., 'module_00': '/tmp/benchmark/modules/module_00',
+     'module_01': '/tmp/benchmark/modules/module_01'}
+
+    Args:
+        modules_path: Folder to make the modules in. Must not exist yet.
+        shape: The keys of DEFAULT_SHAPE to override.
+
+    Returns:
+        Dictionary mapping each module name to its folder, like ChooseModule.modules().
+    """
+    shape = {**DEFAULT_SHAPE, **(shape or {})}
+    os.makedirs(modules_path)
+    rng = random.Random(shape["seed"])
+    packages = [f"package_{idx:02}" for idx in range(20)]
+    modules = {}
+
+    for module_name, filenames in BASE_MODULE_FILES.items():
+        module_path = os.path.join(modules_path, module_name)
+        for filename in filenames:
+            _write_file(os.path.join(module_path, filename), shape["file_size"], rng)
+        modules[module_name] = module_path
+
+    for idx in range(shape["modules"]):
+        module_name = f"module_{idx:02}"
+        module_path = os.path.join(modules_path, module_name)
+        for file_idx in range(shape["files_per_module"]):
+            # Spread files from the module's top level down to the deepest subfolder.
+            dirs = [f"dir_{level}_{file_idx % (level + 2)}" for level in range(file_idx % (shape["depth"] + 1))]
+            _write_file(os.path.join(module_path, *dirs, f"file_{file_idx:04}.py"), shape["file_size"], rng)
+
+        for shared_idx in range(shape["shared_files"]):
+            filename = f"shared_{shared_idx:02}.py" if shared_idx < shape["shared_collisions"] \
+                else f"{module_name}_shared_{shared_idx:02}.py"
+            _write_file(os.path.join(module_path, "utils", "shared", filename), shape["file_size"], rng)
+
+        with open(os.path.join(module_path, "requirements.txt"), "w") as f:
+            f.write("\n".join(sorted(rng.sample(packages, 3))) + "\n")
+        modules[module_name] = module_path
+
+    return modules
+
+
+def make_bare_repos(modules: dict[str, str],
+                    module_names: list[str],
+                    remotes_path: str,
+                    url_prefix: str = BENCHMARK_URL_PREFIX
+                   ) -> dict[str, str]:
+    """
+    Turn on-disk modules into bare git repos that stand in for GitHub. Their working copies are removed.
+    Point their URLs at the repos with get_git_url_rewrite.
+
+    Example:
+    >>> make_bare_repos(modules, ["module_07"], "/tmp/benchmark/remotes")
+    {'module_07': 'https://github.com/make-canned-program-benchmarks/module_07'}
+
+    Returns:
+        Dictionary mapping each module name to its URL.
+    """
+    os.makedirs(remotes_path, exist_ok=True)
+    # Fixed authors and dates, so the same modules always give the same commits.
+    env = {**os.environ, "GIT_AUTHOR_NAME": "benchmark", "GIT_AUTHOR_EMAIL": "benchmark@localhost",
+           "GIT_COMMITTER_NAME": "benchmark", "GIT_COMMITTER_EMAIL": "benchmark@localhost",
+           "GIT_AUTHOR_DATE": "2024-01-01T00:00:00Z", "GIT_COMMITTER_DATE": "2024-01-01T00:00:00Z"}
+    urls = {}
+    for module_name in module_names:
+        module_path = modules[module_name]
+        for command in (["git", "init", "--quiet"], ["git", "add", "--all"],
+                        ["git", "commit", "--quiet", "--no-gpg-sign", "-m", f"Synthetic module {module_name}"]):
+            subprocess.run(command, cwd=module_path, env=env, check=True, capture_output=True)
+        subprocess.run(["git", "clone", "--bare", "--quiet", module_path, os.path.join(remotes_path, f"{module_name}.git")],
+                       env=env, check=True, capture_output=True)
+        shutil.rmtree(module_path)
+        urls[module_name] = f"{url_prefix}{module_name}"
+    return urls
+
+
+def get_git_url_rewrite(remotes_path: str, url_prefix: str = BENCHMARK_URL_PREFIX) -> dict[str, str]:
+    """
+    Get the environment variables that make git fetch URLs starting with url_prefix from the bare repos
+    in remotes_path instead, e.g. 'https://github.com/make-canned-program-benchmarks/module_07'
+    -> 'file:///tmp/benchmark/remotes/module_07.git'. Git adds the '.git' itself.
+    """
+    return {
+        "GIT_CONFIG_COUNT": "1",
+        "GIT_CONFIG_KEY_0": f"url.{Path(remotes_path).resolve().as_uri()}/.insteadOf",
+        "GIT_CONFIG_VALUE_0": url_prefix,
+    }
+
+
+def _write_file(path: str, size: int, rng: random.Random) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # A unique first line, then random lines, so no two files have the same contents.
+    header = f"# {os.path.basename(path)} {rng.getrandbits(64):016x}\n".encode()
+    block = "".join(f"value_{rng.getrandbits(32):08x} = {rng.getrandbits(16)}\n"
+                    for _ in range(min(size, BLOCK_SIZE) // 24 + 1)).encode()[:BLOCK_SIZE]
+    with open(path, "wb") as f:
+        f.write(header[:size])
+        remaining = size - min(len(header), size)
+        while remaining > 0:
+            chunk = block[:remaining]
+            f.write(chunk)
+            remaining -= len(chunk)
@@ -1,22 +1,40 @@
 
+import argparse
 import os
+import shutil
 import sys
+import tempfile
+from typing import Callable
 
 
 from steps.validated.choose_modules import ChooseModule
 from steps.validated.copy_on_disk_modules_to_program_directory import CopyOnDiskModulesToProgramDirectory
-from steps.validated.make_program_directory import make_program_directory
+from steps.validated.make_program_directory import staged_program_directory
 from steps.validated.concatenate_requirements import concatenate_requirements
 
 from steps.wip.pull_remote_modules_from_github import PullRemoteModulesFromGithub
 
 
 from utils.create_debug_input_and_output_folders import create_debug_input_and_output_folders
+from utils.build_manifest import (
+    BUILD_MANIFEST_FILENAME, check_program_files, load_build_manifest, make_file_entry, write_build_manifest
+)
+from utils.content_store import ContentStore
 from utils.create_readme import create_readme
+from utils.estimate_plan import estimate_plan, format_bytes, format_estimate
+from utils.execute_plan import execute_plan, store_module_files
+from utils.instrumentation import Instrumentation
+from utils.load_manifest import load_manifest
+from utils.pipeline import Pipeline
+from utils.plan_program import GENERATED_FILES, plan_program
 
 from utils.remove_underscores import remove_underscores
+from utils.resolve_requirements import RequirementsMerger
 from utils.unpack_then_delete import unpack_then_delete
 from utils.unpack_utils_shared import unpack_utils_shared
+from utils.update_program import update_program
+from utils.venv_cache import add_cached_venv
+from utils.wheelhouse import add_offline_install
 from utils.shared.next_step import next_step
 
 
@@ -25,7 +43,19 @@ from logger.logger import Logger
 logger = Logger(logger_name=__name__)
 
 
-def main():
+ALWAYS_INCLUDE = ["main", "start", "install",
+                  "gitignore", "requirements", "readme",
+                  "logger", "config", "utils"]
+
+
+def main(link_files: bool = False,
+         update: bool = False,
+         step_by_step: bool = False,
+         plan_only: bool = False,
+         report_path: str = None,
+         wheelhouse: bool = False,
+         venv_cache: bool = False
+        ):
     """
     Create the base for a program. The program will have the following file structure.
     program_name/
@@ -49,56 +79,442 @@ def main():
 
 
     next_step("Step 2. Choose custom modules to include in your program.")
-    always_include = ["main", "start", "install",
-                      "gitignore", "requirements", "readme",
-                      "logger", "config", "utils"]
-    choose = ChooseModule(always_include=always_include)
-    chosen_modules = choose.modules()
-
-
-    next_step("Step 3. Create the folder with chosen program name in the home directory.")
-    program_path = make_program_directory(program_name, preferred_path=OUTPUT_FOLDER)
-
-
-    next_step("Step 4. Copy the on-disk modules to the program directory.")
-    # NOTE: Ignore .git and .gitignore files.
-    copy = CopyOnDiskModulesToProgramDirectory(chosen_modules, program_path)
-    copy.modules_to_program_directory()
+    choose = ChooseModule(always_include=ALWAYS_INCLUDE)
+    # When updating, default to the modules the program was made with.
+    build_manifest = load_build_manifest(os.path.join(OUTPUT_FOLDER, program_name)) if update else None
+    if build_manifest:
+        print(f"Updating '{program_name}' with its original modules: {', '.join(build_manifest['modules'])}")
+        chosen_modules = choose.modules(list(build_manifest["modules"]))
+    else:
+        chosen_modules = choose.modules()
+
+    if plan_only:
+        print(format_estimate(plan_program_only(program_name, chosen_modules, update=update)))
+        return
+    instrumentation = Instrumentation() if report_path else None
+    try:
+        make_program(program_name, chosen_modules, link_files=link_files, update=update,
+                     step_by_step=step_by_step, instrumentation=instrumentation, wheelhouse=wheelhouse,
+                     venv_cache=venv_cache)
+    finally:
+        if instrumentation is not None:
+            instrumentation.write_report(report_path)
+
+
+def make_program(program_name: str,
+                 chosen_modules: dict[str, str],
+                 output_root: str = None,
+                 interactive: bool = True,
+                 link_files: bool = False,
+                 update: bool = False,
+                 step_by_step: bool = False,
+                 instrumentation: Instrumentation = None,
+                 content_store: ContentStore = None,
+                 wheelhouse: bool = False,
+                 venv_cache: bool = False
+                ) -> str:
+    """
+    Make a single program, from Step 3 on.
+
+    Args:
+        program_name: Name of the program folder.
+        chosen_modules: Dictionary mapping module names to their paths/URLs, from ChooseModule.modules().
+        output_root: Folder to make the program in. Defaults to OUTPUT_FOLDER.
+        interactive: If False, don't ask for confirmation before writing the program.
+        link_files: If True, hardlink module files from the content store when reflinks aren't supported.
+            This saves disk space, but the hardlinked files are read-only.
+        update: If True and the program already exists, only apply what changed in its modules,
+            keeping the user's edits. See utils/update_program.py
+        step_by_step: If True, copy the modules into the program and then rearrange them (the old Steps 4-11),
+            instead of planning where every file goes and writing each one once.
+        instrumentation: If given, record each step's time, files and I/O in it. See utils/instrumentation.py
+        content_store: The store to write module files through. Defaults to the shared store.
+        wheelhouse: If True, put wheels for the program's requirements in it from the shared wheelhouse,
+            with install scripts that install them without the network. See utils/wheelhouse.py
+        venv_cache: If True, give the program a venv with its requirements installed, hardlink-cloned from
+            a cached venv for the same requirements. See utils/venv_cache.py
+
+    Returns:
+        The path to the finished program.
+
+    Raises:
+        ValueError: If updating a program that has no build manifest.
+    """
+    output_root = output_root or OUTPUT_FOLDER
+    program_path = os.path.join(output_root, program_name)
+    if update and os.path.exists(program_path):
+        # Build next to the program, then move over only what changed. Module files that are the same as
+        # when the program was last built aren't written at all, unless building step by step.
+        build_manifest = load_build_manifest(program_path)
+        if build_manifest is None:
+            # Checked before building, since update_program can't run without it.
+            raise ValueError(
+                f"Can't update {program_path}: it has no {BUILD_MANIFEST_FILENAME}, so user edits can't be told apart "
+                f"from generated files. Move it aside and make it again without --update."
+            )
+        edits = check_program_files(program_path, build_manifest)
+        if edits["modified"] or edits["missing"]:
+            logger.info(f"Since '{program_name}' was made, {len(edits['modified'])} generated files were edited "
+                        f"and {len(edits['missing'])} were deleted. These are kept as they are.")
+        previous_files = build_manifest["files"]
+        staging_path = tempfile.mkdtemp(dir=output_root, prefix=f".{program_name}.update-")
+        try:
+            build_program(program_name, chosen_modules, staging_path, interactive=interactive, link_files=link_files,
+                          step_by_step=step_by_step, instrumentation=instrumentation, content_store=content_store,
+                          wheelhouse=wheelhouse, previous_files=previous_files)
+            if instrumentation is not None:
+                instrumentation.measure(program_name, "update", update_program, staging_path, program_path)
+            else:
+                update_program(staging_path, program_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+        if venv_cache:
+            _add_cached_venv(program_name, program_path, instrumentation)
+        return program_path
+
+    next_step("Step 3. Create a staging folder next to where the program will go.")
+    # The program only appears at its final path once it's complete. If a step fails, nothing is left behind.
+    with staged_program_directory(program_name, preferred_path=output_root) as staging_path:
+        build_program(program_name, chosen_modules, staging_path, interactive=interactive, link_files=link_files,
+                      step_by_step=step_by_step, instrumentation=instrumentation, content_store=content_store,
+                      wheelhouse=wheelhouse)
+    if venv_cache:
+        # Once the program is at its final path, since a venv can't be moved.
+        _add_cached_venv(program_name, program_path, instrumentation)
+    print(f"\nProgram '{program_name}' has been created successfully in {program_path}.")
+    return program_path
+
+
+def _add_cached_venv(program_name: str, program_path: str, instrumentation: Instrumentation = None) -> None:
+    next_step("Clone the program's venv from the venv cache.")
+    if instrumentation is not None:
+        instrumentation.measure(program_name, "venv", add_cached_venv, program_path)
+    else:
+        add_cached_venv(program_path)
+
+
+def build_program(program_name: str,
+                  chosen_modules: dict[str, str],
+                  program_path: str,
+                  interactive: bool = True,
+                  link_files: bool = False,
+                  step_by_step: bool = False,
+                  instrumentation: Instrumentation = None,
+                  content_store: ContentStore = None,
+                  wheelhouse: bool = False,
+                  previous_files: dict[str, dict] = None
+                 ) -> None:
+    """
+    Build a program in an existing, empty program directory. See make_program for the arguments.
 
+    previous_files are the file entries from the build manifest of the program being updated.
+    Building in one pass, module files that haven't changed since then aren't written. See utils/execute_plan.py
+    """
+    if step_by_step:
+        build_program_step_by_step(program_name, chosen_modules, program_path, interactive, link_files,
+                                   instrumentation, content_store, wheelhouse)
+    else:
+        build_program_in_one_pass(program_name, chosen_modules, program_path, interactive, link_files,
+                                  instrumentation, content_store, wheelhouse, previous_files)
+
+
+def build_program_in_one_pass(program_name: str,
+                              chosen_modules: dict[str, str],
+                              program_path: str,
+                              interactive: bool = True,
+                              link_files: bool = False,
+                              instrumentation: Instrumentation = None,
+                              content_store: ContentStore = None,
+                              wheelhouse: bool = False,
+                              previous_files: dict[str, dict] = None
+                             ) -> None:
+    """
+    Work out where every module file ends up, then write each one once.
+    Gives the same program as build_program_step_by_step, without copying, moving and deleting
+    the same files several times. See utils/plan_program.py
 
-    # TODO This function works as intended, but throws [WinError 5] Access is denied.
-    next_step("Step 5. Pull the requested modules from GitHub or disk.")
+    Steps run as a pipeline, so independent ones overlap: on-disk module files are hashed into the
+    content store while GitHub modules are exported, and the requirements, README and folders
+    are made while the files are written. See utils/pipeline.py
+    """
     pull = PullRemoteModulesFromGithub(chosen_modules, program_path)
-    pull.remote_modules_from_github()
-
-
-    next_step("Step 6. Concatenate requirements.txt files.")
-    all_requirements = concatenate_requirements(program_path)
-
-
-    next_step("Step 7. Unpack the 'utils.shared' files.", stop=True)
-    unpack_utils_shared(chosen_modules, program_path)
+    content_store = content_store or ContentStore.shared()
+    link_modes = ("reflink", "hardlink", "copy") if link_files else ("reflink", "copy")
+
+    def export_modules() -> dict[str, str]:
+        return {
+            module_name: export_path for module_name, (success, export_path) in pull.export_modules().items() if success
+        }
+
+    def plan_files(exports: dict[str, str]) -> dict:
+        plan = plan_program(_get_module_sources(chosen_modules, exports))
+        for skipped in plan["skipped"]:
+            logger.info(f"Skipping {skipped['module']}'s {skipped['destination']}: {skipped['reason']}")
+        return plan
+
+    def write_manifest(files: dict[str, dict[str, dict]], offline_install: dict[str, dict] = None) -> None:
+        # Record what was generated, so the program can be updated later without losing edits.
+        # The planned files were hashed on their way into the content store, so only the generated ones need hashing.
+        # files is execute_plan's output: the entries for the planned files and symlinks.
+        symlinks = files["symlinks"]
+        files = files["files"]
+        for relative_path in GENERATED_FILES:
+            files[relative_path] = make_file_entry(os.path.join(program_path, *relative_path.split("/")))
+        files.update(offline_install or {})
+        write_build_manifest(program_path, program_name, chosen_modules, module_commits=pull.commits,
+                             files=files, symlinks=symlinks)
+
+    pipeline = Pipeline(instrumentation=instrumentation, name=program_name)
+    pipeline.add_step("exports", _announce("Step 4. Export the requested modules from GitHub.", export_modules))
+    pipeline.add_step("stored", _announce(
+        "Step 5. Hash the on-disk module files into the content store.",
+        lambda: store_module_files(list(_get_module_sources(chosen_modules, {}).values()), content_store)
+    ))
+    pipeline.add_step("plan", _announce(
+        "Step 6. Plan where every module file goes in the program directory.", plan_files
+    ), inputs=["exports"])
+    pipeline.add_step("files", _announce(
+        "Step 7. Write the planned files to the program directory.",
+        lambda plan: execute_plan(plan, program_path, content_store, link_modes, previous_files=previous_files)
+    ), inputs=["plan"], after=["stored"])
+    pipeline.add_step("requirements", _announce(
+        "Step 8. Concatenate requirements.txt files.",
+        lambda plan: concatenate_requirements(program_path, plan["requirements_files"])
+    ), inputs=["plan"])
+    pipeline.add_step("readme", _announce(
+        "Step 9. Create a README.md file.",
+        lambda requirements: create_readme(program_name, program_path, requirements)
+    ), inputs=["requirements"])
+    pipeline.add_step("folders", _announce(
+        "Step 10. Create debug, input, and output folders.",
+        lambda: create_debug_input_and_output_folders(program_path)
+    ))
+    if wheelhouse:
+        pipeline.add_step("offline_install", _announce(
+            "Step 11. Add wheels for the requirements from the wheelhouse, with offline install scripts.",
+            lambda: add_offline_install(program_path)
+        ), after=["requirements", "files"])
+    pipeline.add_step("manifest", write_manifest, inputs=["files"] + (["offline_install"] if wheelhouse else []),
+                      after=["readme", "folders"])
+    _confirm(program_path, interactive)
+    pipeline.run()
+
+
+def plan_program_only(program_name: str,
+                      chosen_modules: dict[str, str],
+                      output_root: str = None,
+                      update: bool = False
+                     ) -> dict:
+    """
+    Work out everything make_program would do, with byte counts and estimated times, without touching disk.
+    Nothing is cloned, fetched or exported, so GitHub modules that haven't been exported before
+    are listed without their files. See utils/estimate_plan.py
 
+    Returns:
+        The estimate. Print it with format_estimate.
+    """
+    output_root = output_root or OUTPUT_FOLDER
+    program_path = os.path.join(output_root, program_name)
 
+    pull = PullRemoteModulesFromGithub(chosen_modules, program_path)
+    remote_modules = pull.find_exports()
+    exports = {
+        module_name: remote["export_path"] for module_name, remote in remote_modules.items() if remote["export_path"]
+    }
+    plan = plan_program(_get_module_sources(chosen_modules, exports))
+    return estimate_plan(plan, program_path, remote_modules, update=update)
+
+
+def _get_module_sources(chosen_modules: dict[str, str], exports: dict[str, str]) -> dict[str, str]:
+    """Get the local folder of every module: on-disk modules as they are, GitHub modules from their exports."""
+    module_sources = {
+        module_name: module_path for module_name, module_path in chosen_modules.items()
+        if not str(module_path).startswith(("http://", "https://"))
+    }
+    module_sources.update(exports)
+    return module_sources
+
+
+def build_program_step_by_step(program_name: str,
+                               chosen_modules: dict[str, str],
+                               program_path: str,
+                               interactive: bool = True,
+                               link_files: bool = False,
+                               instrumentation: Instrumentation = None,
+                               content_store: ContentStore = None,
+                               wheelhouse: bool = False
+                              ) -> None:
+    """
+    Run Steps 4-11: copy every module into the program directory, then rearrange it.
+    Steps run as a pipeline, so copying the on-disk modules and pulling the GitHub ones overlap.
+    See utils/pipeline.py
+    """
+    # Every requirements.txt is found while the modules are copied and pulled, rather than by searching the program.
+    requirements_merger = RequirementsMerger()
+    # NOTE: Ignore .git and .gitignore files.
+    copy = CopyOnDiskModulesToProgramDirectory(chosen_modules, program_path, content_store=content_store,
+                                               link_files=link_files, requirements_merger=requirements_merger)
+    pull = PullRemoteModulesFromGithub(chosen_modules, program_path, requirements_merger=requirements_merger)
     these_files = ["main", "gitignore", "start", "install"]
-    next_step("Step 8. Unpack these folders into the program directory, then delete the folders")
-    unpack_then_delete(these_files, program_path)
 
+    pipeline = Pipeline(instrumentation=instrumentation, name=program_name)
+    pipeline.add_step("copy", _announce(
+        "Step 4. Copy the on-disk modules to the program directory.", copy.modules_to_program_directory
+    ))
+    # TODO This function works as intended, but throws [WinError 5] Access is denied.
+    pipeline.add_step("pull", _announce(
+        "Step 5. Pull the requested modules from GitHub or disk.", pull.remote_modules_from_github
+    ))
+    pipeline.add_step("requirements", _announce(
+        "Step 6. Concatenate requirements.txt files.",
+        lambda: concatenate_requirements(program_path, requirements_merger=requirements_merger)
+    ), after=["copy", "pull"])
+    pipeline.add_step("utils_shared", _announce(
+        "Step 7. Unpack the 'utils.shared' files.", lambda: unpack_utils_shared(chosen_modules, program_path)
+    ), after=["requirements"])
+    pipeline.add_step("unpack", _announce(
+        "Step 8. Unpack these folders into the program directory, then delete the folders",
+        lambda: unpack_then_delete(these_files, program_path)
+    ), after=["utils_shared"])
+    pipeline.add_step("readme", _announce(
+        "Step 9. Create a README.md file.",
+        lambda requirements: create_readme(program_name, program_path, requirements)
+    ), inputs=["requirements"])
+    pipeline.add_step("underscores", _announce(
+        "Step 10. Remove underscores from all file names in the main folder.", lambda: remove_underscores(program_path)
+    ), after=["unpack"])
+    pipeline.add_step("folders", _announce(
+        "Step 11. Create debug, input, and output folders.", lambda: create_debug_input_and_output_folders(program_path)
+    ))
+    if wheelhouse:
+        pipeline.add_step("offline_install", _announce(
+            "Step 12. Add wheels for the requirements from the wheelhouse, with offline install scripts.",
+            lambda: add_offline_install(program_path)
+        ), after=["requirements", "underscores"])
+    # Record what was generated, so the program can be updated later without losing edits.
+    pipeline.add_step("manifest", lambda: write_build_manifest(
+        program_path, program_name, chosen_modules, module_commits=pull.commits
+    ), after=["readme", "underscores", "folders"] + (["offline_install"] if wheelhouse else []))
+    _confirm(program_path, interactive)
+    pipeline.run()
+
+
+def _announce(message: str, function: Callable) -> Callable:
+    """Wrap a pipeline step, so it's announced with next_step when it starts."""
+    def step(**kwargs):
+        next_step(message)
+        return function(**kwargs)
+    return step
+
+
+def _confirm(program_path: str, interactive: bool) -> None:
+    """
+    Ask before the pipeline starts writing to the program directory.
+    Steps run in worker threads, several at a time, so they can't stop for input() themselves.
+    """
+    if interactive:
+        print(f"The next steps write the program to {program_path}.")
+        next_step("Start writing the program.", stop=True)
+
+
+def main_from_manifest(manifest_path: str,
+                       link_files: bool = False,
+                       update: bool = False,
+                       step_by_step: bool = False,
+                       plan_only: bool = False,
+                       report_path: str = None,
+                       wheelhouse: bool = False,
+                       venv_cache: bool = False
+                      ) -> dict[str, str|dict|Exception]:
+    """
+    Make every program listed in a manifest file, without prompting.
+    See utils/load_manifest.py for the manifest format.
 
-    next_step("Step 9. Create a README.md file.")
-    create_readme(program_name, program_path, all_requirements)
-
-
-    next_step("Step 10. Remove underscores from all file names in the main folder.")
-    remove_underscores(program_path)
-
+    A program that fails is logged and skipped, so one bad entry doesn't stop the batch.
+    If report_path is given, every program's steps are written to one instrumentation report there.
 
-    next_step("Step 11. Create debug, input, and output folders.")
-    create_debug_input_and_output_folders(program_path)
+    Returns:
+        A dictionary mapping each program name to its path (or its estimate, if plan_only),
+        or to the exception if it failed.
+    """
+    programs = load_manifest(manifest_path, default_output_root=OUTPUT_FOLDER)
+
+    # Scanning the module folders is the same for every program, so only do it once.
+    choose = ChooseModule(always_include=ALWAYS_INCLUDE)
+
+    instrumentation = Instrumentation() if report_path and not plan_only else None
+    results = {}
+    failed = 0
+    for idx, program in enumerate(programs, start=1):
+        logger.info(f"Making program {idx}/{len(programs)}: '{program['name']}'")
+        try:
+            chosen_modules = choose.modules(program["modules"])
+            if plan_only:
+                results[program["name"]] = plan_program_only(
+                    program["name"], chosen_modules, output_root=program["output_root"], update=update
+                )
+                print(format_estimate(results[program["name"]]))
+                continue
+            results[program["name"]] = make_program(
+                program["name"], chosen_modules, output_root=program["output_root"],
+                interactive=False, link_files=link_files, update=update, step_by_step=step_by_step,
+                instrumentation=instrumentation, wheelhouse=wheelhouse, venv_cache=venv_cache
+            )
+        except Exception as e:
+            failed += 1
+            results[program["name"]] = e
+            logger.error(f"Could not make program '{program['name']}': {e}")
+
+    if plan_only:
+        estimates = [result for result in results.values() if isinstance(result, dict)]
+        print(f"Batch total: {sum(estimate['files'] for estimate in estimates)} files, "
+              f"{format_bytes(sum(estimate['bytes'] for estimate in estimates))}, "
+              f"about {sum(estimate['seconds'] for estimate in estimates):.2f}s")
+    if instrumentation is not None:
+        instrumentation.write_report(report_path)
+    logger.info(f"{'Planned' if plan_only else 'Made'} {len(programs) - failed}/{len(programs)} programs from {manifest_path}")
+    return results
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the base for a program from custom modules.")
+    parser.add_argument("--manifest", help="YAML or JSON file listing programs to make without prompting.")
+    parser.add_argument("--link-files", action="store_true",
+                        help="Hardlink module files from the content store to save disk space. Hardlinked files are read-only.")
+    parser.add_argument("--update", action="store_true",
+                        help="If a program already exists, update it in place from its modules, keeping your edits.")
+    parser.add_argument("--step-by-step", action="store_true",
+                        help="Copy the modules into the program, then rearrange them, instead of writing each file once.")
+    parser.add_argument("--plan", action="store_true",
+                        help="Print every file operation the build would perform, with sizes and time estimates, without running it.")
+    parser.add_argument("--report", nargs="?", const=os.path.join(OUTPUT_FOLDER, "build_report.json"), metavar="PATH",
+                        help="Write each step's wall/CPU time, files touched, bytes read/written and syscall counts to a JSON file. "
+                             "Defaults to build_report.json in the output folder.")
+    parser.add_argument("--wheelhouse", action="store_true",
+                        help="Put wheels for the program's requirements in it from a shared wheelhouse, downloading each wheel once, "
+                             "with install_offline.sh/.bat scripts that install them without the network.")
+    parser.add_argument("--prune-store", action="store_true",
+                        help="Afterwards, remove files from the content store that no module has any more, e.g. old versions.")
+    parser.add_argument("--venv-cache", action="store_true",
+                        help="Give the program a venv with its requirements installed, hardlink-cloned from a cached venv "
+                             "for the same requirements, so it's ready to run without installing anything.")
+    args = parser.parse_args()
     try:
-        main()
+        if args.manifest:
+            results = main_from_manifest(args.manifest, link_files=args.link_files,
+                                         update=args.update, step_by_step=args.step_by_step, plan_only=args.plan,
+                                         report_path=args.report, wheelhouse=args.wheelhouse, venv_cache=args.venv_cache)
+        else:
+            main(link_files=args.link_files, update=args.update, step_by_step=args.step_by_step, plan_only=args.plan,
+                 report_path=args.report, wheelhouse=args.wheelhouse, venv_cache=args.venv_cache)
+            results = {}
+        if args.prune_store and not args.plan:
+            pruned = ContentStore.shared().prune()
+            print(f"Pruned {pruned['objects']} files ({format_bytes(pruned['bytes'])}) from the content store.")
+        if any(isinstance(result, Exception) for result in results.values()):
+            sys.exit(1)
+    except FileExistsError as e:
+        print(f"Error: {e}. Exiting...")
+        sys.exit(1)
     except KeyboardInterrupt:
         print("\nProgram stopped.")
\ No newline at end of file
@@ -1,5 +1,4 @@
 import os
-from pathlib import Path
 from typing import Optional
 import yaml
 
@@ -9,6 +8,11 @@ from logger.logger import Logger
 logger = Logger(logger_name=__name__)
 
 
+from utils.module_catalog import load_module_catalog
+from utils.module_graph import get_module_dependencies, resolve_dependencies
+from utils.module_search import ModuleSearchIndex
+
+
 # class ChooseModule:
 
 #     YAML_PATH: str = os.path.join(PROJECT_ROOT, "github_urls_for_modules.yaml")
@@ -147,9 +151,11 @@ class ChooseModule:
 
 
     def __init__(self, always_include: Optional[list[str]] = None) -> None:
-        self.yaml_path: Path = Path(PROJECT_ROOT) / "github_urls_for_modules.yaml"
         self.always_include: list[str] = [module.lower() for module in (always_include or [])]
-        self.top_level_dir: list[str] = os.listdir(CUSTOM_MODULES_FOLDER)
+
+        # Only rescans the module folders and YAML file if they changed since the last run.
+        self.catalog: dict = load_module_catalog(CUSTOM_MODULES_FOLDER)
+        self.top_level_dir: list[str] = self.catalog["top_level"]
         
         # Load GitHub URLs
         self.github_urls: dict[str, str] = self._load_github_urls()
@@ -169,21 +175,26 @@ class ChooseModule:
         }
         logger.debug(f"self.available_modules:\n{self.available_modules}", f=True)
 
+        # What each module needs. See utils/module_graph.py
+        all_dependencies = get_module_dependencies(self.catalog)
+        self.dependencies: dict[str, list[str]] = {
+            module: all_dependencies.get(module, []) for module in self.available_modules
+        }
+
+        # For prefix completion, typo suggestions and '?' searches in the prompt.
+        self.search_index: ModuleSearchIndex = ModuleSearchIndex(self._describe_available_modules())
+
 
     def _load_github_urls(self) -> dict[str, str]:
         """Load and validate GitHub URLs from YAML file."""
-        try:
-            with open(self.yaml_path) as f:
-                urls = yaml.safe_load(f)
-            
-            if not isinstance(urls, dict):
-                raise ValueError("YAML file must contain a dictionary")
-            
-            return urls
-        except Exception as e:
-            logger.warning(f"Could not import URL yaml file: {e}")
+        github = self.catalog["github"]
+        if github["error"] is not None:
+            logger.warning(f"Could not import URL yaml file: {github['error']}")
             return {"_default": "_option"}
 
+        # NOTE Clone options (depth, filter, paths) are read by PullRemoteModulesFromGithub.
+        return {module_name: options["url"] for module_name, options in github["modules"].items()}
+
 
     def _get_modules_that_are_available_on_github(self) -> dict[str, str]:
         """Create a dictionary of modules that are available on github."""
@@ -192,24 +203,12 @@ class ChooseModule:
 
     def _get_modules_that_are_available_on_disk(self) -> dict[str, str]:
         """Get all valid module folders from disk."""
-        if not os.path.isdir(CUSTOM_MODULES_FOLDER):
-            logger.warning(f"Custom modules folder not found: {CUSTOM_MODULES_FOLDER}")
-            return {}
-
         # Get module folders excluding those available on GitHub
-        base_path = Path(CUSTOM_MODULES_FOLDER)
         subfolders = {}
-
-        for dir in base_path.iterdir():
-            for d in dir.iterdir():
-                if not d.is_dir():
-                    continue
-
-                name = d.name.lower()
-                if name in self.modules_available_on_github or name in self.top_level_dir:
-                    continue
-
-                subfolders[d.name] = str(d)
+        for name, entry in self.catalog["disk"].items():
+            if name.lower() in self.modules_available_on_github or name.lower() in self.top_level_dir:
+                continue
+            subfolders[name] = entry["path"]
 
         # Remove OS-specific folders
         if os.name == 'nt':
@@ -223,8 +222,48 @@ class ChooseModule:
         return subfolders
 
 
-    def modules(self) -> dict[str, str]:
-        """Let user choose which modules to use and include required ones."""
+    def _describe_available_modules(self) -> dict[str, dict]:
+        """Get each available module's description and tags (its category, and 'disk' or 'github') for searching."""
+        disk = {name.lower(): entry for name, entry in self.catalog["disk"].items()}
+        descriptions = {}
+        for module in self.available_modules:
+            if module in self.modules_available_on_github:
+                descriptions[module] = {"description": "", "tags": ["github"]}
+            else:
+                entry = disk.get(module, {})
+                descriptions[module] = {"description": entry.get("description", ""),
+                                        "tags": ["disk", entry.get("category", "")]}
+        return descriptions
+
+
+    def modules(self, chosen_modules: Optional[list[str]] = None) -> dict[str, str]:
+        """
+        Let user choose which modules to use and include required ones.
+
+        In the prompt, a unique prefix of a module name is enough, and Tab completes names
+        (if readline is available). A typo doesn't throw away the rest of the input:
+        the valid names are kept, and the closest matches are suggested for the rest.
+        Entering '?' and a query searches names, descriptions and tags, e.g. '?tag:github llm'.
+
+        Args:
+            chosen_modules: Module names picked ahead of time (e.g. from a batch manifest).
+                If given, the user is not prompted.
+
+        Returns:
+            Dictionary mapping module names to their paths/URLs, including every module they depend on,
+            in an order where each module comes after its dependencies.
+
+        Raises:
+            ValueError: If any pre-chosen module (or one of its dependencies) is not available,
+                or the dependencies have a cycle.
+        """
+        if chosen_modules is not None:
+            chosen_modules = [module.strip().lower() for module in chosen_modules]
+            invalid_modules = [module for module in chosen_modules if module not in self.available_modules]
+            if invalid_modules:
+                raise ValueError(f"Invalid module(s): {', '.join(self._suggest(module) for module in invalid_modules)}")
+            return self._select(chosen_modules)
+
         # Display available modules
         available_modules = sorted(
             module for module in self.available_modules
@@ -232,34 +271,102 @@ class ChooseModule:
         )
 
         separator = "*" * 20
-        module_list = "\n".join(f"- {module}" for module in available_modules)
+        descriptions = {name.lower(): entry["description"] for name, entry in self.catalog["disk"].items()}
+        module_list = "\n".join(
+            f"- {module}: {descriptions[module]}" if descriptions.get(module) else f"- {module}"
+            for module in available_modules
+        )
         always_include_list = "\n".join(f"- {module}" for module in self.always_include)
         print(f"{separator}\nAvailable Modules:\n{module_list}\n{separator}")
         print(f"Always Included:\n{always_include_list}\n{separator}")
 
         # Get and validate user input
+        self._enable_tab_completion()
+        chosen_modules = []
+        prompt = "\nEnter the python modules you want to pull (comma-separated, '?' to search): "
         while True:
-            chosen_input = input("\nEnter the python modules you want to pull (comma-separated): ").strip()
-            if not chosen_input:
+            chosen_input = input(prompt).strip()
+            if chosen_input.startswith("?"):
+                self._print_search_results(chosen_input[1:])
+                continue
+            if not chosen_input and not chosen_modules:
                 print("No modules selected. Please try again.")
                 continue
 
-            chosen_modules = [module.strip().lower() for module in chosen_input.split(',')]
+            invalid_modules = []
+            for name in chosen_input.split(','):
+                name = name.strip().lower()
+                if not name:
+                    continue
+                module = self._complete(name)
+                if module is None:
+                    invalid_modules.append(name)
+                elif module not in chosen_modules:
+                    chosen_modules.append(module)
             logger.debug(f"chosen_modules\n{chosen_modules}",f=True)
-            invalid_modules = [module for module in chosen_modules if module not in self.available_modules]
-            
+
             if invalid_modules:
-                print(f"Invalid module(s): {', '.join(invalid_modules)}\nPlease try again.")
+                print(f"Invalid module(s): {', '.join(self._suggest(module) for module in invalid_modules)}")
+                if chosen_modules:
+                    print(f"Kept: {', '.join(chosen_modules)}")
+                prompt = "\nEnter the missing modules, or press Enter to continue without them: "
                 continue
-            
-            break
 
-        # Create final module selection including required modules
-        selected_modules = {
-            module: self.available_modules[module]
-            for module in set(chosen_modules + self.always_include)
-        }
+            try:
+                return self._select(chosen_modules)
+            except ValueError as e:
+                chosen_modules = []
+                prompt = "\nEnter the python modules you want to pull (comma-separated, '?' to search): "
+                print(f"{e}\nPlease try again.")
+
+
+    def _complete(self, name: str) -> Optional[str]:
+        """Get the module a name or unique prefix refers to, or None."""
+        if name in self.available_modules:
+            return name
+        matches = self.search_index.complete(name)
+        return matches[0] if len(matches) == 1 else None
+
+
+    def _suggest(self, name: str) -> str:
+        """e.g. 'dtabase' -> "dtabase (did you mean database?)" """
+        suggestions = [module for module, _ in self.search_index.search(name, limit=3)]
+        return f"{name} (did you mean {' or '.join(suggestions)}?)" if suggestions else name
+
+
+    def _print_search_results(self, query: str) -> None:
+        results = self.search_index.search(query)
+        if not results:
+            print("No matching modules.")
+            return
+        for module, _ in results:
+            description = self.search_index.modules[module]["description"]
+            print(f"- {module}: {description}" if description else f"- {module}")
+
+
+    def _enable_tab_completion(self) -> None:
+        try:
+            import readline
+        except ImportError: # Windows
+            return
+
+        def completer(text: str, state: int) -> Optional[str]:
+            matches = self.search_index.complete(text.strip())
+            return matches[state] if state < len(matches) else None
+
+        readline.set_completer(completer)
+        readline.set_completer_delims(", ")
+        readline.parse_and_bind("tab: complete")
+
+
+    def _select(self, chosen_modules: list[str]) -> dict[str, str]:
+        """Create final module selection including required modules and everything they depend on."""
+        modules = resolve_dependencies(chosen_modules + self.always_include, self.dependencies)
+        added = [module for module in modules if module not in chosen_modules and module not in self.always_include]
+        if added:
+            logger.info(f"Also including modules the chosen ones depend on: {', '.join(added)}")
+
+        selected_modules = {module: self.available_modules[module] for module in modules}
 
         logger.debug(f"Selected modules: {selected_modules}")
         return selected_modules
-
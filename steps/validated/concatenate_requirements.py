@@ -1,19 +1,51 @@
 import os
 import glob
 
-def concatenate_requirements(program_path: str) -> set:
+from utils.resolve_requirements import RequirementsMerger
+
+def concatenate_requirements(program_path: str,
+                             requirements_files: list[str] = None,
+                             requirements_merger: RequirementsMerger = None
+                            ) -> set:
     """
     Concatenate requirements.txt files from all the submodules.
+    Each package is listed once, with the intersection of what every module asks for,
+    so pip doesn't have to backtrack through them. See utils/resolve_requirements.py
+
+    Args:
+        program_path: The program directory to write the combined requirements.txt to.
+        requirements_files: The requirements.txt files to combine.
+            Defaults to every requirements.txt in the program directory.
+        requirements_merger: The requirements.txt files found while the modules were copied into the program,
+            so it doesn't have to be searched for them. Used instead of requirements_files.
+
+    Returns:
+        The combined requirements.
+
+    Raises:
+        ValueError: If modules ask for versions of a package that can't all be met,
+            or a requirements file includes constraints with a relative '-c'.
     """
-    requirements_files = glob.glob(os.path.join(program_path, "**", "requirements.txt"), recursive=True)
-    all_requirements = set()
-    for req_file in requirements_files:
+    if requirements_merger is None:
+        if requirements_files is None:
+            requirements_files = glob.glob(os.path.join(program_path, "**", "requirements.txt"), recursive=True)
+        requirements_merger = RequirementsMerger()
+        for req_file in requirements_files:
+            requirements_merger.add_file(req_file)
+    for req_file in requirements_merger.files:
         print(f"Found requirements.txt for {req_file}")
-        with open(req_file, 'r') as f:
-            all_requirements.update(f.read().splitlines())
+    resolved = requirements_merger.resolve()
+
+    if resolved["conflicts"]:
+        conflicts = "\n".join(
+            f"- {conflict['name']}: {conflict['reason']} ("
+            + ", ".join(f"{line} in {path}" for path, line in conflict["specifiers"]) + ")"
+            for conflict in resolved["conflicts"]
+        )
+        raise ValueError(f"The modules' requirements conflict:\n{conflicts}")
 
     with open(os.path.join(program_path, "requirements.txt"), 'w') as f:
-        for req in sorted(all_requirements):
+        for req in resolved["other_lines"] + resolved["requirements"]:
             f.write(f"{req}\n")
     print("Made requirements.txt for main program")
-    return all_requirements
+    return set(resolved["requirements"])
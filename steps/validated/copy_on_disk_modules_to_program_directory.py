@@ -1,19 +1,51 @@
+from functools import partial
 from pathlib import Path
-import shutil
+from typing import Optional
 
 
 from logger.logger import Logger
 logger = Logger(logger_name=__name__)
 
 
+from utils.content_store import ContentStore
+from utils.copy_trees import MAX_COPY_WORKERS, copy_trees
+from utils.resolve_requirements import RequirementsMerger
+
+
 class CopyOnDiskModulesToProgramDirectory:
+    """
+    Copy the on-disk modules into the program directory.
+
+    Files go through a content-addressed store, so copying the same modules into many programs
+    only stores each file once and reflinks (or, if allowed, hardlinks) it into each program.
+    """
 
     def __init__(self, 
                  chosen_modules: dict[str, str], 
-                 program_path: str
+                 program_path: str,
+                 content_store: Optional[ContentStore] = None,
+                 link_files: bool = False,
+                 max_workers: int = MAX_COPY_WORKERS,
+                 requirements_merger: Optional[RequirementsMerger] = None
                 ) -> None:
+        """
+        Args:
+            chosen_modules: Dictionary mapping module names to their paths/URLs.
+            program_path: Destination directory where modules should be copied.
+            content_store: The store to copy files through. Defaults to the shared store.
+            link_files: If True, hardlink files from the store when reflinks aren't supported.
+                Hardlinked files are read-only, since editing one would edit the stored copy.
+            max_workers: How many files to copy at the same time.
+            requirements_merger: If given, every requirements.txt is added to it as it's copied.
+        """
         self.chosen_modules = self._validate_paths(chosen_modules)
         self.program_path = self._validate_paths(program_path)
+        self.content_store = content_store or ContentStore.shared()
+        link_modes = ("reflink", "hardlink", "copy") if link_files else ("reflink", "copy")
+        self.copy_function = partial(self.content_store.copy_file, link_modes=link_modes)
+        if requirements_merger is not None:
+            self.copy_function = requirements_merger.watch(self.copy_function)
+        self.max_workers = max_workers
 
 
     def _validate_path_helper(self, path: str) -> Path:
@@ -58,6 +90,7 @@ class CopyOnDiskModulesToProgramDirectory:
     def modules_to_program_directory(self) -> None:
         """
         Copy local modules to the program path, skipping any modules that are URLs.
+        Every module is copied at the same time, by a pool of threads. See utils/copy_trees.py
         
         Args:
             chosen_modules: dictionary mapping module names to their paths/URLs
@@ -67,32 +100,33 @@ class CopyOnDiskModulesToProgramDirectory:
             OSError: If there are permission issues or I/O errors during copying
             ValueError: If the program path doesn't exist or isn't a directory
         """
+        trees = {}
         for module_name, module_path in self.chosen_modules.items():
-            try:
-                # Get the destination path.
-                destination_path: Path = self.program_path / module_name
-
-                # Throw an error if it already exists.
-                if destination_path.exists():
-                    logger.debug(f"Module already exists at: {destination_path}")
-                    raise FileExistsError(f"Module already exists at: {destination_path}")
-                
-                # Copy the module directory.
-                logger.info(f"Copying module '{module_name}' from {module_path} to {destination_path}")
-                shutil.copytree(
-                    module_path,
-                    destination_path,
-                    symlinks=True,
-                    ignore=shutil.ignore_patterns('*.pyc', '__pycache__', '.git', '.github', '.pytest_cache'),
-                    dirs_exist_ok=True
-                )
-                logger.info(f"Successfully copied module: {module_name}")
-
-            except PermissionError as e:
-                logger.error(f"Permission denied while copying module '{module_name}': {e}")
-                raise OSError(f"Permission denied while copying module '{module_name}'") from e
-
-            except OSError as e:
-                logger.error(f"Error copying module '{module_name}': {e}")
-                raise OSError(f"Failed to copy module '{module_name}'") from e
-
+            # Get the destination path.
+            destination_path: Path = self.program_path / module_name
+
+            # Throw an error if it already exists.
+            if destination_path.exists():
+                logger.debug(f"Module already exists at: {destination_path}")
+                raise FileExistsError(f"Module already exists at: {destination_path}")
+
+            logger.info(f"Copying module '{module_name}' from {module_path} to {destination_path}")
+            trees[module_name] = (str(module_path), str(destination_path))
+
+        try:
+            stats = copy_trees(trees, copy_function=self.copy_function, max_workers=self.max_workers)
+            for module_name, module_stats in stats.items():
+                logger.info(f"Successfully copied module: {module_name} "
+                            f"({module_stats['files']} files, {module_stats['bytes']} bytes)")
+
+        except PermissionError as e:
+            logger.error(f"Permission denied while copying modules: {e}")
+            raise OSError(f"Permission denied while copying modules: {e}") from e
+
+        except OSError as e:
+            logger.error(f"Error copying modules: {e}")
+            raise OSError(f"Failed to copy modules: {e}") from e
+
+        finally:
+            # Remember the hashes, so the next program doesn't rehash the same files.
+            self.content_store.save_index()
@@ -1,13 +1,76 @@
+from contextlib import contextmanager
 import os
-import sys
+import shutil
+from typing import Iterator
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.shared.make_id import make_id
+
 
 def make_program_directory(program_name: str, preferred_path: str = None) -> str:
-    home_dir = os.path.expanduser("~")
-    program_path = os.path.join(home_dir, program_name) if not preferred_path else os.path.join(preferred_path, program_name)
+    """
+    Make the program directory, either in the home directory or the preferred path.
+
+    Raises:
+        FileExistsError: If a program with that name already exists.
+            Callers decide whether that ends the run (interactive mode)
+            or just this program (batch mode).
+    """
+    program_path = _get_program_path(program_name, preferred_path)
     if not os.path.exists(program_path):
         os.makedirs(program_path, exist_ok=True)
         print(f"Made program directory at {program_path}")
         return program_path
     else:
-        print("Error: Program with that name already exists. Exiting...")
-        sys.exit(1)
+        raise FileExistsError(f"Program with that name already exists: {program_path}")
+
+
+@contextmanager
+def staged_program_directory(program_name: str, preferred_path: str = None) -> Iterator[str]:
+    """
+    Make an empty staging directory next to where the program will go, and publish it there
+    with one atomic rename once the block finishes. If the block fails, the staging directory is removed,
+    so a failed build never leaves a half-made program behind.
+
+    The staging directory is hidden and uniquely named, so builds of different programs
+    (or of the same program, from different processes) never see each other's partial state.
+
+    Example:
+    >>> with staged_program_directory("my_program", "/home/user/programs") as staging_path:
+    >>>     build_program("my_program", chosen_modules, staging_path)
+    >>> # /home/user/programs/my_program now exists, complete.
+
+    Raises:
+        FileExistsError: If a program with that name already exists, either before the build starts
+            or by the time it finishes (e.g. another process made it first).
+    """
+    program_path = _get_program_path(program_name, preferred_path)
+    if os.path.exists(program_path):
+        raise FileExistsError(f"Program with that name already exists: {program_path}")
+
+    # Same parent directory, so the final rename never crosses filesystems.
+    parent_path = os.path.dirname(program_path)
+    os.makedirs(parent_path, exist_ok=True)
+    staging_path = os.path.join(parent_path, f".{program_name}.staging-{make_id()}")
+    os.mkdir(staging_path)
+    logger.info(f"Building {program_name} in staging directory {staging_path}")
+
+    try:
+        yield staging_path
+        if os.path.exists(program_path):
+            raise FileExistsError(f"Program with that name was made while this one was building: {program_path}")
+        os.replace(staging_path, program_path)
+    except BaseException:
+        shutil.rmtree(staging_path, ignore_errors=True)
+        logger.info(f"Removed staging directory {staging_path}")
+        raise
+    print(f"Made program directory at {program_path}")
+
+
+def _get_program_path(program_name: str, preferred_path: str = None) -> str:
+    home_dir = os.path.expanduser("~")
+    return os.path.join(home_dir, program_name) if not preferred_path else os.path.join(preferred_path, program_name)
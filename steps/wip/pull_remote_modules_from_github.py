@@ -16,12 +16,14 @@ This module relies on configuration from the project's config module and uses
 the custom logger for logging operations.
 """
 
+import asyncio
 import os
 from pathlib import Path
 import shutil
-import subprocess
-import time
+import tarfile
 import tempfile
+import threading
+from typing import Callable, Optional
 
 
 from config.config import PROJECT_ROOT, PULLED_REPOS_PATH
@@ -29,39 +31,229 @@ from logger.logger import Logger
 logger = Logger(logger_name=__name__)
 
 
+from utils.fast_copy_file import fast_copy2
+from utils.instrumentation import run_in_step_thread
+from utils.load_github_urls import load_github_urls
+from utils.module_catalog import load_module_catalog
+from utils.module_graph import get_module_dependencies, topological_waves
+from utils.resolve_requirements import RequirementsMerger
+from utils.shared.limiters.Limiter import Limiter
+from utils.shared.make_sha256_hash import make_sha256_hash
+from utils.shared.sanitize_filename import sanitize_filename
+
+
+MAX_CONCURRENT_CLONES = 4
+CLONE_TIMEOUT_IN_SECONDS = 300
+
+
 class PullRemoteModulesFromGithub:
     """
     A utility class to manage Git operations for pulling modules from GitHub.
+
+    Modules are cloned concurrently, in waves: a module is only pulled once the modules it depends on
+    have been, and is skipped if one of them failed. The number of clones in flight is capped by a Limiter,
+    and each clone is killed if it runs longer than the timeout.
+
+    Each repo is kept as a bare mirror in PULLED_REPOS_PATH that is only fetched incrementally,
+    and each commit's files are exported from the mirror once, to an export cache next to the mirrors,
+    then copied into the program directory (without .git).
     """
-    def __init__(self, chosen_modules: dict[str, str], program_path: str):
+    # Shared by every instance, so a batch of programs only fetches each mirror once.
+    _fetched_mirrors: set[str] = set()
+    _mirror_locks: dict[str, threading.Lock] = {}
+    _mirror_locks_lock = threading.Lock()
+
+    def __init__(self,
+                 chosen_modules: dict[str, str],
+                 program_path: str,
+                 max_concurrent_clones: int = MAX_CONCURRENT_CLONES,
+                 clone_timeout: float = CLONE_TIMEOUT_IN_SECONDS,
+                 mirror_folder: str = PULLED_REPOS_PATH,
+                 clone_options: Optional[dict[str, dict]] = None,
+                 dependencies: Optional[dict[str, list[str]]] = None,
+                 requirements_merger: Optional[RequirementsMerger] = None,
+                 clones_per_second: Optional[float] = None
+                ):
         """
         Initialize the GitModulePuller.
         
         Args:
-            base_path: The base directory where modules will be cloned
-            github_urls: Dictionary mapping module names to their GitHub URLs
+            chosen_modules: Dictionary mapping module names to their paths/URLs.
+                Only the modules with GitHub URLs are pulled.
+            program_path: The program directory where modules will be cloned
+            max_concurrent_clones: How many clones can run at the same time.
+            clone_timeout: Seconds to wait for a single git command before killing it.
+            mirror_folder: Where the bare mirrors of the GitHub repos are cached.
+            clone_options: Dictionary mapping module names to their clone options (depth, filter, paths).
+                Defaults to the options in the URL YAML file. See utils/load_github_urls.py
+            dependencies: Dictionary mapping module names to the modules they depend on.
+                Defaults to the dependencies in the module catalog. See utils/module_graph.py
+            requirements_merger: If given, every requirements.txt is added to it as it's copied into the program.
+            clones_per_second: If given, most modules started per second, e.g. to stay under GitHub's rate limits.
         """
         self.chosen_modules: dict[str, str] = self._remove_on_disk_custom_modules(chosen_modules)
         # NOTE We don't need to validate program_path since it was already validated in the previous step.
         self.program_path: str = program_path 
         self.github_urls: dict = None
+        self.max_concurrent_clones: int = max(1, max_concurrent_clones)
+        self.clone_timeout: float = clone_timeout
+        self.clones_per_second: Optional[float] = clones_per_second
+        self.mirror_folder: str = mirror_folder
+        self.clone_options: dict[str, dict] = clone_options if clone_options is not None else self._load_clone_options()
+        self.dependencies: dict[str, list[str]] = dependencies if dependencies is not None else self._load_dependencies()
+        # Module name -> commit its files were exported from, for the build manifest.
+        self.commits: dict[str, str] = {}
+        self.copy_function: Callable = requirements_merger.watch(fast_copy2) if requirements_merger is not None else fast_copy2
 
 
-    def remote_modules_from_github(self) -> None:
+    def remote_modules_from_github(self) -> dict[str, tuple[bool, str]]:
+        """
+        Pull every chosen GitHub module into the program directory.
 
-        results = {}
-        for module_name in self.chosen_modules.keys():
-            # Try to pull the module from github and add it to the output dictionary.
-            try:
-                results[module_name] = self._pull_module(module_name) # -> tuple[bool, str, str]
-                logger.info(f"'{module_name}' module pulled successfully.")
-            except:
-                results[module_name] = (False, "Failed to pull module")
+        Returns:
+            Dictionary mapping module names to a tuple of (success boolean, status message)
+        """
+        if not self.chosen_modules:
+            logger.info("No GitHub modules chosen. Skipping...")
+            return {}
+
+        results = asyncio.run(self._pull_modules())
 
         # Print the results
-        for module_name, tup in results.items():
-            _, success, message = tup
+        for module_name, (success, message) in results.items():
             logger.info(f"{module_name}: {'Success' if success else 'Failed'} - {message}")
+        return results
+
+
+    def export_modules(self) -> dict[str, tuple[bool, str]]:
+        """
+        Export every chosen GitHub module to the export cache, without copying it into the program directory.
+        The single-pass build plans and writes the program straight from these. See utils/plan_program.py
+
+        Returns:
+            Dictionary mapping module names to a tuple of (success boolean, export path or error message)
+        """
+        if not self.chosen_modules:
+            logger.info("No GitHub modules chosen. Skipping...")
+            return {}
+
+        results = asyncio.run(self._pull_modules(self._export_module))
+        for module_name, (success, message) in results.items():
+            if not success:
+                logger.error(f"{module_name}: Failed - {message}")
+        return results
+
+
+    def find_exports(self) -> dict[str, dict]:
+        """
+        Look up what pulling each chosen GitHub module would do, without fetching, cloning or exporting anything.
+        Used by --plan. The commit is the mirror's current HEAD, so it may be behind the remote.
+
+        Returns:
+            Dictionary mapping module names to a dictionary with the module's 'url', 'mirror_path',
+            whether the mirror exists ('mirror_exists'), its 'commit' (None if there's no mirror),
+            and the cached 'export_path' for that commit (None if it hasn't been exported yet).
+        """
+        return asyncio.run(self._find_exports()) if self.chosen_modules else {}
+
+
+    async def _find_exports(self) -> dict[str, dict]:
+        exports = {}
+        for module_name, url in self.chosen_modules.items():
+            options = self.clone_options.get(module_name, {})
+            mirror_path = self._get_mirror_path(url, options.get("depth"), options.get("filter"))
+            export = {"url": url, "mirror_path": mirror_path, "mirror_exists": os.path.isdir(mirror_path),
+                      "commit": None, "export_path": None}
+            if export["mirror_exists"]:
+                success, message = await self._run_git_command(['git', '--git-dir', mirror_path, 'rev-parse', 'HEAD'])
+                if success:
+                    export["commit"] = message.strip()
+                    export_path = self._get_export_path(mirror_path, export["commit"], options.get("paths", []))
+                    export["export_path"] = export_path if os.path.isdir(export_path) else None
+            exports[module_name] = export
+        return exports
+
+
+    async def _pull_modules(self, pull_module: Optional[Callable] = None) -> dict[str, tuple[bool, str]]:
+        """Clone the modules one wave at a time, at most max_concurrent_clones at a time."""
+        pull_module = pull_module or self._pull_module
+        limiter = Limiter(semaphore=self.max_concurrent_clones, progress_bar=False, requests_per_second=self.clones_per_second)
+        waves, github_dependencies = self._get_waves()
+
+        results = {}
+        for wave in waves:
+            module_names = []
+            for module_name in wave:
+                failed = [dependency for dependency in github_dependencies[module_name] if not results[dependency][0]]
+                if failed:
+                    logger.error(f"Skipping '{module_name}', since {', '.join(failed)} could not be pulled.")
+                    results[module_name] = (False, f"Skipped, since {', '.join(failed)} could not be pulled")
+                    continue
+                module_names.append(module_name)
+
+            outputs = await asyncio.gather(
+                *[limiter.run_task_with_limit(pull_module(module_name)) for module_name in module_names],
+                return_exceptions=True
+            )
+            results.update(self._collect_results(module_names, outputs))
+        return results
+
+
+    def _collect_results(self, module_names: list[str], outputs: list) -> dict[str, tuple[bool, str]]:
+        results = {}
+        for module_name, output in zip(module_names, outputs):
+            # Try to pull the module from github and add it to the output dictionary.
+            if isinstance(output, BaseException):
+                logger.error(f"'{module_name}' module could not be pulled: {output}")
+                results[module_name] = (False, f"Failed to pull module: {output}")
+            else:
+                _, success, message = output
+                results[module_name] = (success, message)
+                if success:
+                    logger.info(f"'{module_name}' module pulled successfully.")
+        return results
+
+
+    def _get_waves(self) -> tuple[list[list[str]], dict[str, list[str]]]:
+        """
+        Group the GitHub modules into waves, where every module only depends on modules in earlier waves.
+        Dependencies through on-disk modules count, e.g. if GitHub module A needs on-disk module B,
+        which needs GitHub module C, then C is pulled before A.
+
+        Returns:
+            Tuple of (waves, dictionary mapping each GitHub module to the GitHub modules it needs)
+        """
+        github_dependencies = {}
+        for module_name in self.chosen_modules:
+            needed, pending = set(), list(self.dependencies.get(module_name, []))
+            while pending:
+                dependency = pending.pop()
+                if dependency not in needed:
+                    needed.add(dependency)
+                    pending.extend(self.dependencies.get(dependency, []))
+            github_dependencies[module_name] = sorted(needed.intersection(self.chosen_modules) - {module_name})
+
+        try:
+            return topological_waves(self.chosen_modules, github_dependencies), github_dependencies
+        except ValueError as e:
+            logger.warning(f"{e}. Pulling every module at once.")
+            return [list(self.chosen_modules)], {module_name: [] for module_name in self.chosen_modules}
+
+
+    def _load_dependencies(self) -> dict[str, list[str]]:
+        try:
+            return get_module_dependencies(load_module_catalog())
+        except Exception as e:
+            logger.warning(f"Could not load module dependencies, pulling every module at once: {e}")
+            return {}
+
+
+    def _load_clone_options(self) -> dict[str, dict]:
+        try:
+            return load_github_urls()
+        except Exception as e:
+            logger.warning(f"Could not load clone options, doing full clones: {e}")
+            return {}
 
 
     def _remove_on_disk_custom_modules(self, path: str|dict[str, str]) -> str|dict[str, Path]:
@@ -73,8 +265,8 @@ class PullRemoteModulesFromGithub:
         return github_modules
 
 
-    def _run_git_command(self, command: list, cwd: str = None, 
-                         max_attempts: int = 3, delay: int = 1) -> tuple[bool, str]:
+    async def _run_git_command(self, command: list, cwd: str = None, 
+                               max_attempts: int = 3, delay: int = 1) -> tuple[bool, str]:
         """
         Execute a git command and return the result.
         
@@ -87,63 +279,249 @@ class PullRemoteModulesFromGithub:
         """
         for attempt in range(max_attempts):
             try:
-                result = subprocess.run(
-                    command,
+                process = await asyncio.create_subprocess_exec(
+                    *command,
                     cwd=cwd,
-                    capture_output=True,
-                    text=True,
-                    check=True
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE
                 )
-                return True, result.stdout
             except PermissionError:
                 if attempt == max_attempts - 1:
                     raise
-                time.sleep(delay)
+                await asyncio.sleep(delay)
                 continue
-            except subprocess.CalledProcessError as e:
-                return False, f"Git command failed: {e.stderr}"
             except Exception as e:
                 return False, f"Error executing git command: {e}"
 
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=self.clone_timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return False, f"Git command timed out after {self.clone_timeout} seconds: {' '.join(command)}"
+
+            if process.returncode != 0:
+                return False, f"Git command failed: {stderr.decode(errors='replace')}"
+            return True, stdout.decode(errors='replace')
+
 
-    def _pull_module(self, module_name: str) -> tuple[bool, str, str]:
+    async def _pull_module(self, module_name: str) -> tuple[str, bool, str]:
         """
         Pull a specific module from GitHub.
-        Clone the repos from GitHub to a temporary directory,
-        then move it to the final destination if successful.
+        Export it from its mirror to the export cache, then copy it to a temporary directory
+        in the program directory, and move it to the final destination if successful.
 
         Args:
             module_name: Name of the module to pull
             
         Returns:
-            Tuple of (success boolean, status message)
+            Tuple of (module name, success boolean, status message)
         """
-        if module_name not in self.chosen_modules:
-            return False, f"Module {module_name} not found in configured GitHub URLs"
-
+        _, success, message = await self._export_module(module_name)
+        if not success:
+            return module_name, success, message
+        export_path = message
         final_module_path = os.path.join(self.program_path, module_name)
-        url = self.chosen_modules[module_name]
 
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
+        # Create a temporary directory next to the final location, so the move is a rename.
+        with tempfile.TemporaryDirectory(dir=self.program_path, ignore_cleanup_errors=True) as temp_dir:
             temp_module_path = os.path.join(temp_dir, module_name)
+            try:
+                await asyncio.to_thread(run_in_step_thread, shutil.copytree, export_path, temp_module_path, symlinks=True, copy_function=self.copy_function)
+                await asyncio.to_thread(self._move_to_final_location, temp_module_path, final_module_path)
+                logger.info(f"Successfully moved {module_name} to {final_module_path}")
+            except Exception as e:
+                success = False
+                message = f"Failed to move temporary directory to final location: {e}"
+                logger.error(message)
+            return module_name, success, message
+
+
+    async def _export_module(self, module_name: str) -> tuple[str, bool, str]:
+        """
+        Bring the module's mirror in PULLED_REPOS_PATH up to date, then export its files at HEAD
+        to the export cache (without .git). Exports are keyed by commit, so each one is only made once.
+
+        Args:
+            module_name: Name of the module to export
+
+        Returns:
+            Tuple of (module name, success boolean, export path or error message)
+        """
+        if module_name not in self.chosen_modules:
+            return module_name, False, f"Module {module_name} not found in configured GitHub URLs"
+        url = self.chosen_modules[module_name]
 
-            logger.info(f"Cloning {module_name} from {url} to temporary directory")
-            success, message = self._run_git_command(
-                ['git', 'clone', url, temp_module_path]
+        success, message = await self._update_mirror(module_name, url)
+        if not success:
+            return module_name, success, message
+        mirror_path = message
+
+        success, message = await self._run_git_command(['git', '--git-dir', mirror_path, 'rev-parse', 'HEAD'])
+        if not success:
+            return module_name, success, message
+        commit = message.strip()
+
+        # Only export the paths the program needs, if the module lists them.
+        paths = self.clone_options.get(module_name, {}).get("paths", [])
+        export_path = self._get_export_path(mirror_path, commit, paths)
+        if os.path.isdir(export_path):
+            logger.debug(f"{module_name} at {commit[:12]} already exported to {export_path}")
+            self.commits[module_name] = commit
+            return module_name, True, export_path
+
+        os.makedirs(os.path.dirname(export_path), exist_ok=True)
+        # Export next to the final location, then rename, so a half-finished export is never used.
+        temp_dir = tempfile.mkdtemp(dir=os.path.dirname(export_path), suffix=".partial")
+        try:
+            archive_path = os.path.join(temp_dir, f"{module_name}.tar")
+            temp_export_path = os.path.join(temp_dir, module_name)
+
+            logger.info(f"Exporting {module_name} at {commit[:12]} from mirror {mirror_path} to {export_path}")
+            success, message = await self._run_git_command(
+                ['git', '--git-dir', mirror_path, 'archive', '--format=tar', f'--output={archive_path}', commit, '--', *paths]
             )
-            if success:
-                # If cloning was successful, move the temporary directory to the final location
+            if not success:
+                return module_name, success, message
+            try:
+                await asyncio.to_thread(run_in_step_thread, self._extract_archive, archive_path, temp_export_path)
+                os.replace(temp_export_path, export_path)
+            except OSError as e:
+                # Another process finished the same export first. Use theirs.
+                if not os.path.isdir(export_path):
+                    return module_name, False, f"Failed to export {module_name}: {e}"
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        self.commits[module_name] = commit
+        return module_name, True, export_path
+
+
+    def _get_mirror_path(self, url: str, depth: Optional[int] = None, filter_spec: Optional[str] = None) -> str:
+        """
+        Get the path of the bare mirror for a URL, e.g.
+        'https://github.com/the-ride-never-ends/api' -> 'pulled_repos/api-1a2b3c4d5e6f7a8b.git'
+        The hash keeps two repos with the same name from sharing a mirror.
+        Shallow and partial mirrors are kept apart from full ones, since git can't easily convert between them.
+        """
+        repo_name = sanitize_filename(url.rstrip("/").split("/")[-1].removesuffix(".git")) or "repo"
+        key = make_sha256_hash(url) if depth is None and filter_spec is None else make_sha256_hash(url, depth, filter_spec)
+        return os.path.join(self.mirror_folder, f"{repo_name}-{key[:16]}.git")
+
+
+    async def _update_mirror(self, module_name: str, url: str) -> tuple[bool, str]:
+        """
+        Clone a bare mirror of the URL if we don't have one, otherwise fetch just the new commits.
+        Each mirror is only fetched once per process, so a batch of programs
+        hits the network at most once per module.
+
+        Returns:
+            Tuple of (success boolean, mirror path or error message)
+        """
+        options = self.clone_options.get(module_name, {})
+        depth, filter_spec = options.get("depth"), options.get("filter")
+        depth_args = ['--depth', str(depth)] if depth else []
+        filter_args = [f'--filter={filter_spec}'] if filter_spec else []
+
+        mirror_path = self._get_mirror_path(url, depth, filter_spec)
+        lock = self._get_mirror_lock(mirror_path)
+
+        # Threading lock, since several event loops (one per program) can share the same mirror.
+        await self._acquire_mirror_lock(lock)
+        try:
+            if mirror_path in self._fetched_mirrors and os.path.isdir(mirror_path):
+                logger.debug(f"Mirror for {module_name} already fetched this run: {mirror_path}")
+                return True, mirror_path
+
+            if os.path.isdir(mirror_path):
+                logger.info(f"Fetching updates for {module_name} into mirror {mirror_path}")
+                success, message = await self._run_git_command(
+                    ['git', '--git-dir', mirror_path, 'fetch', '--prune', *depth_args, 'origin']
+                )
+                if not success:
+                    # A stale mirror is better than no program, e.g. when we're offline.
+                    logger.warning(f"Could not fetch {module_name}, using cached mirror: {message}")
+            else:
+                os.makedirs(self.mirror_folder, exist_ok=True)
+                # Clone next to the final location, then rename, so a half-finished clone is never used.
+                temp_mirror_path = tempfile.mkdtemp(dir=self.mirror_folder, suffix=".partial")
+                logger.info(f"Cloning mirror of {module_name} from {url} to {mirror_path}")
+                success, message = await self._run_git_command(
+                    ['git', 'clone', '--mirror', '--quiet', *depth_args, *filter_args, url, temp_mirror_path]
+                )
+                if not success:
+                    shutil.rmtree(temp_mirror_path, ignore_errors=True)
+                    return False, message
                 try:
-                    if os.path.exists(final_module_path):
-                        shutil.rmtree(final_module_path)
-                    shutil.move(temp_module_path, final_module_path)
-                    logger.info(f"Successfully moved {module_name} to {final_module_path}")
-                except Exception as e:
-                    success = False
-                    message = f"Failed to move temporary directory to final location: {e}"
-                    logger.error(message)
-            return module_name, success, message
+                    os.replace(temp_mirror_path, mirror_path)
+                except OSError:
+                    # Another process finished the same mirror first. Use theirs.
+                    shutil.rmtree(temp_mirror_path, ignore_errors=True)
+                    if not os.path.isdir(mirror_path):
+                        raise
+
+            self._fetched_mirrors.add(mirror_path)
+            return True, mirror_path
+        finally:
+            lock.release()
+
+
+    def _get_export_path(self, mirror_path: str, commit: str, paths: list[str]) -> str:
+        """
+        Get the path of a module's export at a commit, e.g.
+        'pulled_repos/api-1a2b3c4d5e6f7a8b.git' -> 'pulled_repos/exports/api-1a2b3c4d5e6f7a8b-9fceb02d0ae598e9'
+        A commit's files never change, so an export can be reused by every program made from it.
+        """
+        mirror_name = os.path.basename(mirror_path).removesuffix(".git")
+        name = f"{mirror_name}-{commit[:16]}"
+        if paths:
+            name += f"-{make_sha256_hash(*paths)[:8]}"
+        return os.path.join(self.mirror_folder, "exports", name)
+
+
+    @classmethod
+    def _get_mirror_lock(cls, mirror_path: str) -> threading.Lock:
+        with cls._mirror_locks_lock:
+            return cls._mirror_locks.setdefault(mirror_path, threading.Lock())
+
+
+    @staticmethod
+    async def _acquire_mirror_lock(lock: threading.Lock) -> None:
+        """
+        Wait for a mirror lock in a worker thread, without blocking the event loop.
+        If cancelled while waiting, the thread still gets the lock, so it releases it again straight away.
+        """
+        state = {"acquired": False, "abandoned": False}
+        state_lock = threading.Lock()
+
+        def acquire() -> None:
+            lock.acquire()
+            with state_lock:
+                if state["abandoned"]:
+                    lock.release()
+                else:
+                    state["acquired"] = True
+
+        try:
+            await asyncio.to_thread(acquire)
+        except asyncio.CancelledError:
+            with state_lock:
+                if state["acquired"]:
+                    # Acquired just as the wait was cancelled, so nobody will release it but us.
+                    lock.release()
+                state["abandoned"] = True
+            raise
+
+
+    def _extract_archive(self, archive_path: str, destination_path: str) -> None:
+        with tarfile.open(archive_path) as tar:
+            tar.extractall(destination_path, filter="data")
+
+
+    def _move_to_final_location(self, temp_module_path: str, final_module_path: str) -> None:
+        if os.path.exists(final_module_path):
+            shutil.rmtree(final_module_path)
+        shutil.move(temp_module_path, final_module_path)
 
 
     # def _get_module_status(self, module_name: str) -> tuple[bool, str]:
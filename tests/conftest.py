@@ -0,0 +1,34 @@
+import os
+import sys
+
+
+import pytest
+
+
+# Tests import the repo's modules the way main.py does, from the repo root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _write_files(root, files: dict[str, str]) -> None:
+    for relative_path, contents in files.items():
+        path = os.path.join(root, *relative_path.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+
+
+def _read_file(root, relative_path: str) -> str:
+    with open(os.path.join(root, *relative_path.split("/"))) as f:
+        return f.read()
+
+
+@pytest.fixture
+def write_files():
+    """Write files under a folder, given as {'relative/path.py': contents}. Folders are made as needed."""
+    return _write_files
+
+
+@pytest.fixture
+def read_file():
+    """Read a file under a folder, given its '/'-separated relative path."""
+    return _read_file
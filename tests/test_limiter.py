@@ -0,0 +1,169 @@
+import asyncio
+import time
+
+
+import pytest
+
+
+from utils.shared.limiters.Limiter import Limiter
+from utils.shared.limiters.TokenBucket import TokenBucket
+
+
+# Timing tests allow this much slack, for slow or busy machines.
+SLACK = 0.05
+
+
+def test_token_bucket_allows_a_burst_then_waits():
+    async def run():
+        bucket = TokenBucket(rate=10, capacity=5)
+        burst = [await bucket.acquire() for _ in range(5)]
+        started = time.monotonic()
+        waited = await bucket.acquire()
+        return burst, waited, time.monotonic() - started
+
+    burst, waited, elapsed = asyncio.run(run())
+    assert burst == [0.0] * 5
+    assert waited == pytest.approx(0.1, abs=SLACK)
+    assert elapsed >= 0.1 - SLACK
+
+
+def test_token_bucket_keeps_to_its_rate():
+    async def run():
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # The first is free, then one every 1/20s.
+    assert asyncio.run(run()) >= 4 / 20 - SLACK
+
+
+def test_token_bucket_debt_is_paid_back():
+    async def run():
+        bucket = TokenBucket(rate=100, capacity=10)
+        first = await bucket.acquire(30)
+        second = await bucket.acquire(1)
+        return first, second
+
+    first, second = asyncio.run(run())
+    # Bigger than the bucket: waits for it to be full, then leaves it 20 in debt.
+    assert first == 0.0
+    assert second == pytest.approx(21 / 100, abs=SLACK)
+
+
+def test_token_bucket_serves_waiters_in_order():
+    async def run():
+        bucket = TokenBucket(rate=50, capacity=1)
+        await bucket.acquire()
+        order = []
+
+        async def take(idx):
+            await bucket.acquire()
+            order.append(idx)
+
+        await asyncio.gather(*(take(idx) for idx in range(5)))
+        return order
+
+    assert asyncio.run(run()) == [0, 1, 2, 3, 4]
+
+
+def test_token_bucket_needs_a_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+def test_limiter_keeps_input_order_and_concurrency():
+    running, most_running = 0, 0
+
+    async def work(inp):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        await asyncio.sleep(0.01 * (5 - inp % 5))
+        running -= 1
+        return inp * 2
+
+    async def run():
+        return await Limiter(semaphore=3, progress_bar=False).run_async_many(inputs=range(20), func=work, enum=False)
+
+    assert asyncio.run(run()) == [inp * 2 for inp in range(20)]
+    assert most_running == 3
+
+
+def test_limiter_stops_on_stop_condition():
+    started = []
+
+    async def work(inp):
+        started.append(inp)
+        return "stop" if inp == 3 else inp
+
+    async def run():
+        limiter = Limiter(semaphore=1, stop_condition="stop", progress_bar=False)
+        return limiter, await limiter.run_async_many(inputs=range(10), func=work, enum=False)
+
+    limiter, results = asyncio.run(run())
+    assert limiter.stopped
+    assert results == [0, 1, 2, "stop"]
+    assert started == [0, 1, 2, 3]
+
+
+def test_limiter_stop_finishes_running_coroutines():
+    async def run():
+        limiter = Limiter(semaphore=2, progress_bar=False)
+
+        async def work(inp):
+            if inp == 1:
+                limiter.stop()
+            await asyncio.sleep(0.01)
+            return inp
+
+        return await limiter.run_async_many(inputs=range(10), func=work, enum=False)
+
+    # 0 and 1 were already running when 1 stopped the limiter.
+    assert asyncio.run(run()) == [0, 1]
+
+
+def test_limiter_requests_per_second():
+    async def work(inp):
+        return inp
+
+    async def run():
+        limiter = Limiter(semaphore=10, requests_per_second=20, burst=1, progress_bar=False)
+        started = time.monotonic()
+        await limiter.run_async_many(inputs=range(5), func=work, enum=False)
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 4 / 20 - SLACK
+
+
+def test_limiter_bytes_per_second_from_get_size():
+    async def work(inp):
+        return inp
+
+    async def run():
+        limiter = Limiter(semaphore=4, bytes_per_second=1000, progress_bar=False)
+        started = time.monotonic()
+        results = await limiter.run_async_many(inputs=[500] * 5, func=work, enum=False, get_size=lambda inp: inp)
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(run())
+    assert results == [500] * 5
+    # A second's worth (1000 bytes) goes at once, then the other 1500 take 1.5s.
+    assert elapsed >= 1.5 - SLACK
+
+
+def test_limiter_exceptions():
+    async def work(inp):
+        if inp == 2:
+            raise RuntimeError("failed")
+        return inp
+
+    async def run(return_exceptions):
+        limiter = Limiter(semaphore=2, progress_bar=False)
+        return await limiter.run_async_many(inputs=range(4), func=work, enum=False, return_exceptions=return_exceptions)
+
+    results = asyncio.run(run(True))
+    assert results[:2] == [0, 1] and isinstance(results[2], RuntimeError) and results[3] == 3
+    with pytest.raises(RuntimeError):
+        asyncio.run(run(False))
@@ -0,0 +1,90 @@
+import os
+
+
+from utils.merge_trees import merge_trees
+from utils.unpack_utils_shared import unpack_utils_shared
+
+
+def test_merge_trees_resolves_collisions_in_order(tmp_path, write_files, read_file):
+    destination = tmp_path / "destination"
+    write_files(destination, {"taken.py": "destination"})
+    write_files(tmp_path / "first", {
+        "taken.py": "first",
+        "collision.py": "first",
+        "same.py": "same",
+        "sub/first.py": "first",
+        "kind": "a file",
+        ".git/HEAD": "ignored",
+    })
+    write_files(tmp_path / "second", {
+        "collision.py": "second",
+        "same.py": "same",
+        "sub/second.py": "second",
+        "kind/under.py": "a directory",
+    })
+
+    # Not in alphabetical order, to show the order given is what counts.
+    result = merge_trees({"second": str(tmp_path / "second"), "first": str(tmp_path / "first")}, str(destination))
+
+    assert read_file(destination, "taken.py") == "destination"
+    assert read_file(destination, "collision.py") == "second"
+    assert read_file(destination, "same.py") == "same"
+    assert read_file(destination, "sub/first.py") == "first"
+    assert read_file(destination, "sub/second.py") == "second"
+    assert read_file(destination, "kind/under.py") == "a directory"
+    assert not (destination / ".git").exists()
+
+    assert result["deduplicated"] == [{"module": "first", "path": "same.py"}]
+    assert result["skipped"] == [
+        {"module": "first", "path": "collision.py", "reason": "'second' already has collision.py"},
+        {"module": "first", "path": "kind", "reason": "'second' already has kind as a directory, not a file"},
+        {"module": "first", "path": "taken.py", "reason": "The destination already has taken.py"},
+    ]
+    assert result["files"] == 5
+
+
+def test_merge_trees_skips_everything_under_a_skipped_directory(tmp_path, write_files, read_file):
+    destination = tmp_path / "destination"
+    write_files(destination, {"helpers": "a file"})
+    write_files(tmp_path / "module", {"helpers/a.py": "a", "helpers/deeper/b.py": "b"})
+
+    result = merge_trees({"module": str(tmp_path / "module")}, str(destination))
+
+    assert read_file(destination, "helpers") == "a file"
+    assert result["skipped"] == [{"module": "module", "path": "helpers",
+                                  "reason": "The destination already has helpers as a file, not a directory"}]
+    assert result["files"] == 0
+
+
+def test_merge_trees_deduplicates_symlinks_to_the_same_place(tmp_path):
+    for name in ("first", "second"):
+        os.makedirs(tmp_path / name)
+        os.symlink("target.py", tmp_path / name / "link.py")
+    os.symlink("elsewhere.py", tmp_path / "second" / "other.py")
+    os.symlink("target.py", tmp_path / "first" / "other.py")
+
+    result = merge_trees({"first": str(tmp_path / "first"), "second": str(tmp_path / "second")},
+                         str(tmp_path / "destination"))
+
+    assert os.readlink(tmp_path / "destination" / "link.py") == "target.py"
+    assert os.readlink(tmp_path / "destination" / "other.py") == "target.py"
+    assert result["deduplicated"] == [{"module": "second", "path": "link.py"}]
+    assert [skipped["path"] for skipped in result["skipped"]] == ["other.py"]
+
+
+def test_unpack_utils_shared_merges_utils_first_then_alphabetically(tmp_path, write_files, read_file):
+    write_files(tmp_path, {
+        "utils/shared/own.py": "utils",
+        "zeta/utils/shared/own.py": "zeta",
+        "zeta/utils/shared/shared.py": "zeta",
+        "alpha/utils/shared/shared.py": "alpha",
+        "alpha/utils/shared/alpha.py": "alpha",
+    })
+
+    unpack_utils_shared(["zeta", "alpha", "utils"], str(tmp_path))
+
+    assert read_file(tmp_path, "utils/shared/own.py") == "utils"
+    assert read_file(tmp_path, "utils/shared/shared.py") == "alpha"
+    assert read_file(tmp_path, "utils/shared/alpha.py") == "alpha"
+    assert not (tmp_path / "alpha" / "utils" / "shared").exists()
+    assert not (tmp_path / "zeta" / "utils" / "shared").exists()
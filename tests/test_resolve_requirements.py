@@ -0,0 +1,124 @@
+import pytest
+
+
+from steps.validated.concatenate_requirements import concatenate_requirements
+from utils.resolve_requirements import RequirementsMerger, _intersect_specifiers, resolve_requirements
+
+
+@pytest.mark.parametrize("specifiers, expected", [
+    ([(">=", "2.0"), ("==", "2.1.1"), ("<", "3")], ["==2.1.1"]),
+    ([(">=", "1.0"), ("<", "2.0"), ("!=", "1.5"), ("!=", "0.5")], [">=1.0", "<2.0", "!=1.5"]),
+    ([("~=", "2.1.3")], [">=2.1.3", "<2.2"]),
+    ([("==", "2.1.*"), (">=", "2.1.4")], [">=2.1.4", "<2.2"]),
+    ([(">=", "2.0"), (">", "2.0")], [">2.0"]),
+    ([(">=", "2.0"), ("<=", "2.0")], ["==2.0"]),
+    ([(">=", "2.0"), ("<=", "2.0"), ("!=", "2.1.*")], ["==2.0"]),
+    ([("==", "2.2"), ("!=", "2.1.*")], ["==2.2"]),
+])
+def test_intersect_specifiers(specifiers, expected):
+    assert _intersect_specifiers(specifiers) == expected
+
+
+@pytest.mark.parametrize("specifiers", [
+    [("==", "1.10.2"), (">=", "2.0")],
+    [("==", "2.0"), ("==", "2.1")],
+    [(">=", "3.0"), ("<", "2.0")],
+    [(">", "2.0"), ("<=", "2.0")],
+    [(">=", "2.0"), ("<=", "2.0"), ("!=", "2.0")],
+    [("==", "2.1.1"), ("!=", "2.1.1")],
+    [("==", "2.1.1"), ("!=", "2.1.*")],
+    [("==", "2"), ("!=", "2.0.*")],
+])
+def test_intersect_specifiers_conflicts(specifiers):
+    with pytest.raises(ValueError):
+        _intersect_specifiers(specifiers)
+
+
+def test_resolve_requirements_merges_per_package(tmp_path):
+    (tmp_path / "a.txt").write_text(
+        'Pandas>=2.0\nrequests\n--extra-index-url https://example.com\n# comment\nnumpy<2 ; python_version >= "3.9"\n'
+    )
+    (tmp_path / "b.txt").write_text("pandas==2.1.1\ntyping_extensions\nnumpy<1.26; python_version>='3.9'\n")
+    paths = [str(tmp_path / "a.txt"), str(tmp_path / "b.txt")]
+
+    resolved = resolve_requirements(paths)
+    assert resolved == {
+        "requirements": ['numpy<1.26; python_version >= "3.9"', "pandas==2.1.1", "requests", "typing-extensions"],
+        "other_lines": ["--extra-index-url https://example.com"],
+        "conflicts": [],
+    }
+    assert resolve_requirements(reversed(paths)) == resolved
+
+
+def test_resolve_requirements_reports_every_conflicting_line(tmp_path):
+    (tmp_path / "a.txt").write_text("pydantic==1.10.2\npydantic<3\n")
+    (tmp_path / "b.txt").write_text("pydantic>=2.0\n")
+    a, b = str(tmp_path / "a.txt"), str(tmp_path / "b.txt")
+
+    resolved = resolve_requirements([a, b])
+    assert resolved["requirements"] == []
+    assert resolved["conflicts"] == [{
+        "name": "pydantic", "marker": None, "reason": "'==1.10.2' excludes '>=2.0'",
+        "specifiers": [(a, "pydantic==1.10.2"), (a, "pydantic<3"), (b, "pydantic>=2.0")],
+    }]
+
+
+def test_resolve_requirements_keeps_hashes(tmp_path):
+    (tmp_path / "a.txt").write_text("requests==2.31.0 \\\n    --hash=sha256:bbb \\\n    --hash=sha256:aaa\n")
+    (tmp_path / "b.txt").write_text("requests>=2.0 --hash=sha256:aaa --hash=sha256:ccc\nrequests<3\n")
+
+    resolved = resolve_requirements([str(tmp_path / "a.txt"), str(tmp_path / "b.txt")])
+    assert resolved["requirements"] == ["requests==2.31.0 --hash=sha256:aaa --hash=sha256:bbb --hash=sha256:ccc"]
+    assert resolved["other_lines"] == []
+
+
+def test_resolve_requirements_inlines_relative_includes(tmp_path, write_files):
+    write_files(tmp_path, {
+        "common/base.txt": "pydantic<2\n--extra-index-url https://example.com\n",
+        "requirements.txt": "-r common/base.txt\n-r /absolute/other.txt\npydantic>=1.10\n",
+    })
+
+    resolved = resolve_requirements([str(tmp_path / "requirements.txt")])
+    assert resolved["requirements"] == ["pydantic>=1.10,<2"]
+    assert resolved["other_lines"] == ["--extra-index-url https://example.com", "-r /absolute/other.txt"]
+
+
+@pytest.mark.parametrize("text", ["-c constraints.txt\n", "-r requirements.txt\n"])
+def test_resolve_requirements_rejects_relative_constraints_and_cycles(tmp_path, text):
+    (tmp_path / "requirements.txt").write_text(text)
+    with pytest.raises(ValueError):
+        resolve_requirements([str(tmp_path / "requirements.txt")])
+
+
+def test_resolve_requirements_url_with_specifiers_conflicts(tmp_path):
+    (tmp_path / "a.txt").write_text("api @ https://example.com/api.zip\n")
+    (tmp_path / "b.txt").write_text("api>=2.0\n")
+    a, b = str(tmp_path / "a.txt"), str(tmp_path / "b.txt")
+
+    resolved = resolve_requirements([a, b])
+    assert resolved["requirements"] == []
+    assert resolved["conflicts"] == [{
+        "name": "api", "marker": None, "reason": "'@ https://example.com/api.zip' can't also be '>=2.0'",
+        "specifiers": [(a, "api @ https://example.com/api.zip"), (b, "api>=2.0")],
+    }]
+
+
+def test_concatenate_requirements_raises_on_conflicts(tmp_path, write_files):
+    write_files(tmp_path, {"api/requirements.txt": "pydantic==1.10.2\n", "database/requirements.txt": "pydantic>=2.0\n"})
+
+    with pytest.raises(ValueError, match="pydantic==1.10.2 in .*pydantic>=2.0 in "):
+        concatenate_requirements(str(tmp_path))
+    assert not (tmp_path / "requirements.txt").exists()
+
+
+def test_requirements_merger_watches_copies(tmp_path, write_files):
+    source = tmp_path / "module"
+    write_files(source, {"requirements.txt": "aiohttp>=3.9\n", "api.py": ""})
+    merger = RequirementsMerger()
+    copy_function = merger.watch(lambda source_path, destination_path: destination_path)
+
+    copy_function(str(source / "api.py"), str(tmp_path / "api.py"))
+    copy_function(str(source / "requirements.txt"), str(tmp_path / "requirements.txt"))
+
+    assert merger.files == [str(source / "requirements.txt")]
+    assert merger.resolve()["requirements"] == ["aiohttp>=3.9"]
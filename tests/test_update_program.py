@@ -0,0 +1,137 @@
+import os
+
+
+import pytest
+
+
+from utils.build_manifest import load_build_manifest, write_build_manifest
+from utils.content_store import ContentStore
+from utils.execute_plan import execute_plan
+from utils.plan_program import plan_program
+from utils.update_program import update_program
+
+
+@pytest.fixture
+def build(write_files):
+    """Write files into a program folder, with a build manifest that records them as generated."""
+    def build(path, files: dict[str, str]) -> None:
+        write_files(path, files)
+        write_build_manifest(str(path), "my_program", {})
+    return build
+
+
+def test_update_program_classifies_every_file(tmp_path, build, write_files, read_file):
+    program, staging = tmp_path / "program", tmp_path / "staging"
+    build(program, {
+        "unchanged.py": "same",
+        "edited.py": "generated",
+        "upstream.py": "old",
+        "both.py": "old",
+        "removed.py": "gone upstream",
+        "removed_edited.py": "gone upstream",
+        "deleted.py": "old",
+    })
+    build(staging, {
+        "unchanged.py": "same",
+        "edited.py": "generated",
+        "upstream.py": "new upstream",
+        "both.py": "new upstream",
+        "new/new.py": "new upstream",
+        "deleted.py": "new upstream",
+    })
+    # The user's edits since the program was generated.
+    write_files(program, {"edited.py": "edited by the user", "both.py": "edited by the user",
+                     "removed_edited.py": "edited by the user"})
+    os.remove(program / "deleted.py")
+
+    summary = update_program(str(staging), str(program))
+
+    assert summary == {
+        "added": ["new/new.py"],
+        "updated": ["upstream.py"],
+        "removed": ["removed.py"],
+        "kept": ["both.py", "deleted.py", "removed_edited.py"],
+    }
+    assert read_file(program, "unchanged.py") == "same"
+    assert read_file(program, "edited.py") == "edited by the user"
+    assert read_file(program, "upstream.py") == "new upstream"
+    assert read_file(program, "both.py") == "edited by the user"
+    assert read_file(program, "new/new.py") == "new upstream"
+    assert read_file(program, "removed_edited.py") == "edited by the user"
+    assert not (program / "removed.py").exists()
+    assert not (program / "deleted.py").exists()
+
+    # The manifest records what was generated, not what's on disk, so kept edits are still edits next time.
+    generated = load_build_manifest(str(staging))["files"]
+    recorded = load_build_manifest(str(program))["files"]
+    assert {path: entry["sha256"] for path, entry in recorded.items()} == \
+        {path: entry["sha256"] for path, entry in generated.items()}
+    again = update_program(str(staging), str(program))
+    assert again["added"] == again["updated"] == again["removed"] == []
+    assert read_file(program, "both.py") == "edited by the user"
+
+
+def test_update_program_updates_symlinks(tmp_path):
+    program, staging = tmp_path / "program", tmp_path / "staging"
+    program.mkdir()
+    staging.mkdir()
+    for path, target in {"unchanged": "unchanged.py", "retargeted": "old.py", "edited": "old.py",
+                         "removed": "gone.py"}.items():
+        os.symlink(target, program / path)
+    for path, target in {"unchanged": "unchanged.py", "retargeted": "new.py", "edited": "new.py",
+                         "added": "new.py"}.items():
+        os.symlink(target, staging / path)
+    write_build_manifest(str(program), "my_program", {})
+    write_build_manifest(str(staging), "my_program", {})
+    # The user's edit since the program was generated.
+    os.remove(program / "edited")
+    os.symlink("mine.py", program / "edited")
+
+    summary = update_program(str(staging), str(program))
+
+    assert summary == {"added": ["added"], "updated": ["retargeted"], "removed": ["removed"], "kept": ["edited"]}
+    assert os.readlink(program / "added") == "new.py"
+    assert os.readlink(program / "retargeted") == "new.py"
+    assert os.readlink(program / "unchanged") == "unchanged.py"
+    assert os.readlink(program / "edited") == "mine.py"
+    assert not os.path.lexists(program / "removed")
+    assert load_build_manifest(str(program))["symlinks"] == load_build_manifest(str(staging))["symlinks"]
+
+
+def test_execute_plan_records_symlinks(tmp_path, write_files):
+    module = tmp_path / "modules" / "api"
+    write_files(module, {"api.py": "api"})
+    os.symlink("api.py", module / "link.py")
+
+    written = execute_plan(plan_program({"api": str(module)}), str(tmp_path / "program"), ContentStore(str(tmp_path / "store")))
+
+    assert written["symlinks"] == {"api/link.py": {"target": "api.py", "module": "api"}}
+    assert os.readlink(tmp_path / "program" / "api" / "link.py") == "api.py"
+
+
+def test_update_program_only_reads_changed_files_from_staging(tmp_path, build, read_file):
+    program, staging = tmp_path / "program", tmp_path / "staging"
+    build(program, {"unchanged.py": "same", "upstream.py": "old"})
+    build(staging, {"unchanged.py": "same", "upstream.py": "new upstream"})
+    os.remove(staging / "unchanged.py")
+
+    summary = update_program(str(staging), str(program))
+
+    assert summary["updated"] == ["upstream.py"]
+    assert read_file(program, "unchanged.py") == "same"
+
+
+def test_execute_plan_skips_files_unchanged_since_the_last_build(tmp_path, write_files, read_file):
+    module = tmp_path / "modules" / "api"
+    write_files(module, {"api.py": "api", "client.py": "client"})
+    store = ContentStore(str(tmp_path / "store"))
+    previous_files = execute_plan(plan_program({"api": str(module)}), str(tmp_path / "program"), store)["files"]
+
+    write_files(module, {"client.py": "client, changed"})
+    staging = tmp_path / "staging"
+    files = execute_plan(plan_program({"api": str(module)}), str(staging), store, previous_files=previous_files)["files"]
+
+    assert files["api/api.py"] == previous_files["api/api.py"]
+    assert files["api/client.py"]["sha256"] != previous_files["api/client.py"]["sha256"]
+    assert not (staging / "api" / "api.py").exists()
+    assert read_file(staging, "api/client.py") == "client, changed"
@@ -0,0 +1,222 @@
+import json
+import os
+from typing import Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.shared.get_formatted_datetime import get_formatted_datetime
+from utils.shared.make_sha256_file_hash import make_sha256_file_hash
+
+
+BUILD_MANIFEST_FILENAME = ".build_manifest.json"
+BUILD_MANIFEST_VERSION = 3
+
+
+def make_file_entry(path: str) -> dict:
+    """
+    Describe a file for the build manifest.
+
+    Example:
+    >>> make_file_entry("program/main.py")
+    {'sha256': '2cf24dba5fb0a30e...', 'size': 5, 'mtime_ns': 1731400000000000000}
+    """
+    st = os.stat(path)
+    return {"sha256": make_sha256_file_hash(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def hash_program_files(program_path: str) -> dict[str, dict]:
+    """
+    Describe every regular file in a program directory.
+
+    Returns:
+        Dictionary mapping each file's path relative to the program directory (with '/' separators)
+        to its manifest entry. See make_file_entry. The build manifest itself is left out.
+    """
+    files = {}
+    for root, dirs, filenames in os.walk(program_path):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            relative_path = os.path.relpath(path, program_path).replace(os.sep, "/")
+            if relative_path == BUILD_MANIFEST_FILENAME:
+                continue
+            files[relative_path] = make_file_entry(path)
+    return files
+
+
+def find_program_symlinks(program_path: str) -> dict[str, dict]:
+    """
+    Describe every symlink in a program directory.
+
+    Returns:
+        Dictionary mapping each symlink's path relative to the program directory (with '/' separators)
+        to its manifest entry, e.g. {'target': '../utils/shared/helper.py'}.
+    """
+    symlinks = {}
+    for root, dirs, filenames in os.walk(program_path):
+        dirs.sort()
+        for name in sorted(dirs + filenames):
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                symlinks[os.path.relpath(path, program_path).replace(os.sep, "/")] = {"target": os.readlink(path)}
+    return symlinks
+
+
+def describe_modules(chosen_modules: dict[str, str], module_commits: Optional[dict[str, str]] = None) -> dict[str, dict]:
+    """
+    Describe where each module came from.
+
+    Example:
+    >>> describe_modules({"api": "https://github.com/the-ride-never-ends/api", "logger": "/modules/core/logger"},
+    >>>                  {"api": "9fceb02d0ae598e95dc970b74767f19372d61af8"})
+    {'api': {'type': 'github', 'source': 'https://github.com/the-ride-never-ends/api', 'commit': '9fceb02d...'},
+     'logger': {'type': 'disk', 'source': '/modules/core/logger'}}
+    """
+    module_commits = module_commits or {}
+    modules = {}
+    for module_name, module_path in sorted(chosen_modules.items()):
+        if str(module_path).startswith(("http://", "https://")):
+            modules[module_name] = {"type": "github", "source": module_path, "commit": module_commits.get(module_name)}
+        else:
+            modules[module_name] = {"type": "disk", "source": str(module_path)}
+    return modules
+
+
+def write_build_manifest(program_path: str,
+                         program_name: str,
+                         chosen_modules: dict[str, str],
+                         module_commits: Optional[dict[str, str]] = None,
+                         files: Optional[dict[str, dict]] = None,
+                         symlinks: Optional[dict[str, dict]] = None
+                        ) -> dict:
+    """
+    Record what was generated into the program directory: which modules it was made from,
+    the hash, size and modification time of every file, and the target of every symlink.
+    The program can then be checked or updated later without rehashing it. See utils/update_program.py
+
+    Args:
+        program_path: The program directory.
+        program_name: Name of the program.
+        chosen_modules: Dictionary mapping module names to their paths/URLs.
+        module_commits: Dictionary mapping GitHub module names to the commit they were exported from.
+        files: The file entries to record, if already known. Defaults to describing every file in program_path.
+        symlinks: The symlink entries to record, if already known. Defaults to describing every symlink in program_path.
+
+    Returns:
+        The manifest that was written.
+    """
+    manifest = {
+        "version": BUILD_MANIFEST_VERSION,
+        "program_name": program_name,
+        "created": get_formatted_datetime(),
+        "modules": describe_modules(chosen_modules, module_commits),
+        "files": dict(sorted(files.items())) if files is not None else hash_program_files(program_path),
+        "symlinks": dict(sorted(symlinks.items())) if symlinks is not None else find_program_symlinks(program_path),
+    }
+    save_build_manifest(program_path, manifest)
+    logger.info(f"Wrote build manifest for {len(manifest['files'])} files to {program_path}")
+    return manifest
+
+
+def save_build_manifest(program_path: str, manifest: dict) -> None:
+    """Write a build manifest into a program directory."""
+    # Write to a temporary file, then rename, so a crash never leaves half a manifest.
+    manifest_path = os.path.join(program_path, BUILD_MANIFEST_FILENAME)
+    with open(f"{manifest_path}.tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def load_build_manifest(program_path: str) -> Optional[dict]:
+    """
+    Load a program's build manifest. Manifests from older versions are upgraded in memory.
+
+    Returns:
+        The manifest, or None if the program doesn't have one.
+
+    Raises:
+        ValueError: If the manifest is from a newer version of this program, or is malformed.
+    """
+    manifest_path = os.path.join(program_path, BUILD_MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return None
+
+    with open(manifest_path, "r") as f:
+        manifest = json.load(f)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("files"), dict) \
+            or not isinstance(manifest.get("symlinks", {}), dict):
+        raise ValueError(f"Build manifest is malformed: {manifest_path}")
+    version = manifest.get("version", 1)
+    if version > BUILD_MANIFEST_VERSION:
+        raise ValueError(f"Build manifest version {version} is newer than this program supports: {manifest_path}")
+
+    if version == 1:
+        # Version 1 only had file hashes and module paths.
+        manifest["files"] = {
+            relative_path: {"sha256": sha256, "size": None, "mtime_ns": None}
+            for relative_path, sha256 in manifest["files"].items()
+        }
+        manifest["modules"] = describe_modules(manifest.get("modules", {}))
+    if version < 3:
+        # Versions 1 and 2 didn't record symlinks.
+        manifest["symlinks"] = {}
+    manifest["version"] = BUILD_MANIFEST_VERSION
+    return manifest
+
+
+def file_matches(path: str, entry: dict, rehash: bool = False) -> bool:
+    """
+    Check whether a file still has the contents recorded in its manifest entry.
+    If its size and modification time haven't changed, it isn't read unless rehash is True.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return False
+    if entry.get("size") is not None and st.st_size != entry["size"]:
+        return False
+    if not rehash and st.st_mtime_ns == entry.get("mtime_ns"):
+        return True
+    return make_sha256_file_hash(path) == entry["sha256"]
+
+
+def check_program_files(program_path: str, manifest: Optional[dict] = None, rehash: bool = False) -> dict[str, list[str]]:
+    """
+    Compare a program directory against its build manifest.
+
+    Args:
+        program_path: The program directory.
+        manifest: The manifest to check against. Defaults to the program's own.
+        rehash: If True, hash every file even if its size and modification time are unchanged.
+
+    Returns:
+        Dictionary with the relative paths of generated files and symlinks that were 'modified' or are 'missing'.
+        If both are empty, the program is exactly as it was generated.
+
+    Raises:
+        ValueError: If the program has no build manifest.
+    """
+    manifest = manifest or load_build_manifest(program_path)
+    if manifest is None:
+        raise ValueError(f"No build manifest in {program_path}")
+
+    result = {"modified": [], "missing": []}
+    for relative_path, entry in manifest["files"].items():
+        path = os.path.join(program_path, *relative_path.split("/"))
+        if not os.path.isfile(path):
+            result["missing"].append(relative_path)
+        elif not file_matches(path, entry, rehash=rehash):
+            result["modified"].append(relative_path)
+    for relative_path, entry in manifest["symlinks"].items():
+        path = os.path.join(program_path, *relative_path.split("/"))
+        if not os.path.islink(path):
+            result["missing"].append(relative_path)
+        elif os.readlink(path) != entry["target"]:
+            result["modified"].append(relative_path)
+    return result
@@ -0,0 +1,269 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+from typing import Iterable, Optional
+
+
+from config.config import PROJECT_ROOT
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.fast_copy_file import COPY_METHODS, fast_copy_file
+from utils.shared.make_sha256_file_hash import make_sha256_file_hash
+
+
+CONTENT_STORE_PATH = os.path.join(PROJECT_ROOT, "cache", "content_store")
+
+# Hardlinks are fast and free, but editing a hardlinked file in place also edits the stored copy,
+# so they're opt-in. Reflinks are copy-on-write, so they're always safe.
+DEFAULT_LINK_MODES = ("reflink", "copy")
+
+
+class ContentStore:
+    """
+    A content-addressed file store. Files are stored once, keyed by the SHA-256 of their contents,
+    and materialized into program directories by reflink, hardlink or copy.
+
+    Generating many programs from the same modules only stores each file once,
+    and a file whose path, size and mtime haven't changed since it was last stored isn't hashed again.
+
+    Without reflinks or hardlinks (e.g. on ext4 by default), the store is a copy of every module file
+    on top of the programs' own copies. Old versions stay until prune removes them.
+
+    Example:
+    >>> store = ContentStore.shared()
+    >>> shutil.copytree(module_path, destination_path, copy_function=store.copy_file)
+    >>> # Or, to allow hardlinks:
+    >>> copy_function = functools.partial(store.copy_file, link_modes=("reflink", "hardlink", "copy"))
+    >>> store.save_index()
+    """
+    _shared: dict[str, 'ContentStore'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 store_path: str = CONTENT_STORE_PATH,
+                 link_modes: tuple[str, ...] = DEFAULT_LINK_MODES
+                ) -> None:
+        """
+        Args:
+            store_path: Folder to keep the stored files and their index in.
+            link_modes: Ways to materialize a stored file, tried in order.
+                Any of 'reflink', 'hardlink' and 'copy'. 'copy' always works.
+        """
+        for mode in link_modes:
+            if mode not in ("reflink", "hardlink", "copy"):
+                raise ValueError(f"Unknown link mode: {mode}")
+
+        self.store_path: str = store_path
+        self.objects_path: str = os.path.join(store_path, "objects")
+        self.index_path: str = os.path.join(store_path, "index.json")
+        self.link_modes: tuple[str, ...] = tuple(link_modes)
+
+        # Source path -> (size, mtime_ns, inode, digest)
+        self.index: dict[str, tuple[int, int, int, str]] = self._load_index()
+        self._lock = threading.Lock()
+        self._index_changed: bool = False
+        os.makedirs(self.objects_path, exist_ok=True)
+
+
+    @classmethod
+    def shared(cls, store_path: str = CONTENT_STORE_PATH) -> 'ContentStore':
+        """
+        Get the store for a path, creating it once per process, so a batch of programs shares one index.
+        """
+        with cls._shared_lock:
+            if store_path not in cls._shared:
+                cls._shared[store_path] = cls(store_path)
+            return cls._shared[store_path]
+
+
+    def _load_index(self) -> dict[str, tuple[int, int, int, str]]:
+        try:
+            with open(self.index_path, "r") as f:
+                return {path: tuple(entry) for path, entry in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Could not load content store index, rehashing files: {e}")
+            return {}
+
+
+    def save_index(self) -> None:
+        """Write the index to disk, so the next run doesn't rehash unchanged files."""
+        with self._lock:
+            if not self._index_changed:
+                return
+            index = dict(self.index)
+            self._index_changed = False
+
+        # Write to a temporary file, then rename, so a crash never leaves half an index.
+        fd, temp_path = tempfile.mkstemp(dir=self.store_path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, self.index_path)
+        logger.debug(f"Saved content store index with {len(index)} entries")
+
+
+    def object_path(self, digest: str) -> str:
+        """Get the path of a stored file, e.g. 'objects/2c/f24dba5fb0...'"""
+        return os.path.join(self.objects_path, digest[:2], digest[2:])
+
+
+    def add(self, source_path: str) -> str:
+        """
+        Store a file if it isn't stored already.
+
+        Returns:
+            The SHA-256 hex digest of the file's contents.
+        """
+        source_path = os.path.abspath(source_path)
+        st = os.stat(source_path)
+        with self._lock:
+            entry = self.index.get(source_path)
+        if entry and entry[:3] == (st.st_size, st.st_mtime_ns, st.st_ino) and os.path.exists(self.object_path(entry[3])):
+            return entry[3]
+
+        digest = make_sha256_file_hash(source_path)
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Store under a temporary name, then rename, so a half-written object is never used.
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(object_path), suffix=".tmp")
+            os.close(fd)
+            try:
+                fast_copy_file(source_path, temp_path)
+                # Stored files are read-only, so they can't be edited through a hardlink by accident.
+                os.chmod(temp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                os.replace(temp_path, object_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+
+        with self._lock:
+            self.index[source_path] = (st.st_size, st.st_mtime_ns, st.st_ino, digest)
+            self._index_changed = True
+        return digest
+
+
+    def materialize(self, digest: str, destination_path: str, link_modes: Optional[tuple[str, ...]] = None) -> str:
+        """
+        Make a stored file appear at destination_path, trying each link mode in order.
+
+        Args:
+            digest: The SHA-256 hex digest of the stored file.
+            destination_path: Where the file should appear.
+            link_modes: Overrides the store's link modes for this file.
+
+        Returns:
+            The link mode that was used.
+        """
+        link_modes = link_modes or self.link_modes
+        object_path = self.object_path(digest)
+        for mode in link_modes:
+            try:
+                if mode == "reflink":
+                    fast_copy_file(object_path, destination_path, methods=("reflink",))
+                elif mode == "hardlink":
+                    os.link(object_path, destination_path)
+                else:
+                    # Reflinks were either already tried, or not allowed.
+                    method = fast_copy_file(object_path, destination_path, methods=COPY_METHODS[1:])
+                    logger.debug(f"Copied {destination_path} with {method}")
+                return mode
+            except OSError as e:
+                # Not supported on this filesystem, across filesystems, or too many links.
+                logger.debug(f"Could not {mode} {destination_path}: {e}")
+                if mode != "hardlink" and os.path.exists(destination_path):
+                    os.remove(destination_path)
+        raise OSError(f"Could not materialize {digest} at {destination_path} with any of {link_modes}")
+
+
+    def put(self, source_path: str, destination_path: str, link_modes: Optional[tuple[str, ...]] = None) -> tuple[str, str]:
+        """
+        Store a file, then materialize it at the destination.
+
+        Returns:
+            Tuple of (SHA-256 hex digest, link mode that was used)
+        """
+        digest = self.add(source_path)
+        if os.path.lexists(destination_path):
+            os.remove(destination_path)
+        mode = self.materialize(digest, destination_path, link_modes)
+        # Hardlinks share the stored file's metadata. Otherwise, keep the source's permissions and times.
+        if mode != "hardlink":
+            shutil.copystat(source_path, destination_path)
+        return digest, mode
+
+
+    def prune(self, keep: Iterable[str] = ()) -> dict[str, int]:
+        """
+        Remove stored files that no current source has, e.g. old versions of module files, and forget sources
+        that were deleted or changed since they were stored. Don't run it while files are being added.
+
+        Programs never depend on the store: reflinked and copied files are their own, and a hardlinked file
+        keeps its data when the stored one is removed. So pruning is always safe, and a pruned file is just
+        stored again the next time it's needed.
+
+        Args:
+            keep: Digests to keep even if no current source has them.
+
+        Returns:
+            How many 'objects' and 'bytes' were removed, and how many 'sources' were forgotten.
+        """
+        with self._lock:
+            index = dict(self.index)
+        live, forgotten = set(keep), []
+        for source_path, entry in index.items():
+            try:
+                st = os.stat(source_path)
+            except FileNotFoundError:
+                forgotten.append(source_path)
+                continue
+            if (st.st_size, st.st_mtime_ns, st.st_ino) != entry[:3]:
+                forgotten.append(source_path)
+                continue
+            live.add(entry[3])
+
+        with self._lock:
+            for source_path in forgotten:
+                if self.index.get(source_path) == index[source_path]:
+                    del self.index[source_path]
+                    self._index_changed = True
+
+        stats = {"objects": 0, "bytes": 0, "sources": len(forgotten)}
+        for prefix in os.listdir(self.objects_path):
+            prefix_path = os.path.join(self.objects_path, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for name in os.listdir(prefix_path):
+                if name.endswith(".tmp") or prefix + name in live:
+                    continue
+                object_path = os.path.join(prefix_path, name)
+                stats["bytes"] += os.path.getsize(object_path)
+                if os.name == "nt":
+                    # Windows won't remove a read-only file.
+                    os.chmod(object_path, stat.S_IRUSR | stat.S_IWUSR)
+                os.remove(object_path)
+                stats["objects"] += 1
+            if not os.listdir(prefix_path):
+                os.rmdir(prefix_path)
+
+        self.save_index()
+        logger.info(f"Pruned {stats['objects']} objects ({stats['bytes']} bytes) from {self.store_path}, "
+                    f"and forgot {stats['sources']} sources")
+        return stats
+
+
+    def copy_file(self, source_path: str, destination_path: str, link_modes: Optional[tuple[str, ...]] = None) -> str:
+        """
+        Store a file, then materialize it at the destination.
+        Has the same signature as shutil.copy2, so it can be a copytree copy_function.
+        """
+        self.put(source_path, destination_path, link_modes)
+        return destination_path
+
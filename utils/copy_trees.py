@@ -0,0 +1,251 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import fnmatch
+import os
+import re
+import shutil
+import threading
+from typing import Callable, Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.fast_copy_file import fast_copy2
+from utils.instrumentation import run_in_step_thread
+
+
+# Copying is waiting on the disk (or the network, for network filesystems), not the CPU,
+# so there can be more threads than cores.
+MAX_COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+# Most bytes of file data being copied at once. A file bigger than this is copied on its own.
+MAX_IN_FLIGHT_BYTES = 64 * 1024 * 1024
+# Most files queued or being copied at once, per worker, so a huge tree isn't queued all at once.
+MAX_QUEUED_FILES_PER_WORKER = 64
+# Small files are handed to the pool in batches, so the pool's overhead isn't paid per file.
+BATCH_FILES = 16
+BATCH_BYTES = 1024 * 1024
+
+IGNORE_PATTERNS = ('*.pyc', '__pycache__', '.git', '.github', '.pytest_cache')
+
+
+def copy_trees(trees: dict[str, tuple[str, str]],
+               copy_function: Optional[Callable[[str, str], object]] = None,
+               ignore_patterns: tuple[str, ...] = IGNORE_PATTERNS,
+               max_workers: int = MAX_COPY_WORKERS,
+               max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES
+              ) -> dict[str, dict[str, int]]:
+    """
+    Copy directory trees like shutil.copytree(symlinks=True, dirs_exist_ok=True), with the files of every tree
+    copied at the same time by a thread pool. Copying many small files is mostly waiting on the filesystem,
+    so this scales with how many requests it can serve at once, e.g. on network filesystems.
+
+    Trees are walked with os.scandir in the calling thread, which makes the directories and recreates
+    symlinks as it goes, and hands each file to the pool. The walk waits while too many bytes or files are
+    in flight, so memory stays bounded however big the trees are. Directory permissions and times are
+    copied once all their files are done, like copytree does.
+
+    Example:
+    >>> copy_trees({
+    >>>     "api": ("/modules/core/api", "/programs/my_program/api"),
+    >>>     "database": ("/modules/core/database", "/programs/my_program/database"),
+    >>> }, copy_function=content_store.copy_file)
+    {'api': {'files': 12, 'bytes': 48213, 'directories': 3, 'symlinks': 0}, 'database': {...}}
+
+    Args:
+        trees: Dictionary mapping a name for each tree (e.g. its module) to its (source, destination) folders.
+        copy_function: Copies one file, like shutil.copy2. Called from worker threads, so it must be thread-safe.
+            Defaults to fast_copy2, which copies the data by reflink or in the kernel where possible.
+            See utils/fast_copy_file.py
+        ignore_patterns: Glob patterns of file and folder names to skip, like shutil.ignore_patterns.
+        max_workers: Files copied at the same time.
+        max_in_flight_bytes: Most bytes of file data queued or being copied at once.
+
+    Returns:
+        Dictionary mapping each tree's name to how many 'files', 'bytes', 'directories' and 'symlinks' were copied.
+
+    Raises:
+        OSError: The first error raised while copying, with a note saying which tree it was in.
+            Copies already in progress are finished first, but nothing new is started.
+    """
+    ignore = re.compile("|".join(fnmatch.translate(pattern) for pattern in ignore_patterns)) if ignore_patterns else None
+    stats = {name: {"files": 0, "bytes": 0, "directories": 0, "symlinks": 0} for name in trees}
+    directories: list[tuple[str, str]] = []
+
+    with _CopyPool(copy_function, max_workers, max_in_flight_bytes) as pool:
+        for name, (source_root, destination_root) in trees.items():
+            if pool.failures:
+                break
+            try:
+                for kind, source_path, destination_path, size in _walk_tree(source_root, destination_root, ignore):
+                    if pool.failures:
+                        break
+                    if kind == "directory":
+                        os.makedirs(destination_path, exist_ok=True)
+                        directories.append((source_path, destination_path))
+                        stats[name]["directories"] += 1
+                    elif kind == "symlink":
+                        if os.path.lexists(destination_path):
+                            os.remove(destination_path)
+                        os.symlink(os.readlink(source_path), destination_path)
+                        stats[name]["symlinks"] += 1
+                    else:
+                        pool.add(name, source_path, destination_path, size)
+                        stats[name]["files"] += 1
+                        stats[name]["bytes"] += size
+            except OSError as e:
+                pool.failures.append((name, e))
+        # Leaving the with block waits for every copy to finish.
+
+    if pool.failures:
+        name, exception = pool.failures[0]
+        exception.add_note(f"While copying '{name}' from {trees[name][0]} to {trees[name][1]}")
+        raise exception
+
+    # Deepest first, so copying a directory's times isn't undone by making its subdirectories.
+    for source_path, destination_path in reversed(directories):
+        shutil.copystat(source_path, destination_path)
+    return stats
+
+
+def copy_files(files: list[tuple[str, str, int]],
+               copy_function: Optional[Callable[[str, str], object]] = None,
+               max_workers: int = MAX_COPY_WORKERS,
+               max_in_flight_bytes: int = MAX_IN_FLIGHT_BYTES
+              ) -> None:
+    """
+    Copy files at the same time on a thread pool, like copy_trees, when it's already known which files
+    to copy where. The destination folders must exist.
+
+    Args:
+        files: List of (source path, destination path, size in bytes) tuples.
+        copy_function: Copies one file, like shutil.copy2. Called from worker threads, so it must be thread-safe.
+            Defaults to fast_copy2.
+        max_workers: Files copied at the same time.
+        max_in_flight_bytes: Most bytes of file data queued or being copied at once.
+
+    Raises:
+        OSError: The first error raised while copying, with a note saying which file it was.
+    """
+    with _CopyPool(copy_function, max_workers, max_in_flight_bytes) as pool:
+        for source_path, destination_path, size in files:
+            if pool.failures:
+                break
+            pool.add(source_path, source_path, destination_path, size)
+
+    if pool.failures:
+        source_path, exception = pool.failures[0]
+        exception.add_note(f"While copying {source_path}")
+        raise exception
+
+
+class _CopyPool:
+    """
+    Copies files on a thread pool, handed over in batches, so the pool's overhead isn't paid per file.
+    Adding a file waits while too many bytes or files are in flight. Leaving the with block waits for every copy.
+    After the first failure, nothing new is started, and failures has the (name, exception) of each one.
+    """
+
+    def __init__(self, copy_function: Optional[Callable[[str, str], object]], max_workers: int, max_in_flight_bytes: int) -> None:
+        self.copy_function = copy_function or fast_copy2
+        self.max_workers = max(1, max_workers)
+        self.budget = _CopyBudget(max(1, max_in_flight_bytes), self.max_workers * MAX_QUEUED_FILES_PER_WORKER)
+        self.failures: list[tuple[str, BaseException]] = []
+        self._batch: list[tuple[str, str, str]] = []
+        self._batch_size = 0
+        self._pool: Optional[ThreadPoolExecutor] = None
+
+
+    def __enter__(self) -> '_CopyPool':
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="copy_trees")
+        return self
+
+
+    def __exit__(self, *exc_info) -> None:
+        try:
+            if not self.failures:
+                self._submit()
+        finally:
+            self._pool.shutdown(wait=True)
+
+
+    def add(self, name: str, source_path: str, destination_path: str, size: int) -> None:
+        self._batch.append((name, source_path, destination_path))
+        self._batch_size += size
+        if len(self._batch) >= BATCH_FILES or self._batch_size >= BATCH_BYTES:
+            self._submit()
+
+
+    def _submit(self) -> None:
+        if not self._batch:
+            return
+        batch, size = self._batch, self._batch_size
+        self._batch, self._batch_size = [], 0
+        self.budget.acquire(len(batch), size)
+        # In the caller's context, so utils/instrumentation.py counts the copies, and their CPU time and I/O, as its step's.
+        self._pool.submit(contextvars.copy_context().run, run_in_step_thread, self._copy, batch, size)
+
+
+    def _copy(self, batch: list[tuple[str, str, str]], size: int) -> None:
+        name = None
+        try:
+            for name, source_path, destination_path in batch:
+                if self.failures:
+                    break
+                self.copy_function(source_path, destination_path)
+        except BaseException as e:
+            self.failures.append((name, e))
+        finally:
+            self.budget.release(len(batch), size)
+
+
+def _walk_tree(source_root: str, destination_root: str, ignore: Optional[re.Pattern]):
+    """
+    Yield (kind, source path, destination path, size) for everything in a tree that isn't ignored,
+    each directory before what's in it. kind is 'directory', 'symlink' or 'file'.
+    """
+    yield "directory", source_root, destination_root, 0
+    stack = [(source_root, destination_root)]
+    while stack:
+        source_dir, destination_dir = stack.pop()
+        with os.scandir(source_dir) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
+        for entry in entries:
+            if ignore is not None and ignore.match(entry.name):
+                continue
+            destination_path = os.path.join(destination_dir, entry.name)
+            if entry.is_symlink():
+                yield "symlink", entry.path, destination_path, 0
+            elif entry.is_dir():
+                yield "directory", entry.path, destination_path, 0
+                stack.append((entry.path, destination_path))
+            else:
+                yield "file", entry.path, destination_path, entry.stat().st_size
+
+
+class _CopyBudget:
+    """Blocks the walk while too many bytes or files are in flight."""
+
+    def __init__(self, max_bytes: int, max_files: int) -> None:
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.bytes = 0
+        self.files = 0
+        self._condition = threading.Condition()
+
+
+    def acquire(self, files: int, size: int) -> None:
+        # Something bigger than the whole budget waits until nothing else is in flight.
+        files, size = min(files, self.max_files), min(size, self.max_bytes)
+        with self._condition:
+            self._condition.wait_for(lambda: self.files + files <= self.max_files and self.bytes + size <= self.max_bytes)
+            self.files += files
+            self.bytes += size
+
+
+    def release(self, files: int, size: int) -> None:
+        with self._condition:
+            self.files -= min(files, self.max_files)
+            self.bytes -= min(size, self.max_bytes)
+            self._condition.notify_all()
@@ -0,0 +1,155 @@
+import os
+from typing import Optional
+
+
+from utils.plan_program import GENERATED_FILES, UNPACK_FOLDERS
+
+
+# Rough throughput for estimates. Pass your own to estimate_plan to match your disks and network.
+COPY_BYTES_PER_SECOND = 200 * 1024 * 1024
+SECONDS_PER_FILE = 0.0005 # Opening, creating and stat-ing a file, regardless of its size.
+CLONE_SECONDS = 10.0
+FETCH_SECONDS = 2.0
+EXPORT_SECONDS = 1.0
+
+
+def estimate_plan(plan: dict,
+                  program_path: str,
+                  remote_modules: Optional[dict[str, dict]] = None,
+                  update: bool = False,
+                  copy_bytes_per_second: float = COPY_BYTES_PER_SECOND,
+                  seconds_per_file: float = SECONDS_PER_FILE,
+                  clone_seconds: float = CLONE_SECONDS,
+                  fetch_seconds: float = FETCH_SECONDS,
+                  export_seconds: float = EXPORT_SECONDS
+                 ) -> dict:
+    """
+    List every operation a build would perform, with byte counts and estimated times, without touching disk.
+
+    Example:
+    >>> plan = plan_program(module_sources)
+    >>> estimate = estimate_plan(plan, "/home/user/programs/my_program", pull.find_exports())
+    >>> print(format_estimate(estimate))
+
+    Args:
+        plan: A plan from utils/plan_program.py
+        program_path: Where the program would be made.
+        remote_modules: What pulling each GitHub module would do, from PullRemoteModulesFromGithub.find_exports().
+            Modules that haven't been exported yet aren't in the plan, so their bytes are unknown.
+        update: If True and the program exists, it would be built in staging and then updated in place.
+        copy_bytes_per_second, seconds_per_file, clone_seconds, fetch_seconds, export_seconds:
+            Throughput to estimate with.
+
+    Returns:
+        A dictionary with:
+        - 'program_path': Where the program would be made.
+        - 'exists': Whether something is already there. Without update, the build would fail.
+        - 'operations': Every operation, in order, each a dictionary with its 'operation'
+            (clone, fetch, export, copy, merge, unpack, rename, link, skip, generate or update),
+            'module', 'source', 'destination', 'bytes' (None if unknown) and estimated 'seconds'.
+        - 'files', 'bytes', 'seconds': Totals. 'bytes' doesn't include operations of unknown size.
+        - 'unknown': Names of the modules whose size isn't known until they're pulled.
+    """
+    operations = []
+    unknown = []
+
+    for module_name, remote in (remote_modules or {}).items():
+        if not remote["mirror_exists"]:
+            operations.append(_operation("clone", module_name, remote["url"], remote["mirror_path"], None, clone_seconds))
+        else:
+            operations.append(_operation("fetch", module_name, remote["url"], remote["mirror_path"], None, fetch_seconds))
+        if remote["export_path"] is None:
+            operations.append(_operation("export", module_name, remote["mirror_path"], None, None, export_seconds))
+            unknown.append(module_name)
+
+    for entry in plan["files"]:
+        if entry["symlink"]:
+            operation = "link"
+        elif "renamed_from" in entry:
+            operation = "rename"
+        elif entry["destination"].startswith("utils/shared/") and entry["module"] != "utils":
+            operation = "merge"
+        elif entry["module"] in UNPACK_FOLDERS:
+            operation = "unpack"
+        else:
+            operation = "copy"
+        seconds = seconds_per_file + entry["size"] / copy_bytes_per_second
+        operations.append(_operation(operation, entry["module"], entry["source"], entry["destination"], entry["size"], seconds))
+
+    for entry in plan["skipped"]:
+        operations.append({**_operation("skip", entry["module"], entry["source"], entry["destination"], 0, 0.0),
+                           "reason": entry["reason"]})
+
+    for relative_path in GENERATED_FILES:
+        operations.append(_operation("generate", None, None, relative_path, None, seconds_per_file))
+
+    written = [op for op in operations if op["operation"] not in ("clone", "fetch", "export", "skip")]
+    exists = os.path.exists(program_path)
+    if update and exists:
+        # The operations above are the build in staging. The update then checks each file against the program
+        # and moves it over, which costs a stat and a rename, not another copy. This is the most it costs,
+        # since module files that haven't changed since the last build aren't written at all.
+        operations.append(_operation("update", None, None, program_path, None, len(written) * seconds_per_file))
+
+    return {
+        "program_path": program_path,
+        "exists": exists,
+        "operations": operations,
+        "files": len(written),
+        "bytes": sum(op["bytes"] or 0 for op in operations),
+        "seconds": sum(op["seconds"] for op in operations),
+        "unknown": unknown,
+    }
+
+
+def format_estimate(estimate: dict) -> str:
+    """
+    Format an estimate from estimate_plan as a table, one operation per line, with the totals at the end.
+
+    Example:
+    >>> print(format_estimate(estimate))
+    clone         ?        10.00s  database: https://github.com/the-ride-never-ends/database
+    copy      1.2 KiB       0.00s  api/api.py <- /modules/core/api/api.py
+    ...
+    Total: 214 files, 1.9 MiB, about 12.31s (database not pulled yet, so not counted)
+    """
+    lines = [f"Plan for {estimate['program_path']}"]
+    if estimate["exists"]:
+        lines.append("  NOTE: This program already exists. Without --update, the build will stop here.")
+
+    for op in estimate["operations"]:
+        size = "?" if op["bytes"] is None else format_bytes(op["bytes"])
+        if op["operation"] in ("clone", "fetch", "export"):
+            target = f"{op['module']}: {op['source']}"
+        elif op["source"] is None:
+            target = op["destination"]
+        else:
+            target = f"{op['destination']} <- {op['source']}"
+        if "reason" in op:
+            target += f" ({op['reason']})"
+        lines.append(f"  {op['operation']:<9}{size:>10}  {op['seconds']:>8.2f}s  {target}")
+
+    total = (f"Total: {estimate['files']} files, {format_bytes(estimate['bytes'])}, "
+             f"about {estimate['seconds']:.2f}s")
+    if estimate["unknown"]:
+        total += f" ({', '.join(estimate['unknown'])} not pulled yet, so not counted)"
+    lines.append(total)
+    return "\n".join(lines)
+
+
+def format_bytes(size: int) -> str:
+    """
+    Example:
+    >>> format_bytes(1536)
+    '1.5 KiB'
+    """
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024 or unit == "GiB":
+            return f"{size} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+def _operation(operation: str, module: Optional[str], source: Optional[str],
+               destination: Optional[str], size: Optional[int], seconds: float) -> dict:
+    return {"operation": operation, "module": module, "source": source,
+            "destination": destination, "bytes": size, "seconds": seconds}
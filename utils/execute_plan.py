@@ -0,0 +1,115 @@
+import fnmatch
+import os
+from typing import Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.content_store import ContentStore
+from utils.copy_trees import MAX_COPY_WORKERS, copy_files
+from utils.plan_program import IGNORE_PATTERNS
+
+
+def execute_plan(plan: dict,
+                 program_path: str,
+                 content_store: Optional[ContentStore] = None,
+                 link_modes: Optional[tuple[str, ...]] = None,
+                 max_workers: int = MAX_COPY_WORKERS,
+                 previous_files: Optional[dict[str, dict]] = None
+                ) -> dict[str, dict[str, dict]]:
+    """
+    Write every file in a plan from utils/plan_program.py into the program directory, once,
+    through the content store. Folders and symlinks are made first, then the files are written
+    at the same time on a thread pool. See utils/copy_trees.py
+
+    Example:
+    >>> plan = plan_program(module_sources)
+    >>> written = execute_plan(plan, "/home/user/programs/my_program")
+    >>> written["files"]["main.py"]
+    {'sha256': '2cf24dba5fb0a30e...', 'size': 5, 'mtime_ns': 1731400000000000000, 'module': 'main'}
+    >>> written["symlinks"]["utils/shared/helper.py"]
+    {'target': '../../helpers/helper.py', 'module': 'utils'}
+
+    Args:
+        plan: The plan to write.
+        program_path: The program directory.
+        content_store: The store to write files through. Defaults to the shared store.
+        link_modes: Overrides the store's link modes. See ContentStore.
+        max_workers: Files written at the same time.
+        previous_files: The file entries from the build manifest of the program being updated.
+            Files whose contents are the same as last time aren't written, and their previous entries are returned,
+            so utils/update_program.py leaves them alone. Sources are checked with the content store's index,
+            so an unchanged source is only stat'ed, not read.
+
+    Returns:
+        Dictionary with the build manifest entries for the 'files' and 'symlinks' that were written,
+        keyed by their relative path, with the module each one came from.
+    """
+    content_store = content_store or ContentStore.shared()
+    made_dirs = set()
+    entries = {}
+    symlinks = {}
+
+    for entry in plan["files"]:
+        destination_path = os.path.join(program_path, *entry["destination"].split("/"))
+        directory = os.path.dirname(destination_path)
+        if directory not in made_dirs:
+            os.makedirs(directory, exist_ok=True)
+            made_dirs.add(directory)
+
+        if entry["symlink"]:
+            target = os.readlink(entry["source"])
+            os.symlink(target, destination_path)
+            symlinks[entry["destination"]] = {"target": target, "module": entry["module"]}
+            continue
+        entries[destination_path] = entry
+
+    files = {}
+    previous_files = previous_files or {}
+
+    def write_file(source_path: str, destination_path: str) -> None:
+        # Called from the pool's threads. Each one writes its own key, so the dict needs no lock.
+        entry = entries[destination_path]
+        previous = previous_files.get(entry["destination"])
+        if previous is not None and content_store.add(source_path) == previous["sha256"]:
+            files[entry["destination"]] = {**previous, "module": entry["module"]}
+            return
+        digest, _ = content_store.put(source_path, destination_path, link_modes)
+        st = os.stat(destination_path)
+        files[entry["destination"]] = {
+            "sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "module": entry["module"]
+        }
+
+    copy_files([(entry["source"], destination_path, entry["size"]) for destination_path, entry in entries.items()],
+               copy_function=write_file, max_workers=max_workers)
+
+    content_store.save_index()
+    unchanged = sum(1 for relative_path, entry in files.items()
+                    if entry["sha256"] == previous_files.get(relative_path, {}).get("sha256"))
+    logger.info(f"Wrote {len(files) - unchanged} files to {program_path} ({unchanged} unchanged since the last build)")
+    return {"files": files, "symlinks": symlinks}
+
+
+def store_module_files(module_paths: list[str], content_store: Optional[ContentStore] = None) -> int:
+    """
+    Hash the files in on-disk modules into the content store ahead of time, e.g. while GitHub modules are
+    still being exported. execute_plan then only has to stat them before materializing them.
+
+    Returns:
+        How many files were stored.
+    """
+    content_store = content_store or ContentStore.shared()
+    count = 0
+    for module_path in module_paths:
+        for root, dirs, filenames in os.walk(module_path):
+            dirs[:] = [d for d in dirs if not any(fnmatch.fnmatch(d, pattern) for pattern in IGNORE_PATTERNS)]
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if any(fnmatch.fnmatch(filename, pattern) for pattern in IGNORE_PATTERNS) or os.path.islink(path):
+                    continue
+                content_store.add(path)
+                count += 1
+    content_store.save_index()
+    return count
@@ -0,0 +1,155 @@
+import errno
+import os
+import shutil
+import sys
+import threading
+
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+# Linux ioctl to make dst share src's blocks (btrfs, xfs, bcachefs...). See: man ioctl_ficlone
+FICLONE = 0x40049409
+
+# Ways to copy a file's data, fastest first.
+# - reflink: The copy shares the original's blocks until either is written to, so nothing is copied.
+# - copy_file_range: The kernel copies the data (or the filesystem does, e.g. server-side on NFS), without user space.
+# - sendfile: The kernel copies the data, without user space.
+# - buffered: Read into user space and write back out. Always works.
+COPY_METHODS = ("reflink", "copy_file_range", "sendfile", "buffered")
+
+# Bytes per copy_file_range/sendfile call.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# Errors that mean a method can't copy this file, rather than that the copy failed, so the next method is tried.
+FALLBACK_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY,
+                   errno.EPERM, errno.EBADF, errno.ENOTSOCK}
+
+# Of those, the errors that mean a method isn't supported at all between two filesystems.
+# The others (e.g. EINVAL, EPERM) can depend on the file, so the method is still tried for the next one.
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOSYS, errno.ENOTTY}
+
+# (method, source device, destination device) that failed as unsupported, so they aren't tried again.
+_unsupported: set[tuple[str, int, int]] = set()
+_lock = threading.Lock()
+
+
+def fast_copy_file(source_path: str, destination_path: str, methods: tuple[str, ...] = COPY_METHODS) -> str:
+    """
+    Copy a file's data (not its permissions or times) the fastest way the OS and filesystems allow,
+    trying each of the methods in order. See COPY_METHODS.
+
+    A method that isn't supported between two filesystems is remembered, so copying many files
+    only pays for the failed attempt once. If a method fails or stops short partway through a file,
+    the next one carries on from the last offset a method reached.
+
+    Each copy raises an audit event named after the method it used, e.g. 'fast_copy_file.reflink',
+    so they're counted in build reports. See utils/instrumentation.py
+
+    Example:
+    >>> fast_copy_file("/modules/core/api/api.py", "/programs/my_program/api/api.py")
+    'reflink'
+    >>> fast_copy_file(source_path, destination_path, methods=("copy_file_range", "sendfile", "buffered"))
+    'copy_file_range'
+
+    Args:
+        source_path: The file to copy.
+        destination_path: Where to copy it. Overwritten if it exists.
+        methods: Methods to try, in order.
+
+    Returns:
+        The method that was used.
+
+    Raises:
+        OSError: If copying fails, or none of the methods are supported.
+    """
+    with open(source_path, "rb") as src, open(destination_path, "wb") as dst:
+        src_st, dst_st = os.fstat(src.fileno()), os.fstat(dst.fileno())
+        size = src_st.st_size
+        copied = 0
+        for method in methods:
+            key = (method, src_st.st_dev, dst_st.st_dev)
+            if key in _unsupported:
+                continue
+            try:
+                copied = _COPY_FUNCTIONS[method](src, dst, copied, size)
+            except (AttributeError, OSError) as e:
+                if isinstance(e, OSError) and e.errno not in FALLBACK_ERRNOS:
+                    raise
+                # The next method resumes at offset 'copied', overwriting anything this one wrote past it.
+                if not isinstance(e, OSError) or e.errno in UNSUPPORTED_ERRNOS:
+                    with _lock:
+                        _unsupported.add(key)
+                logger.debug(f"Can't {method} {source_path} from device {src_st.st_dev} to {dst_st.st_dev}: {e}")
+                continue
+            if copied < size:
+                # The source was shorter than it said (e.g. it's still being written). Let the next method finish it.
+                continue
+            sys.audit(f"fast_copy_file.{method}", source_path, destination_path)
+            return method
+    raise OSError(f"Could not copy {source_path} to {destination_path} with any of {methods}")
+
+
+def fast_copy2(source_path: str, destination_path: str) -> str:
+    """
+    Copy a file with fast_copy_file, then its permissions and times, like shutil.copy2.
+    Has the same signature as shutil.copy2, so it can be a copytree copy_function.
+
+    Returns:
+        The destination path.
+    """
+    if os.path.isdir(destination_path):
+        destination_path = os.path.join(destination_path, os.path.basename(source_path))
+    fast_copy_file(source_path, destination_path)
+    shutil.copystat(source_path, destination_path)
+    return destination_path
+
+
+def _reflink(src, dst, copied: int, size: int) -> int:
+    if fcntl is None:
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported on this platform")
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    return size
+
+
+def _copy_file_range(src, dst, copied: int, size: int) -> int:
+    while copied < size:
+        sent = os.copy_file_range(src.fileno(), dst.fileno(), CHUNK_SIZE, copied, copied)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _sendfile(src, dst, copied: int, size: int) -> int:
+    os.lseek(dst.fileno(), copied, os.SEEK_SET)
+    while copied < size:
+        sent = os.sendfile(dst.fileno(), src.fileno(), copied, CHUNK_SIZE)
+        if sent == 0:
+            break
+        copied += sent
+    return copied
+
+
+def _buffered(src, dst, copied: int, size: int) -> int:
+    # Reads to the end, so a file that grew since it was opened is copied whole.
+    src.seek(copied)
+    dst.seek(copied)
+    shutil.copyfileobj(src, dst)
+    dst.flush()
+    return max(size, dst.tell())
+
+
+_COPY_FUNCTIONS = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _sendfile,
+    "buffered": _buffered,
+}
@@ -0,0 +1,235 @@
+from contextvars import ContextVar
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Optional
+
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.shared.get_formatted_datetime import get_formatted_datetime
+
+
+INSTRUMENTATION_REPORT_VERSION = 2
+
+# Audit events that touch a file. See: https://docs.python.org/3/library/audit_events.html
+# and utils/fast_copy_file.py, which raises one per file it copies, named after how it copied it.
+COPY_EVENTS = ("fast_copy_file.reflink", "fast_copy_file.copy_file_range", "fast_copy_file.sendfile",
+               "fast_copy_file.buffered")
+FILE_EVENTS = ("open", "os.rename", "os.remove", "os.link", "os.symlink", "os.mkdir", "os.rmdir",
+               "shutil.copyfile", "shutil.copymode", "shutil.copystat", "os.chmod", "os.utime") + COPY_EVENTS
+COUNTED_EVENTS = FILE_EVENTS + ("os.scandir", "os.listdir", "shutil.rmtree", "subprocess.Popen")
+
+# The metrics of the step running in the current context. Context variables are copied into
+# asyncio tasks and asyncio.to_thread workers, so a step's own threads and tasks are counted too.
+_current_step: ContextVar[Optional[dict]] = ContextVar("_current_step", default=None)
+_audit_hook_lock = threading.Lock()
+_audit_hook_installed = False
+
+
+class Instrumentation:
+    """
+    Measure each pipeline step: wall and CPU time, files touched, bytes read and written, and syscall counts.
+    Then write it all out as a JSON report, to tell whether a slow build is waiting on the network, the disk,
+    or Python itself.
+
+    - Wall and CPU time: CPU time is the step's own thread, plus its worker threads that run through
+      run_in_step_thread (e.g. the copy pool in utils/copy_trees.py), which is also 'worker_cpu_seconds'.
+      Time spent waiting (on git, the network or the disk) is 'wait_seconds', the wall time not spent on the CPU.
+      Work on other threads (e.g. git's own processes) isn't counted, so it shows up as waiting.
+    - Files touched and operations: counted with an audit hook (sys.addaudithook), including in the threads
+      and asyncio tasks a step starts, e.g. the git subprocesses and archive extraction of a pull.
+    - Bytes and syscalls: from /proc/thread-self/io, for the step's own thread and its run_in_step_thread workers.
+      Linux only, otherwise None.
+      'bytes_read'/'bytes_written' count every read()/write(), 'disk_bytes_read'/'disk_bytes_written'
+      only what reached the disk.
+
+    Audit hooks can't be removed, so the hook is installed once and does nothing outside of a measured step.
+
+    Example:
+    >>> instrumentation = Instrumentation()
+    >>> pipeline = Pipeline(instrumentation=instrumentation, name="my_program")
+    >>> ...
+    >>> instrumentation.write_report("build_report.json")
+    """
+
+    def __init__(self) -> None:
+        # Program name -> step name -> metrics
+        self.programs: dict[str, dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._process_started = _get_process_usage()
+        _install_audit_hook()
+
+
+    def measure(self, program_name: str, step_name: str, function: Callable, /, *args, **kwargs) -> Any:
+        """
+        Call a function, recording its metrics as a step of a program. Call it from the thread the step runs in.
+
+        Returns:
+            Whatever the function returns.
+        """
+        # The step's own threads and tasks all count into this, so it has a lock.
+        metrics = {"operations": {}, "files_touched": set(), "lock": threading.Lock(),
+                   "worker_cpu_seconds": 0.0, "worker_io": {}}
+        io_started = _read_thread_io()
+        token = _current_step.set(metrics)
+        cpu_started = time.thread_time()
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            result = function(*args, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            wall_seconds = time.perf_counter() - started
+            _current_step.reset(token)
+            with metrics["lock"]:
+                worker_cpu_seconds = metrics["worker_cpu_seconds"]
+                worker_io = dict(metrics["worker_io"])
+            cpu_seconds = time.thread_time() - cpu_started + worker_cpu_seconds
+            io = _diff_io(io_started, _read_thread_io())
+            io = {field: value + worker_io.get(field, 0) if value is not None else None for field, value in io.items()}
+            step = {
+                "succeeded": succeeded,
+                "wall_seconds": round(wall_seconds, 6),
+                "cpu_seconds": round(cpu_seconds, 6),
+                "worker_cpu_seconds": round(worker_cpu_seconds, 6),
+                # Workers running at once can use more CPU time than wall time.
+                "wait_seconds": round(max(0.0, wall_seconds - cpu_seconds), 6),
+                "files_touched": len(metrics["files_touched"]),
+                "operations": dict(sorted(metrics["operations"].items())),
+                **io,
+            }
+            with self._lock:
+                self.programs.setdefault(program_name, {})[step_name] = step
+
+
+    def report(self) -> dict:
+        """
+        Get everything measured so far.
+
+        Returns:
+            A dictionary with the report 'version', when it was 'created', each program's steps
+            under 'programs', and the whole run under 'process' (including the CPU time of child processes like git).
+        """
+        with self._lock:
+            programs = {name: dict(steps) for name, steps in self.programs.items()}
+        process = _diff_usage(self._process_started, _get_process_usage())
+        process["wall_seconds"] = round(time.perf_counter() - self._started, 6)
+        return {
+            "version": INSTRUMENTATION_REPORT_VERSION,
+            "created": get_formatted_datetime(),
+            "programs": programs,
+            "process": process,
+        }
+
+
+    def write_report(self, report_path: str) -> dict:
+        """Write the report as JSON. Returns the report."""
+        report = self.report()
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote instrumentation report to {report_path}")
+        return report
+
+
+def run_in_step_thread(function: Callable, /, *args, **kwargs) -> Any:
+    """
+    Call a function on one of a step's worker threads, adding the thread's CPU time, bytes and syscalls
+    to the step's. Run it in a copy of the step's context, so the step is known. Outside of a step, just calls it.
+
+    Example:
+    >>> pool.submit(contextvars.copy_context().run, run_in_step_thread, copy_batch, batch)
+    """
+    metrics = _current_step.get()
+    if metrics is None:
+        return function(*args, **kwargs)
+    io_started = _read_thread_io()
+    cpu_started = time.thread_time()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        cpu_seconds = time.thread_time() - cpu_started
+        io = _diff_io(io_started, _read_thread_io())
+        with metrics["lock"]:
+            metrics["worker_cpu_seconds"] += cpu_seconds
+            for field, value in io.items():
+                if value is not None:
+                    metrics["worker_io"][field] = metrics["worker_io"].get(field, 0) + value
+
+
+def _install_audit_hook() -> None:
+    global _audit_hook_installed
+    with _audit_hook_lock:
+        if not _audit_hook_installed:
+            sys.addaudithook(_audit_hook)
+            _audit_hook_installed = True
+
+
+def _audit_hook(event: str, args: tuple) -> None:
+    metrics = _current_step.get()
+    if metrics is None or event not in COUNTED_EVENTS:
+        return
+    paths = []
+    if event in FILE_EVENTS and args and isinstance(args[0], (str, bytes, os.PathLike)):
+        paths.append(os.fsdecode(args[0]))
+        if event in ("os.rename", "os.link", "os.symlink", "shutil.copyfile") + COPY_EVENTS and len(args) > 1 \
+                and isinstance(args[1], (str, bytes, os.PathLike)):
+            paths.append(os.fsdecode(args[1]))
+    # A read-modify-write, so without the lock, two threads counting at once could lose one.
+    with metrics["lock"]:
+        operations = metrics["operations"]
+        operations[event] = operations.get(event, 0) + 1
+        metrics["files_touched"].update(paths)
+
+
+def _read_thread_io() -> Optional[dict[str, int]]:
+    # Outside of the step's context, so the audit hook doesn't count reading it.
+    token = _current_step.set(None)
+    try:
+        return _read_io("/proc/thread-self/io")
+    finally:
+        _current_step.reset(token)
+
+
+def _read_io(path: str) -> Optional[dict[str, int]]:
+    try:
+        with open(path, "r") as f:
+            return {key: int(value) for key, value in (line.split(": ") for line in f.read().splitlines())}
+    except (OSError, ValueError):
+        return None
+
+
+def _diff_io(before: Optional[dict[str, int]], after: Optional[dict[str, int]]) -> dict[str, Optional[int]]:
+    fields = {"bytes_read": "rchar", "bytes_written": "wchar", "read_syscalls": "syscr", "write_syscalls": "syscw",
+              "disk_bytes_read": "read_bytes", "disk_bytes_written": "write_bytes"}
+    if before is None or after is None:
+        return {field: None for field in fields}
+    return {field: after.get(key, 0) - before.get(key, 0) for field, key in fields.items()}
+
+
+def _get_process_usage() -> dict:
+    usage = {"cpu_seconds": time.process_time(), "io": _read_io("/proc/self/io")}
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        usage["child_cpu_seconds"] = children.ru_utime + children.ru_stime
+    return usage
+
+
+def _diff_usage(before: dict, after: dict) -> dict:
+    usage = {"cpu_seconds": round(after["cpu_seconds"] - before["cpu_seconds"], 6)}
+    if "child_cpu_seconds" in after:
+        usage["child_cpu_seconds"] = round(after["child_cpu_seconds"] - before["child_cpu_seconds"], 6)
+    usage.update(_diff_io(before["io"], after["io"]))
+    return usage
@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+from typing import Optional
+
+
+import yaml
+
+
+from config.config import PROJECT_ROOT
+
+
+def load_github_urls(yaml_path: Optional[str] = None) -> dict[str, dict]:
+    """
+    Load the GitHub modules and their clone options from the URL YAML file.
+
+    Each module is either a URL, or a mapping with a 'url' and optional clone options:
+    - depth (int): Only fetch this many commits, e.g. 1 for just the latest.
+    - filter (str): A git partial clone filter, e.g. 'blob:none' to only download file contents when needed.
+        Only worth it with paths, since exporting a whole module from a partial clone fetches every file lazily.
+    - paths (list[str]): Only export these files/folders into the program (sparse checkout).
+    - depends_on (list[str]): Other modules this one needs. They're added to the program automatically.
+
+    Example:
+    >>> # _github_urls_for_modules.yaml
+    >>> api: "https://github.com/the-ride-never-ends/api"
+    >>> llm_engine:
+    >>>   url: "https://github.com/the-ride-never-ends/llm_engine"
+    >>>   depth: 1
+    >>>   filter: "blob:none"
+    >>>   paths: ["llm_engine", "requirements.txt", "utils/shared"]
+    >>> load_github_urls()
+    {'api': {'url': 'https://github.com/the-ride-never-ends/api'},
+     'llm_engine': {'url': 'https://github.com/the-ride-never-ends/llm_engine', 'depth': 1,
+                    'filter': 'blob:none', 'paths': ['llm_engine', 'requirements.txt', 'utils/shared']}}
+
+    Args:
+        yaml_path: Path to the YAML file. Defaults to 'github_urls_for_modules.yaml' in the project root,
+            or its template '_github_urls_for_modules.yaml' if that hasn't been renamed yet.
+
+    Returns:
+        Dictionary mapping module names to their options. Every module has a 'url'.
+
+    Raises:
+        ValueError: If the file isn't a dictionary or a module's options are invalid.
+    """
+    yaml_path = yaml_path or find_github_urls_yaml()
+    with open(yaml_path) as f:
+        urls = yaml.safe_load(f)
+
+    if not isinstance(urls, dict):
+        raise ValueError("YAML file must contain a dictionary")
+
+    modules = {}
+    for module_name, options in urls.items():
+        if isinstance(options, str):
+            options = {"url": options}
+        if not isinstance(options, dict) or not isinstance(options.get("url"), str):
+            raise ValueError(f"Module '{module_name}' must be a URL or a mapping with a 'url'")
+
+        depth = options.get("depth")
+        if depth is not None and (not isinstance(depth, int) or depth < 1):
+            raise ValueError(f"'depth' for module '{module_name}' must be a positive integer, not {depth!r}")
+
+        filter_spec = options.get("filter")
+        if filter_spec is not None and not isinstance(filter_spec, str):
+            raise ValueError(f"'filter' for module '{module_name}' must be a string, not {filter_spec!r}")
+
+        paths = options.get("paths")
+        if paths is not None and (not isinstance(paths, list) or not all(isinstance(path, str) for path in paths)):
+            raise ValueError(f"'paths' for module '{module_name}' must be a list of strings, not {paths!r}")
+
+        depends_on = options.get("depends_on")
+        if depends_on is not None and (not isinstance(depends_on, list) or not all(isinstance(name, str) for name in depends_on)):
+            raise ValueError(f"'depends_on' for module '{module_name}' must be a list of module names, not {depends_on!r}")
+
+        modules[module_name] = {key: value for key, value in options.items() if value is not None}
+    return modules
+
+
+def find_github_urls_yaml() -> Path:
+    """
+    Get the path of the URL YAML file: 'github_urls_for_modules.yaml' in the project root,
+    or its template '_github_urls_for_modules.yaml' if that hasn't been renamed yet.
+    """
+    yaml_path = Path(PROJECT_ROOT) / "github_urls_for_modules.yaml"
+    if not os.path.exists(yaml_path):
+        yaml_path = Path(PROJECT_ROOT) / "_github_urls_for_modules.yaml"
+    return yaml_path
@@ -0,0 +1,85 @@
+import json
+import os
+from typing import Optional
+
+
+import yaml
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+def load_manifest(manifest_path: str, default_output_root: Optional[str] = None) -> list[dict]:
+    """
+    Load a batch manifest listing the programs to generate.
+
+    The manifest can be YAML (.yaml/.yml) or JSON (.json). It is either a list of programs,
+    or a dictionary with a 'programs' list and an optional 'output_root' default.
+
+    Example:
+    >>> # manifest.yaml
+    >>> output_root: /srv/generated
+    >>> programs:
+    >>>   - name: billing_service
+    >>>     modules: [api, database]
+    >>>   - name: scraper
+    >>>     modules: [llm_engine]
+    >>>     output_root: /srv/scrapers
+    >>> load_manifest("manifest.yaml")
+    [{'name': 'billing_service', 'modules': ['api', 'database'], 'output_root': '/srv/generated'},
+     {'name': 'scraper', 'modules': ['llm_engine'], 'output_root': '/srv/scrapers'}]
+
+    Args:
+        manifest_path: Path to the manifest file.
+        default_output_root: Output root for programs that don't set one and the manifest has no default.
+
+    Returns:
+        A list of program dictionaries with the keys 'name', 'modules' and 'output_root'.
+
+    Raises:
+        ValueError: If the manifest is malformed or lists the same program twice.
+    """
+    with open(manifest_path, "r") as f:
+        if manifest_path.endswith(".json"):
+            manifest = json.load(f)
+        else:
+            manifest = yaml.safe_load(f)
+
+    if isinstance(manifest, list):
+        manifest = {"programs": manifest}
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("programs"), list):
+        raise ValueError(f"Manifest must be a list of programs or a dictionary with a 'programs' list: {manifest_path}")
+
+    output_root = manifest.get("output_root", default_output_root)
+
+    programs = []
+    seen = set()
+    for idx, program in enumerate(manifest["programs"]):
+        if not isinstance(program, dict) or not program.get("name"):
+            raise ValueError(f"Program #{idx} in {manifest_path} has no 'name'")
+
+        modules = program.get("modules") or []
+        if isinstance(modules, str):
+            modules = [module for module in modules.split(",") if module.strip()]
+        if not isinstance(modules, list):
+            raise ValueError(f"'modules' for program '{program['name']}' must be a list or comma-separated string")
+
+        program_root = program.get("output_root", output_root)
+        if program_root:
+            program_root = os.path.expanduser(str(program_root))
+
+        # Two entries writing to the same folder would clobber each other.
+        key = (program_root, str(program["name"]))
+        if key in seen:
+            raise ValueError(f"Program '{program['name']}' is listed more than once for output root '{program_root}'")
+        seen.add(key)
+
+        programs.append({
+            "name": str(program["name"]),
+            "modules": [str(module) for module in modules],
+            "output_root": program_root,
+        })
+
+    logger.info(f"Loaded {len(programs)} programs from manifest {manifest_path}")
+    return programs
@@ -0,0 +1,161 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import shutil
+from typing import Callable, Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.copy_trees import MAX_COPY_WORKERS, copy_files
+from utils.instrumentation import run_in_step_thread
+from utils.shared.make_sha256_file_hash import make_sha256_file_hash
+
+
+IGNORED_NAMES = ('.git', '.gitignore')
+
+
+def merge_trees(sources: dict[str, str],
+                destination_path: str,
+                ignored_names: tuple[str, ...] = IGNORED_NAMES,
+                copy_function: Optional[Callable[[str, str], object]] = None,
+                max_workers: int = MAX_COPY_WORKERS
+               ) -> dict:
+    """
+    Merge several directory trees into one, without overwriting anything. What's already in the destination wins,
+    then the sources in the order given. Files with the same contents at the same path don't collide:
+    they're only copied once.
+
+    The destination and every source are walked once, at the same time, into in-memory indexes.
+    Collisions are resolved on the indexes, without touching the disk again (except to hash files
+    that might be the same), and then the files are copied at the same time. See utils/copy_trees.py
+
+    - A directory that's in several trees is merged.
+    - A file or symlink whose path is already taken is deduplicated if it has the same contents
+      (or points to the same place), and skipped otherwise.
+    - A file where there's already a directory (or the other way round) is skipped, with everything under it.
+
+    Example:
+    >>> merge_trees({
+    >>>     "api": "/programs/my_program/api/utils/shared",
+    >>>     "database": "/programs/my_program/database/utils/shared",
+    >>> }, "/programs/my_program/utils/shared")
+    {'files': 14, 'bytes': 50210, 'directories': 2, 'symlinks': 0,
+     'deduplicated': [{'module': 'database', 'path': 'make_id.py'}],
+     'skipped': [{'module': 'database', 'path': 'safe_format.py', 'reason': "'api' already has safe_format.py"}]}
+
+    Args:
+        sources: Dictionary mapping a name for each tree (e.g. its module) to its folder, in order of priority.
+        destination_path: Folder to merge them into. Made if it doesn't exist.
+        ignored_names: File and folder names to leave out, wherever they are in a tree.
+        copy_function: Copies one file, like shutil.copy2. Called from worker threads, so it must be thread-safe.
+            Defaults to fast_copy2.
+        max_workers: Trees walked, and files copied, at the same time.
+
+    Returns:
+        Dictionary with how many 'files', 'bytes', 'directories' and 'symlinks' were copied,
+        and the 'deduplicated' and 'skipped' paths of each source.
+
+    Raises:
+        OSError: The first error raised while walking or copying.
+    """
+    roots = {None: destination_path, **sources}
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(roots))), thread_name_prefix="merge_trees") as pool:
+        # In the caller's context, so utils/instrumentation.py counts the walks, and their CPU time and I/O, as its step's.
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, run_in_step_thread, _index_tree, root, ignored_names)
+            for name, root in roots.items()
+        }
+        indexes = {name: future.result() for name, future in futures.items()}
+
+    # relative path -> (owner, entry). The owner is None for what was already in the destination.
+    merged = {relative_path: (None, entry) for relative_path, entry in indexes.pop(None).items()}
+    hashes: dict[str, str] = {}
+    directories, symlinks, files = [], [], []
+    result = {"files": 0, "bytes": 0, "directories": 0, "symlinks": 0, "deduplicated": [], "skipped": []}
+
+    for name, index in indexes.items():
+        for relative_path, entry in index.items():
+            parent = relative_path.rpartition("/")[0]
+            if parent and merged.get(parent, (None, {}))[1].get("kind") != "directory":
+                # Under a directory that was skipped, which has already been reported.
+                continue
+
+            if relative_path not in merged:
+                merged[relative_path] = (name, entry)
+                destination = os.path.join(destination_path, relative_path)
+                if entry["kind"] == "directory":
+                    directories.append((entry["path"], destination))
+                elif entry["kind"] == "symlink":
+                    symlinks.append((entry["path"], destination))
+                else:
+                    files.append((entry["path"], destination, entry["size"]))
+                    result["bytes"] += entry["size"]
+                continue
+
+            owner, existing = merged[relative_path]
+            if existing["kind"] == entry["kind"] == "directory":
+                continue
+            if existing["kind"] == entry["kind"] and _same_contents(existing, entry, hashes):
+                result["deduplicated"].append({"module": name, "path": relative_path})
+                continue
+            owner = f"'{owner}'" if owner is not None else "The destination"
+            reason = f"{owner} already has {relative_path}" if existing["kind"] == entry["kind"] \
+                else f"{owner} already has {relative_path} as a {existing['kind']}, not a {entry['kind']}"
+            result["skipped"].append({"module": name, "path": relative_path, "reason": reason})
+
+    os.makedirs(destination_path, exist_ok=True)
+    for _, destination in directories:
+        os.makedirs(destination, exist_ok=True)
+    for source, destination in symlinks:
+        os.symlink(os.readlink(source), destination)
+    copy_files(files, copy_function=copy_function, max_workers=max_workers)
+    # Deepest first, so copying a directory's times isn't undone by making its subdirectories.
+    for source, destination in reversed(directories):
+        shutil.copystat(source, destination)
+
+    result.update(files=len(files), directories=len(directories), symlinks=len(symlinks))
+    return result
+
+
+def _index_tree(root: str, ignored_names: tuple[str, ...]) -> dict[str, dict]:
+    """
+    Map the relative path of everything in a tree to its 'kind' ('directory', 'symlink' or 'file'), 'path' and 'size',
+    each directory before what's in it. Empty if the tree doesn't exist.
+    """
+    index = {}
+    stack = [("", root)]
+    while stack:
+        relative_dir, directory = stack.pop()
+        try:
+            with os.scandir(directory) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+        except FileNotFoundError:
+            if directory == root:
+                return index
+            raise
+        for entry in entries:
+            if entry.name in ignored_names:
+                continue
+            relative_path = f"{relative_dir}{entry.name}"
+            if entry.is_symlink():
+                index[relative_path] = {"kind": "symlink", "path": entry.path, "size": 0}
+            elif entry.is_dir():
+                index[relative_path] = {"kind": "directory", "path": entry.path, "size": 0}
+                stack.append((f"{relative_path}/", entry.path))
+            else:
+                index[relative_path] = {"kind": "file", "path": entry.path, "size": entry.stat().st_size}
+    return index
+
+
+def _same_contents(a: dict, b: dict, hashes: dict[str, str]) -> bool:
+    if a["kind"] == "symlink":
+        return os.readlink(a["path"]) == os.readlink(b["path"])
+    if a["size"] != b["size"]:
+        return False
+    for entry in (a, b):
+        if entry["path"] not in hashes:
+            hashes[entry["path"]] = make_sha256_file_hash(entry["path"])
+    return hashes[a["path"]] == hashes[b["path"]]
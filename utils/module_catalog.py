@@ -0,0 +1,201 @@
+import json
+import os
+import tempfile
+from typing import Optional
+
+
+from config.config import CUSTOM_MODULES_FOLDER, PROJECT_ROOT
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.load_github_urls import find_github_urls_yaml, load_github_urls
+
+
+MODULE_CATALOG_PATH = os.path.join(PROJECT_ROOT, "cache", "module_catalog.json")
+MODULE_CATALOG_VERSION = 3
+
+# Files in a module folder that its catalog entry is made from.
+WATCHED_FILES = ("requirements.txt", "README.md", "dependencies.txt")
+
+
+def load_module_catalog(modules_folder: str = CUSTOM_MODULES_FOLDER,
+                        catalog_path: str = MODULE_CATALOG_PATH,
+                        yaml_path: Optional[str] = None
+                       ) -> dict:
+    """
+    Load the catalog of every module on disk and on GitHub, only rescanning what changed since it was last saved.
+
+    Module folders are laid out as modules_folder/<category>/<module>. A category is only listed again
+    if its mtime changed (a module was added, removed or renamed). A module's WATCHED_FILES are only stat'ed
+    if its folder's mtime changed, and it's only described again if one of theirs did too. The URL YAML file
+    is only parsed again if its mtime changed. If nothing changed, loading is one stat per category and module.
+
+    Editing a file in place doesn't change its folder's mtime, so an edit to a WATCHED_FILES file is only
+    picked up once its folder changes, e.g. when the file is saved by replacing it, as most editors and git do.
+    Delete the catalog to rescan every module.
+
+    Example:
+    >>> catalog = load_module_catalog()
+    >>> catalog["disk"]["api"]
+    {'path': '/modules/core/api', 'category': 'core', 'mtime_ns': 1731400000000000000,
+     'requirements': ['aiohttp', 'pydantic'], 'dependencies': ['logger'],
+     'description': 'Async API client with retries.', 'mtimes': {...}}
+    >>> catalog["github"]["modules"]["llm_engine"]
+    {'url': 'https://github.com/the-ride-never-ends/llm_engine', 'depth': 1}
+
+    Args:
+        modules_folder: The custom modules folder.
+        catalog_path: Where to keep the catalog between runs.
+        yaml_path: The URL YAML file. Defaults to the one load_github_urls would use.
+
+    Returns:
+        A dictionary with:
+        - 'top_level': Names of everything directly in modules_folder.
+        - 'disk': Dictionary mapping each on-disk module name to its 'path', 'category', 'mtime_ns',
+            'requirements' (lines of its requirements.txt), 'dependencies' (module names in its dependencies.txt.
+            See utils/module_graph.py) and 'description' (first line of its README.md).
+            If two categories have a module with the same name, the last one wins.
+        - 'github': Dictionary with the GitHub 'modules' from the URL YAML file, or the 'error' if it couldn't be loaded.
+    """
+    catalog = _read_catalog(catalog_path, modules_folder)
+    changed = False
+
+    # Top-level folder and categories.
+    categories = catalog["categories"]
+    try:
+        top_level = _list_directory(modules_folder)
+    except FileNotFoundError:
+        logger.warning(f"Custom modules folder not found: {modules_folder}")
+        top_level = []
+    if top_level != catalog["top_level"]:
+        catalog["top_level"] = top_level
+        changed = True
+
+    modules = {}
+    for category in top_level:
+        category_path = os.path.join(modules_folder, category)
+        mtime_ns = _get_mtime_ns(category_path, directory=True)
+        if mtime_ns is None:
+            continue
+        cached = categories.get(category)
+        if cached is None or cached["mtime_ns"] != mtime_ns:
+            categories[category] = {"mtime_ns": mtime_ns, "modules": _list_directory(category_path, directories_only=True)}
+            changed = True
+        for name in categories[category]["modules"]:
+            modules[os.path.join(category_path, name)] = (category, name)
+
+    for category in list(categories):
+        if category not in top_level:
+            del categories[category]
+            changed = True
+
+    # Modules.
+    entries = catalog["modules"]
+    disk = {}
+    for module_path, (category, name) in modules.items():
+        mtime_ns = _get_mtime_ns(module_path, directory=True)
+        if mtime_ns is None:
+            continue
+        entry = entries.get(module_path)
+        if entry is None or entry["mtime_ns"] != mtime_ns:
+            mtimes = _get_module_mtimes(module_path, mtime_ns)
+            if entry is None or entry["mtimes"] != {**mtimes, ".": entry["mtime_ns"]}:
+                entry = _describe_module(module_path, category, mtimes)
+            else:
+                # Something else in the folder changed, e.g. a file was added. The entry is still right.
+                entry = {**entry, "mtime_ns": mtime_ns, "mtimes": mtimes}
+            entries[module_path] = entry
+            changed = True
+        disk[name] = entry
+
+    for module_path in list(entries):
+        if module_path not in modules:
+            del entries[module_path]
+            changed = True
+
+    # GitHub modules.
+    yaml_path = str(yaml_path or find_github_urls_yaml())
+    yaml_mtime_ns = _get_mtime_ns(yaml_path)
+    github = catalog["github"]
+    if github.get("path") != yaml_path or github.get("mtime_ns") != yaml_mtime_ns or yaml_mtime_ns is None:
+        try:
+            github = {"path": yaml_path, "mtime_ns": yaml_mtime_ns, "modules": load_github_urls(yaml_path), "error": None}
+        except Exception as e:
+            # Don't remember a failure, so it's retried next time.
+            github = {"path": yaml_path, "mtime_ns": None, "modules": {}, "error": str(e)}
+        catalog["github"] = github
+        changed = True
+
+    if changed:
+        _write_catalog(catalog_path, catalog)
+        logger.debug(f"Updated module catalog at {catalog_path}")
+
+    return {"top_level": catalog["top_level"], "disk": disk, "github": github}
+
+
+def _read_catalog(catalog_path: str, modules_folder: str) -> dict:
+    empty = {"version": MODULE_CATALOG_VERSION, "modules_folder": modules_folder,
+             "top_level": None, "categories": {}, "modules": {}, "github": {}}
+    try:
+        with open(catalog_path, "r") as f:
+            catalog = json.load(f)
+    except FileNotFoundError:
+        return empty
+    except Exception as e:
+        logger.warning(f"Could not load module catalog, rescanning modules: {e}")
+        return empty
+
+    if not isinstance(catalog, dict) or catalog.get("version") != MODULE_CATALOG_VERSION \
+            or catalog.get("modules_folder") != modules_folder:
+        return empty
+    return catalog
+
+
+def _write_catalog(catalog_path: str, catalog: dict) -> None:
+    # Write to a temporary file, then rename, so a crash never leaves half a catalog.
+    os.makedirs(os.path.dirname(catalog_path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(catalog_path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(catalog, f)
+    os.replace(temp_path, catalog_path)
+
+
+def _list_directory(path: str, directories_only: bool = False) -> list[str]:
+    with os.scandir(path) as entries:
+        return sorted(entry.name for entry in entries if not directories_only or entry.is_dir())
+
+
+def _get_mtime_ns(path: str, directory: bool = False) -> Optional[int]:
+    try:
+        st = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if directory and not os.path.isdir(path):
+        return None
+    return st.st_mtime_ns
+
+
+def _get_module_mtimes(module_path: str, mtime_ns: int) -> dict[str, Optional[int]]:
+    return {".": mtime_ns, **{name: _get_mtime_ns(os.path.join(module_path, name)) for name in WATCHED_FILES}}
+
+
+def _describe_module(module_path: str, category: str, mtimes: dict[str, Optional[int]]) -> dict:
+    requirements = _read_lines(module_path, "requirements.txt") if mtimes["requirements.txt"] is not None else []
+    dependencies = _read_lines(module_path, "dependencies.txt") if mtimes["dependencies.txt"] is not None else []
+
+    description = ""
+    if mtimes["README.md"] is not None:
+        with open(os.path.join(module_path, "README.md"), "r", errors="replace") as f:
+            description = next((line.strip() for line in f if line.strip() and not line.startswith("#")), "")
+
+    # No size: edits in nested folders don't change the module folder's mtime, so a cached one would go stale.
+    return {"path": module_path, "category": category, "mtime_ns": mtimes["."],
+            "requirements": requirements, "dependencies": [dependency.lower() for dependency in dependencies],
+            "description": description, "mtimes": mtimes}
+
+
+def _read_lines(module_path: str, filename: str) -> list[str]:
+    """Read the non-empty, non-comment lines of a file in a module."""
+    with open(os.path.join(module_path, filename), "r", errors="replace") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
@@ -0,0 +1,82 @@
+from collections.abc import Iterable
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+def get_module_dependencies(catalog: dict) -> dict[str, list[str]]:
+    """
+    Get what every module in a module catalog depends on.
+    On-disk modules list theirs in a dependencies.txt, one module name per line.
+    GitHub modules list theirs under 'depends_on' in the URL YAML file.
+    A GitHub module replaces an on-disk module with the same name, like it does in ChooseModule.
+
+    Example:
+    >>> get_module_dependencies(load_module_catalog())
+    {'api': [], 'database': [], 'llm_engine': ['api', 'database'], ...}
+    """
+    dependencies = {name.lower(): list(entry.get("dependencies", [])) for name, entry in catalog["disk"].items()}
+    for name, options in catalog["github"]["modules"].items():
+        dependencies[name.lower()] = [dependency.lower() for dependency in options.get("depends_on", [])]
+    return dependencies
+
+
+def resolve_dependencies(modules: Iterable[str], dependencies: dict[str, list[str]]) -> list[str]:
+    """
+    Add everything the modules depend on, directly or indirectly, in an order where
+    every module comes after its dependencies.
+
+    Example:
+    >>> resolve_dependencies(["llm_engine"], {"llm_engine": ["api", "database"], "api": ["logger"], ...})
+    ['database', 'logger', 'api', 'llm_engine']
+
+    Raises:
+        ValueError: If a dependency isn't a known module, or the dependencies have a cycle.
+    """
+    closure = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module in closure:
+            continue
+        if module not in dependencies:
+            raise ValueError(f"Unknown module: {module}")
+        closure.add(module)
+        for dependency in dependencies[module]:
+            if dependency not in dependencies:
+                raise ValueError(f"Module '{module}' depends on '{dependency}', which isn't available")
+            pending.append(dependency)
+
+    return [module for wave in topological_waves(closure, dependencies) for module in wave]
+
+
+def topological_waves(modules: Iterable[str], dependencies: dict[str, list[str]]) -> list[list[str]]:
+    """
+    Group modules into waves, where every module only depends on modules in earlier waves.
+    The modules in a wave don't depend on each other, so they can be pulled at the same time.
+    Dependencies outside of the given modules are ignored.
+
+    Example:
+    >>> topological_waves(["api", "database", "llm_engine", "logger"], {"llm_engine": ["api", "database"], "api": ["logger"], ...})
+    [['database', 'logger'], ['api'], ['llm_engine']]
+
+    Raises:
+        ValueError: If the dependencies have a cycle.
+    """
+    modules = set(modules)
+    remaining = {
+        module: {dependency for dependency in dependencies.get(module, []) if dependency in modules and dependency != module}
+        for module in modules
+    }
+    waves = []
+    while remaining:
+        wave = sorted(module for module, waiting_on in remaining.items() if not waiting_on)
+        if not wave:
+            raise ValueError(f"Modules have a dependency cycle: {', '.join(sorted(remaining))}")
+        waves.append(wave)
+        for module in wave:
+            del remaining[module]
+        for waiting_on in remaining.values():
+            waiting_on.difference_update(wave)
+    return waves
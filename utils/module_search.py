@@ -0,0 +1,130 @@
+from bisect import bisect_left
+from itertools import islice
+import re
+
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+# Below this trigram similarity, a name isn't offered as a fuzzy match.
+MIN_FUZZY_SIMILARITY = 0.3
+
+
+class ModuleSearchIndex:
+    """
+    An in-memory index over module names, descriptions and tags, for prefix completion and fuzzy search.
+
+    Names and description words are kept in one sorted list, so a prefix is found by binary search
+    (the same lookups as a trie, without the per-node dictionaries). Names are also indexed by their
+    trigrams, so a typo like 'dtabase' still finds 'database' without comparing against every module.
+    Both are built once. A lookup over a few hundred modules takes well under a millisecond.
+
+    Example:
+    >>> index = ModuleSearchIndex({
+    >>>     "database": {"description": "MySQL connection pool.", "tags": ["core", "disk"]},
+    >>>     "llm_engine": {"description": "Prompts and LLM clients.", "tags": ["github"]},
+    >>> })
+    >>> index.complete("da")
+    ['database']
+    >>> index.search("dtabase")
+    [('database', 0.218)]
+    >>> index.search("tag:github prompts")
+    [('llm_engine', 0.5)]
+    """
+
+    def __init__(self, modules: dict[str, dict]) -> None:
+        """
+        Args:
+            modules: Dictionary mapping module names to a dictionary with their 'description' and 'tags'.
+                Both are optional.
+        """
+        self.modules: dict[str, dict] = modules
+        self.names: list[str] = sorted(modules)
+        self.tags: dict[str, set[str]] = {}
+        # (word, module name) pairs, sorted, for prefix lookups on names and description words.
+        words = set()
+        self.trigrams: dict[str, set[str]] = {}
+
+        for name, module in modules.items():
+            for tag in module.get("tags", []):
+                self.tags.setdefault(tag.lower(), set()).add(name)
+            words.add((name, name))
+            for word in WORD_PATTERN.findall(f"{name.replace('_', ' ')} {module.get('description', '')}".lower()):
+                words.add((word, name))
+            for trigram in _trigrams(name):
+                self.trigrams.setdefault(trigram, set()).add(name)
+
+        self.words: list[tuple[str, str]] = sorted(words)
+
+
+    def complete(self, prefix: str) -> list[str]:
+        """Get the module names that start with a prefix, in alphabetical order."""
+        prefix = prefix.lower()
+        start = bisect_left(self.names, prefix)
+        matches = []
+        for name in islice(self.names, start, None):
+            if not name.startswith(prefix):
+                break
+            matches.append(name)
+        return matches
+
+
+    def search(self, query: str, limit: int = 10) -> list[tuple[str, float]]:
+        """
+        Find modules matching a query, best first.
+
+        The query is space-separated terms. 'tag:<tag>' terms keep only modules with that tag.
+        Other terms are scored against each module: an exact name scores 1, a name prefix 0.8,
+        a word in the name or description starting with the term 0.5, and a name that's close
+        to the term (by trigram similarity) up to 0.4. A module's score is the average over the terms.
+
+        Returns:
+            List of (module name, score) tuples, at most limit long.
+        """
+        terms = query.lower().split()
+        tags = [term.removeprefix("tag:") for term in terms if term.startswith("tag:")]
+        terms = [term for term in terms if not term.startswith("tag:")]
+
+        candidates = set(self.modules)
+        for tag in tags:
+            candidates &= self.tags.get(tag, set())
+        if not terms:
+            return [(name, 1.0) for name in sorted(candidates)][:limit]
+
+        scores = {}
+        for term in terms:
+            term_scores = self._score_term(term)
+            for name in candidates:
+                scores[name] = scores.get(name, 0.0) + term_scores.get(name, 0.0)
+
+        results = [(name, round(score / len(terms), 3)) for name, score in scores.items() if score > 0]
+        results.sort(key=lambda result: (-result[1], result[0]))
+        return results[:limit]
+
+
+    def _score_term(self, term: str) -> dict[str, float]:
+        scores = {}
+        # Names and description words starting with the term.
+        start = bisect_left(self.words, (term, ""))
+        for word, name in islice(self.words, start, None):
+            if not word.startswith(term):
+                break
+            score = 1.0 if word == term == name else 0.8 if word == name else 0.5
+            scores[name] = max(scores.get(name, 0.0), score)
+
+        # Names close to the term.
+        term_trigrams = _trigrams(term)
+        shared = {}
+        for trigram in term_trigrams:
+            for name in self.trigrams.get(trigram, ()):
+                shared[name] = shared.get(name, 0) + 1
+        for name, count in shared.items():
+            similarity = count / len(term_trigrams | _trigrams(name))
+            if similarity >= MIN_FUZZY_SIMILARITY:
+                scores[name] = max(scores.get(name, 0.0), 0.4 * similarity)
+        return scores
+
+
+def _trigrams(text: str) -> set[str]:
+    # Padded, so short names and the start/end of a name count too.
+    text = f"  {text.lower()} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
@@ -0,0 +1,144 @@
+import asyncio
+import functools
+import time
+from typing import Any, Callable, Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.instrumentation import Instrumentation
+from utils.shared.limiters.Limiter import Limiter
+
+
+MAX_CONCURRENT_STEPS = 4
+
+
+class PipelineAborted(Exception):
+    """Raised for steps that didn't start, because an earlier step failed."""
+
+
+class Pipeline:
+    """
+    Run the steps of a build as a DAG: each step starts as soon as the steps it needs have finished,
+    so independent steps (e.g. copying on-disk modules and cloning GitHub ones) overlap.
+
+    Steps are blocking functions, run in worker threads by an asyncio scheduler.
+    A step's declared inputs are passed to it as keyword arguments, named after the steps that produced them.
+    Steps can only depend on steps that were added before them, so the graph can't have a cycle.
+
+    If a step fails, steps that haven't started yet are skipped, steps that are already running
+    are allowed to finish (threads can't be interrupted), and the first failure is raised.
+
+    Given an Instrumentation, each step's time, files and I/O are recorded under the pipeline's name.
+    See utils/instrumentation.py
+
+    Example:
+    >>> pipeline = Pipeline()
+    >>> pipeline.add_step("copy", copy.modules_to_program_directory)
+    >>> pipeline.add_step("pull", pull.remote_modules_from_github)
+    >>> pipeline.add_step("requirements", lambda: concatenate_requirements(program_path), after=["copy", "pull"])
+    >>> pipeline.add_step("readme", lambda requirements: create_readme(name, program_path, requirements),
+    >>>                   inputs=["requirements"])
+    >>> outputs = pipeline.run()
+    >>> outputs["requirements"]
+    {'aiohttp', 'pyyaml'}
+    """
+
+    def __init__(self,
+                 max_concurrent_steps: int = MAX_CONCURRENT_STEPS,
+                 instrumentation: Optional[Instrumentation] = None,
+                 name: str = "pipeline"
+                ) -> None:
+        """
+        Args:
+            max_concurrent_steps: How many steps can run at the same time.
+            instrumentation: Where to record each step's metrics, if anywhere.
+            name: Name to record the steps under, e.g. the program being built.
+        """
+        self.max_concurrent_steps: int = max(1, max_concurrent_steps)
+        self.instrumentation: Optional[Instrumentation] = instrumentation
+        self.name: str = name
+        self.steps: dict[str, dict] = {}
+        # Step name -> seconds it took, once the pipeline has run.
+        self.timings: dict[str, float] = {}
+
+
+    def add_step(self, name: str, function: Callable, inputs: list[str] = None, after: list[str] = None) -> None:
+        """
+        Add a step to the pipeline.
+
+        Args:
+            name: Name of the step. Its output is stored under this name.
+            function: The step. Called with one keyword argument per input.
+            inputs: Steps whose outputs this step needs.
+            after: Steps that must finish before this one, whose outputs it doesn't need
+                (e.g. because it reads the files they wrote).
+
+        Raises:
+            ValueError: If the name is taken, or an input or after step hasn't been added yet.
+        """
+        if name in self.steps:
+            raise ValueError(f"Pipeline already has a step named '{name}'")
+        inputs, after = list(inputs or []), list(after or [])
+        for dependency in inputs + after:
+            if dependency not in self.steps:
+                raise ValueError(f"Step '{name}' depends on '{dependency}', which hasn't been added yet")
+        self.steps[name] = {"function": function, "inputs": inputs, "after": after}
+
+
+    def run(self) -> dict[str, Any]:
+        """
+        Run every step.
+
+        Returns:
+            Dictionary mapping each step name to its output.
+
+        Raises:
+            Exception: The first exception raised by a step.
+        """
+        return asyncio.run(self._run())
+
+
+    async def _run(self) -> dict[str, Any]:
+        limiter = Limiter(semaphore=self.max_concurrent_steps, progress_bar=False)
+        tasks: dict[str, asyncio.Task] = {}
+        failures: list[tuple[str, BaseException]] = []
+
+        async def run_step(name: str) -> Any:
+            step = self.steps[name]
+            for dependency in step["inputs"] + step["after"]:
+                await asyncio.wait([tasks[dependency]])
+            if failures:
+                raise PipelineAborted(f"Skipped '{name}', since '{failures[0][0]}' failed")
+            kwargs = {dependency: tasks[dependency].result() for dependency in step["inputs"]}
+            return await limiter.run_task_with_limit(self._run_in_thread(name, step["function"], kwargs, failures))
+
+        for name in self.steps:
+            tasks[name] = asyncio.create_task(run_step(name))
+        await asyncio.gather(*tasks.values(), return_exceptions=True)
+
+        if failures:
+            name, exception = failures[0]
+            logger.error(f"Pipeline step '{name}' failed: {exception}")
+            raise exception
+        return {name: task.result() for name, task in tasks.items()}
+
+
+    async def _run_in_thread(self, name: str, function: Callable, kwargs: dict,
+                             failures: list[tuple[str, BaseException]]) -> Any:
+        if failures:
+            raise PipelineAborted(f"Skipped '{name}', since '{failures[0][0]}' failed")
+        logger.debug(f"Starting pipeline step '{name}'")
+        if self.instrumentation is not None:
+            function = functools.partial(self.instrumentation.measure, self.name, name, function)
+        started = time.perf_counter()
+        try:
+            return await asyncio.to_thread(function, **kwargs)
+        except BaseException as e:
+            failures.append((name, e))
+            raise
+        finally:
+            self.timings[name] = time.perf_counter() - started
+            logger.debug(f"Pipeline step '{name}' took {self.timings[name]:.3f}s")
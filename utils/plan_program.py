@@ -0,0 +1,159 @@
+import fnmatch
+import os
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.create_debug_input_and_output_folders import DEBUG_INPUT_AND_OUTPUT_FOLDERS
+
+
+# Same as Step 4's copytree ignore patterns.
+IGNORE_PATTERNS = ('*.pyc', '__pycache__', '.git', '.github', '.pytest_cache')
+
+# Folders whose contents go straight into the program directory, in this order.
+UNPACK_FOLDERS = ["main", "gitignore", "start", "install"]
+
+# Files made by the pipeline itself, which always win over module files at the same path.
+GENERATED_FILES = ["requirements.txt", "README.md"] + [
+    f"{folder}/{placeholder}.txt" for folder, placeholder in DEBUG_INPUT_AND_OUTPUT_FOLDERS
+]
+
+
+def plan_program(module_sources: dict[str, str], unpack_folders: list[str] = UNPACK_FOLDERS) -> dict:
+    """
+    Work out the final path of every module file in the program, so each file can be written exactly once.
+
+    This gives the same layout as copying the modules (Steps 4-5), unpacking 'utils/shared' (Step 7),
+    unpacking the main/gitignore/start/install folders (Step 8) and removing underscores (Step 10):
+    - A module's files go in a folder named after the module.
+    - Files in a module's 'utils/shared' go in the program's 'utils/shared'.
+      The 'utils' module's own files come first, then other modules' in alphabetical order.
+      If two modules have a file at the same path, the first one is kept.
+    - The contents of the unpack folders go in the program directory itself,
+      unless something is already there with the same name.
+    - A leading underscore is removed from names in the program directory, e.g. '_main.py' -> 'main.py',
+      unless that would overwrite something.
+    - Files the pipeline makes itself (requirements.txt, README.md, the debug/input/output placeholders)
+      replace module files at the same path.
+
+    Example:
+    >>> plan = plan_program({"main": "/modules/core/main", "api": "/modules/core/api"})
+    >>> plan["files"][0]
+    {'source': '/modules/core/api/api.py', 'destination': 'api/api.py', 'module': 'api', 'size': 16, 'symlink': False}
+
+    Args:
+        module_sources: Dictionary mapping module names to local folders with their files.
+            GitHub modules must be exported to disk first.
+        unpack_folders: Modules whose contents go in the program directory itself.
+
+    Returns:
+        A dictionary with:
+        - 'files': The files to write, each a dictionary with its 'source' path, its 'destination'
+            relative to the program directory (with '/' separators), its 'module', 'size' and
+            whether it's a 'symlink'. Files whose leading underscore was removed also have 'renamed_from'.
+        - 'skipped': Files that aren't written, each with the 'reason'.
+        - 'requirements_files': Source paths of every requirements.txt, for Step 6.
+    """
+    # The utils module's own files win any 'utils/shared' collisions, like they did in Step 7.
+    order = sorted(module_sources, key=lambda module: (module != "utils", module))
+
+    planned: dict[str, dict] = {}
+    shared: list[tuple[str, dict]] = []
+    unpacked: dict[str, list[tuple[str, dict]]] = {}
+    skipped: list[dict] = []
+    requirements_files: list[str] = []
+
+    for module in order:
+        for relative_path, entry in _walk_module(module, module_sources[module]):
+            if relative_path.split("/")[-1] == "requirements.txt":
+                requirements_files.append(entry["source"])
+
+            if relative_path.startswith("utils/shared/"):
+                shared.append((relative_path.removeprefix("utils/shared/"), entry))
+            elif module in unpack_folders:
+                unpacked.setdefault(module, []).append((relative_path, entry))
+            else:
+                planned[f"{module}/{relative_path}"] = entry
+
+    # Merge every module's utils/shared. First one in wins.
+    for relative_path, entry in shared:
+        if _is_ignored_by_unpack(relative_path):
+            continue
+        destination = f"utils/shared/{relative_path}"
+        if destination in planned:
+            skipped.append({**entry, "destination": destination,
+                            "reason": f"'{planned[destination]['module']}' already has {destination}"})
+            continue
+        planned[destination] = entry
+
+    # Unpack folders into the program directory, skipping names that are already taken.
+    root_names = {destination.split("/")[0] for destination in planned}
+    root_names.update(name for name in GENERATED_FILES if "/" not in name)
+    root_names.update(module for module in unpack_folders if module in module_sources)
+    for module in unpack_folders:
+        taken = set(root_names)
+        for relative_path, entry in unpacked.get(module, []):
+            top_level_name = relative_path.split("/")[0]
+            if top_level_name in taken:
+                skipped.append({**entry, "destination": relative_path,
+                                "reason": f"'{top_level_name}' already exists in the program directory"})
+                continue
+            if "/" in relative_path and _is_ignored_by_unpack(relative_path):
+                continue
+            planned[relative_path] = entry
+            root_names.add(top_level_name)
+        root_names.discard(module)
+
+    # Remove leading underscores from names in the program directory.
+    root_names = {destination.split("/")[0] for destination in planned} | {name.split("/")[0] for name in GENERATED_FILES}
+    renames = {
+        name: name[1:] for name in root_names
+        if name.startswith("_") and name[1:] not in root_names
+    }
+    for name in sorted(root_names):
+        if name.startswith("_") and name not in renames:
+            logger.warning(f"Not renaming '{name}', since '{name[1:]}' already exists in the program directory")
+
+    files = []
+    for destination, entry in planned.items():
+        top_level_name, _, rest = destination.partition("/")
+        if top_level_name in renames:
+            entry = {**entry, "renamed_from": destination}
+            destination = renames[top_level_name] + (f"/{rest}" if rest else "")
+        if destination in GENERATED_FILES:
+            skipped.append({**entry, "destination": destination, "reason": "made by the pipeline"})
+            continue
+        files.append({**entry, "destination": destination})
+
+    logger.info(f"Planned {len(files)} files from {len(module_sources)} modules ({len(skipped)} skipped)")
+    return {"files": files, "skipped": skipped, "requirements_files": requirements_files}
+
+
+def _walk_module(module: str, module_path: str):
+    """
+    Yield (relative path, entry) for every file in a module, skipping IGNORE_PATTERNS.
+    Symlinks are yielded as-is, not followed.
+    """
+    stack = [("", str(module_path))]
+    while stack:
+        relative_dir, directory = stack.pop()
+        with os.scandir(directory) as entries:
+            entries = sorted(entries, key=lambda dir_entry: dir_entry.name)
+        for dir_entry in entries:
+            if any(fnmatch.fnmatch(dir_entry.name, pattern) for pattern in IGNORE_PATTERNS):
+                continue
+            relative_path = f"{relative_dir}{dir_entry.name}"
+            if dir_entry.is_symlink():
+                yield relative_path, {"source": dir_entry.path, "module": module, "size": 0, "symlink": True}
+            elif dir_entry.is_dir():
+                stack.append((f"{relative_path}/", dir_entry.path))
+            elif dir_entry.is_file():
+                yield relative_path, {"source": dir_entry.path, "module": module,
+                                      "size": dir_entry.stat().st_size, "symlink": False}
+
+
+def _is_ignored_by_unpack(relative_path: str) -> bool:
+    # Steps 7 and 8 copied folders with shutil.ignore_patterns('.git', '.gitignore').
+    return any(part in (".git", ".gitignore") for part in relative_path.split("/"))
@@ -0,0 +1,395 @@
+import os
+import re
+import threading
+from typing import Callable, Iterable, Optional
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+REQUIREMENTS_FILENAME = "requirements.txt"
+
+# See: https://peps.python.org/pep-0508/#names
+_REQUIREMENT_PATTERN = re.compile(
+    r"^(?P<name>[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)\s*"
+    r"(?:\[(?P<extras>[^\]]*)\])?\s*"
+    r"(?:@\s*(?P<url>\S+)\s*|(?P<specifiers>\(?[^;]*?\)?))\s*"
+    r"(?:;\s*(?P<marker>.+))?$"
+)
+_SPECIFIER_PATTERN = re.compile(r"^\s*(?P<operator>===|==|!=|~=|<=|>=|<|>)\s*(?P<version>[^\s,]+)\s*$")
+# Hash-checking mode options after a requirement, e.g. 'requests==2.31.0 --hash=sha256:58cd...'
+_HASH_PATTERN = re.compile(r"\s+--hash(?:=|\s+)(?P<hash>\S+)")
+# Options that include another file, e.g. '-r common.txt' or '--constraint=constraints.txt'
+_INCLUDE_PATTERN = re.compile(r"^(?P<option>-r|--requirement|-c|--constraint)(?:=|\s+)(?P<path>\S+)$")
+
+# See: https://peps.python.org/pep-0440/#appendix-b-parsing-version-strings-with-regular-expressions
+_VERSION_PATTERN = re.compile(r"""
+    ^v?
+    (?:(?P<epoch>[0-9]+)!)?
+    (?P<release>[0-9]+(?:\.[0-9]+)*)
+    (?:[-_.]?(?P<pre_label>alpha|a|beta|b|preview|pre|c|rc)[-_.]?(?P<pre_number>[0-9]+)?)?
+    (?P<post>-(?P<post_number_implicit>[0-9]+)|[-_.]?(?:post|rev|r)[-_.]?(?P<post_number>[0-9]+)?)?
+    (?P<dev>[-_.]?dev[-_.]?(?P<dev_number>[0-9]+)?)?
+    (?:\+[a-z0-9]+(?:[-_.][a-z0-9]+)*)?
+    $
+""", re.VERBOSE | re.IGNORECASE)
+_PRE_RELEASE_RANKS = {"a": 0, "alpha": 0, "b": 1, "beta": 1, "c": 2, "rc": 2, "pre": 2, "preview": 2}
+
+
+def normalize_package_name(name: str) -> str:
+    """
+    Normalize a package name, so different spellings of the same package compare equal.
+    See: https://peps.python.org/pep-0503/#normalized-names
+
+    Example:
+    >>> normalize_package_name("Pandas")
+    'pandas'
+    >>> normalize_package_name("typing_extensions")
+    'typing-extensions'
+    """
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_requirement(line: str) -> Optional[dict]:
+    """
+    Parse a requirement like 'Pandas[excel]>=2.0,<3; python_version >= "3.9" --hash=sha256:2cf2...'.
+
+    Returns:
+        Dictionary with the normalized 'name', 'extras' (a sorted list), 'specifiers' (a list of (operator, version)),
+        'url', 'marker' and 'hashes' (a sorted list). None if the line isn't a named requirement,
+        e.g. an option like '--index-url' or a bare URL.
+    """
+    hashes = sorted(set(_HASH_PATTERN.findall(line)))
+    match = _REQUIREMENT_PATTERN.match(_HASH_PATTERN.sub("", line).strip())
+    if match is None:
+        return None
+    specifiers = []
+    specifier_text = (match["specifiers"] or "").strip().removeprefix("(").removesuffix(")")
+    for specifier in filter(None, (part.strip() for part in specifier_text.split(","))):
+        specifier_match = _SPECIFIER_PATTERN.match(specifier)
+        if specifier_match is None:
+            return None
+        specifiers.append((specifier_match["operator"], specifier_match["version"]))
+    return {
+        "name": normalize_package_name(match["name"]),
+        "extras": sorted({normalize_package_name(extra.strip()) for extra in (match["extras"] or "").split(",") if extra.strip()}),
+        "specifiers": specifiers,
+        "url": match["url"],
+        "marker": _normalize_marker(match["marker"]) if match["marker"] else None,
+        "hashes": hashes,
+    }
+
+
+def read_requirements_file(path: str) -> list[str]:
+    """
+    Read a requirements file's lines without comments, blank lines or line continuations,
+    the way pip reads them.
+    """
+    with open(path, "r") as f:
+        text = f.read()
+    lines = []
+    for line in re.sub(r"\\\r?\n", "", text).splitlines():
+        # A comment starts with '#' at the start of the line, or after whitespace. See: pip's req_file.py
+        line = re.sub(r"(^|\s+)#.*$", "", line).strip()
+        if line:
+            lines.append(line)
+    return lines
+
+
+def resolve_requirements(requirements_files: Iterable[str]) -> dict:
+    """
+    Merge requirements files into one requirement per package (and environment marker), with the
+    intersection of every file's version specifiers, so pip doesn't have to backtrack through them.
+    Names are compared normalized, so 'Pandas', 'pandas>=2.0' and 'pandas==2.1.1' become 'pandas==2.1.1'.
+    Specifiers that can't all be met are reported as conflicts rather than left for pip to find.
+
+    The same requirements always give the same output, whatever order the files are in.
+
+    Files included with a relative '-r other.txt' are merged in as if their lines were in the including file,
+    since the path would be wrong from the program directory. Lines that aren't named requirements
+    (options like '--extra-index-url', bare URLs, '-e ...', and includes with absolute paths or URLs)
+    are kept as they are, without duplicates. Requirements with '--hash' options keep every hash they're given.
+
+    Example:
+    >>> resolve_requirements(["/programs/my_program/api/requirements.txt", "/programs/my_program/database/requirements.txt"])
+    {'requirements': ['aiohttp>=3.9', 'pandas==2.1.1'], 'other_lines': [],
+     'conflicts': [{'name': 'pydantic', 'marker': None, 'reason': "'==1.10.2' excludes '>=2.0'",
+                    'specifiers': [('api/requirements.txt', 'pydantic==1.10.2'), ('database/requirements.txt', 'pydantic>=2.0')]}]}
+
+    Args:
+        requirements_files: Paths of the requirements files to merge.
+
+    Returns:
+        Dictionary with the merged 'requirements' lines, sorted by name, the 'other_lines' kept as they are,
+        and the 'conflicts', each with the package 'name' and 'marker', the 'reason', and the 'specifiers':
+        every (path, line) that asked for the package. A package asked for by URL in one line
+        and with version specifiers in another is a conflict too, since the URL decides the version.
+
+    Raises:
+        ValueError: If a file includes constraints with a relative '-c', which can't be merged,
+            or includes itself.
+    """
+    merger = RequirementsMerger()
+    for path in requirements_files:
+        merger.add_file(path)
+    return merger.resolve()
+
+
+class RequirementsMerger:
+    """
+    Collects requirements files as they're found, and merges them with resolve_requirements once they're all in.
+    Files are read and parsed as they're added, so no separate walk of the program is needed to find them.
+    Safe to add files to from several threads.
+
+    Example:
+    >>> requirements = RequirementsMerger()
+    >>> copy_trees(trees, copy_function=requirements.watch(fast_copy2))
+    >>> requirements.resolve()
+    {'requirements': ['aiohttp>=3.9', 'pandas==2.1.1'], 'other_lines': [], 'conflicts': []}
+    """
+
+    def __init__(self) -> None:
+        # Path -> (path, line, parsed requirement or None) for each line in the file and the files it includes.
+        self._files: dict[str, list[tuple[str, str, Optional[dict]]]] = {}
+        self._lock = threading.Lock()
+
+
+    @property
+    def files(self) -> list[str]:
+        """The requirements files added so far, sorted."""
+        with self._lock:
+            return sorted(self._files)
+
+
+    def add_file(self, path: str) -> None:
+        """
+        Read and parse a requirements file, and the files it includes with a relative '-r'.
+        Adding the same path again replaces it.
+
+        Raises:
+            ValueError: See resolve_requirements.
+        """
+        lines = self._read_file(path, including=())
+        with self._lock:
+            self._files[path] = lines
+
+
+    def _read_file(self, path: str, including: tuple[str, ...]) -> list[tuple[str, str, Optional[dict]]]:
+        if os.path.abspath(path) in including:
+            raise ValueError(f"{path} includes itself, through {' -> '.join(including)}")
+        lines = []
+        for line in read_requirements_file(path):
+            include = _INCLUDE_PATTERN.match(line)
+            if include is None or "://" in include["path"] or os.path.isabs(include["path"]):
+                lines.append((path, line, parse_requirement(line)))
+            elif include["option"] in ("-c", "--constraint"):
+                raise ValueError(f"Can't merge the constraints '{line}' in {path}. Put them in the requirements instead.")
+            else:
+                included_path = os.path.join(os.path.dirname(path), include["path"])
+                lines += self._read_file(included_path, (*including, os.path.abspath(path)))
+        return lines
+
+
+    def watch(self, copy_function: Callable[[str, str], object]) -> Callable[[str, str], object]:
+        """
+        Wrap a copy function like shutil.copy2, so every requirements.txt it copies is added.
+        Files are added by their source path, so the same sources always merge in the same order.
+        """
+        def copy_and_add(source_path: str, destination_path: str):
+            result = copy_function(source_path, destination_path)
+            if os.path.basename(source_path) == REQUIREMENTS_FILENAME:
+                self.add_file(source_path)
+            return result
+        return copy_and_add
+
+
+    def resolve(self) -> dict:
+        """Merge the files added so far. See resolve_requirements."""
+        with self._lock:
+            files = dict(self._files)
+
+        groups: dict[tuple[str, Optional[str]], list[tuple[str, str, dict]]] = {}
+        other_lines: list[str] = []
+        for added_path in sorted(files):
+            for path, line, requirement in files[added_path]:
+                if requirement is None:
+                    if line not in other_lines:
+                        other_lines.append(line)
+                    continue
+                groups.setdefault((requirement["name"], requirement["marker"]), []).append((path, line, requirement))
+
+        requirements, conflicts = [], []
+        for (name, marker), group in sorted(groups.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+            extras = sorted({extra for _, _, requirement in group for extra in requirement["extras"]})
+            line = name + (f"[{','.join(extras)}]" if extras else "")
+            urls = sorted({requirement["url"] for _, _, requirement in group if requirement["url"]})
+            specifiers = [specifier for _, _, requirement in group for specifier in requirement["specifiers"]]
+            hashes = sorted({hash_ for _, _, requirement in group for hash_ in requirement["hashes"]})
+            try:
+                if len(urls) > 1:
+                    raise ValueError(f"different URLs {', '.join(urls)}")
+                if urls and specifiers:
+                    raise ValueError(f"'@ {urls[0]}' can't also be "
+                                     f"'{','.join(operator + version for operator, version in specifiers)}'")
+                if urls:
+                    line += f" @ {urls[0]}" + (" " if marker else "")
+                else:
+                    line += ",".join(_intersect_specifiers(specifiers))
+            except ValueError as e:
+                conflicts.append({"name": name, "marker": marker, "reason": str(e),
+                                  "specifiers": [(path, line) for path, line, _ in group]})
+                continue
+            line += f"; {marker}" if marker else ""
+            requirements.append(line + "".join(f" --hash={hash_}" for hash_ in hashes))
+
+        logger.debug(f"Resolved {sum(len(group) for group in groups.values())} requirements into {len(requirements)}"
+                     f" ({len(conflicts)} conflicts)")
+        return {"requirements": requirements, "other_lines": other_lines, "conflicts": conflicts}
+
+
+def _normalize_marker(marker: str) -> str:
+    """Write a marker one way, so "sys_platform=='win32'" and 'sys_platform == "win32"' are grouped together."""
+    marker = re.sub(r"\s*(===|==|!=|~=|<=|>=|<|>)\s*", r" \1 ", marker.replace("'", '"'))
+    return " ".join(marker.split())
+
+
+def _intersect_specifiers(specifiers: list[tuple[str, str]]) -> list[str]:
+    """
+    Turn specifiers like [('>=', '2.0'), ('==', '2.1.1'), ('<', '3')] into the fewest that allow the same versions,
+    e.g. ['==2.1.1']. Raises ValueError if no version meets them all.
+    """
+    specifiers = sorted(set(specifiers), key=lambda specifier: (specifier[0], specifier[1]))
+    keys = {version: _version_key(version.removesuffix(".*")) for _, version in specifiers}
+    if any(key is None for key in keys.values()) or any(operator == "===" for operator, _ in specifiers):
+        # Not a version this can compare. Keep them all, and let pip work it out.
+        return [f"{operator}{version}" for operator, version in specifiers]
+
+    # Bounds are (key, version, inclusive).
+    lower = upper = None
+    pins: dict[tuple, str] = {}
+    excluded = []
+    for operator, version in specifiers:
+        key = keys[version]
+        if operator in (">=", ">"):
+            lower = _tighter(lower, (key, version, operator == ">="), max)
+        elif operator in ("<=", "<"):
+            upper = _tighter(upper, (key, version, operator == "<="), min)
+        elif operator == "~=":
+            # ~=2.1.3 is >=2.1.3, ==2.1.*
+            release = version.split("+")[0].split(".")
+            if len(release) < 2:
+                raise ValueError(f"'~={version}' needs at least two parts to its version")
+            lower = _tighter(lower, (key, version, True), max)
+            upper = _tighter(upper, _prefix_upper_bound(".".join(release[:-1])), min)
+        elif operator == "==" and version.endswith(".*"):
+            prefix = version.removesuffix(".*")
+            lower = _tighter(lower, (keys[version], prefix, True), max)
+            upper = _tighter(upper, _prefix_upper_bound(prefix), min)
+        elif operator == "==":
+            pins.setdefault(key, version)
+        else: # !=
+            excluded.append((operator, version))
+
+    if len(pins) > 1:
+        raise ValueError(f"pinned to {' and '.join('==' + version for version in pins.values())}")
+    if pins:
+        (key, version), = pins.items()
+        for bound, compare in ((lower, lambda a, b: a > b), (upper, lambda a, b: a < b)):
+            if bound is not None and (compare(bound[0], key) or (bound[0] == key and not bound[2])):
+                operator = (">=" if bound[2] else ">") if bound is lower else ("<=" if bound[2] else "<")
+                raise ValueError(f"'=={version}' excludes '{operator}{bound[1]}'")
+        _check_not_excluded(f"'=={version}'", version, key, excluded)
+        return [f"=={version}"]
+
+    if lower is not None and upper is not None:
+        if lower[0] > upper[0] or (lower[0] == upper[0] and not (lower[2] and upper[2])):
+            raise ValueError(f"'{'>=' if lower[2] else '>'}{lower[1]}' excludes '{'<=' if upper[2] else '<'}{upper[1]}'")
+        if lower[0] == upper[0]:
+            _check_not_excluded(f"'>={lower[1]}' and '<={upper[1]}'", lower[1], lower[0], excluded)
+            return [f"=={lower[1]}"]
+
+    merged = []
+    if lower is not None:
+        merged.append(f"{'>=' if lower[2] else '>'}{lower[1]}")
+    if upper is not None:
+        merged.append(f"{'<=' if upper[2] else '<'}{upper[1]}")
+    for operator, version in excluded:
+        # Leave out exclusions that the bounds already rule out.
+        key = keys[version]
+        if not version.endswith(".*") and ((lower is not None and key < lower[0]) or (upper is not None and key > upper[0])):
+            continue
+        merged.append(f"{operator}{version}")
+    return merged
+
+
+def _check_not_excluded(allowed: str, version: str, key: tuple, excluded: list[tuple[str, str]]) -> None:
+    """Raise ValueError if the only version allowed is excluded, by '!=2.1.1' or by prefix, like '!=2.1.*'"""
+    for _, excluded_version in excluded:
+        if excluded_version.endswith(".*"):
+            matches = _matches_prefix(version, excluded_version.removesuffix(".*"))
+        else:
+            matches = _version_key(excluded_version) == key
+        if matches:
+            raise ValueError(f"'!={excluded_version}' excludes {allowed}")
+
+
+def _matches_prefix(version: str, prefix: str) -> bool:
+    """
+    Whether a version matches '==prefix.*', comparing release numbers with the shorter one padded with zeros.
+    See: https://peps.python.org/pep-0440/#version-matching
+    """
+    version_match, prefix_match = _VERSION_PATTERN.match(version.strip()), _VERSION_PATTERN.match(prefix.strip())
+    if int(version_match["epoch"] or 0) != int(prefix_match["epoch"] or 0):
+        return False
+    release = [int(part) for part in version_match["release"].split(".")]
+    prefix_release = [int(part) for part in prefix_match["release"].split(".")]
+    release += [0] * (len(prefix_release) - len(release))
+    return release[:len(prefix_release)] == prefix_release
+
+
+def _tighter(bound: Optional[tuple], other: tuple, pick) -> tuple:
+    if bound is None:
+        return other
+    if bound[0] == other[0]:
+        # The same version: exclusive is tighter.
+        return bound if not bound[2] else other
+    return pick(bound, other, key=lambda item: item[0])
+
+
+def _prefix_upper_bound(prefix: str) -> tuple:
+    """The exclusive upper bound of ==prefix.*, e.g. '2.1' -> <2.2"""
+    epoch, _, release = prefix.rpartition("!")
+    parts = release.split(".")
+    upper = ".".join(parts[:-1] + [str(int(parts[-1]) + 1)])
+    upper = f"{epoch}!{upper}" if epoch else upper
+    # .dev0 is the lowest version there is, so '<2.2.dev0' also excludes 2.2's pre-releases, like ==2.1.* does.
+    return _version_key(f"{upper}.dev0"), upper, False
+
+
+def _version_key(version: str) -> Optional[tuple]:
+    """
+    Get a key that sorts versions the way PEP 440 does. Local versions (after '+') are ignored.
+    None if it isn't a PEP 440 version. See: https://peps.python.org/pep-0440/#summary-of-permitted-suffixes-and-relative-ordering
+    """
+    match = _VERSION_PATTERN.match(version.strip())
+    if match is None:
+        return None
+    release = [int(part) for part in match["release"].split(".")]
+    while len(release) > 1 and release[-1] == 0:
+        release.pop()
+    post = int(match["post_number_implicit"] or match["post_number"] or 0) if match["post"] else None
+    dev = int(match["dev_number"] or 0) if match["dev"] else None
+    if match["pre_label"]:
+        pre = (1, _PRE_RELEASE_RANKS[match["pre_label"].lower()], int(match["pre_number"] or 0))
+    elif post is None and dev is not None:
+        pre = (-1,) # 1.0.dev0 comes before 1.0a0
+    else:
+        pre = (2,)
+    return (
+        int(match["epoch"] or 0),
+        tuple(release),
+        pre,
+        (0,) if post is None else (1, post),
+        (1,) if dev is None else (0, dev),
+    )
@@ -1,30 +1,70 @@
 import asyncio
-from typing import Any, Callable, Coroutine, Generator
+from typing import Any, AsyncIterable, Callable, Coroutine, Iterable, Optional
 
 
-from tqdm import asyncio as tqdmasyncio
+try:
+    from tqdm import tqdm
+except ImportError: # tqdm is only needed for the progress bar.
+    tqdm = None
 
+try:
+    import pandas as pd
+except ImportError: # pandas is only needed for DataFrame inputs.
+    pd = None
 
-from .create_tasks_list import create_tasks_list
-from .create_tasks_list_with_outer_task_name import create_tasks_list_with_outer_task_name
+
+from .TokenBucket import TokenBucket
 
 
 class Limiter:
     """
-    Create an instance-based custom rate-limiter based on a semaphore.
+    Limit how many coroutines run at once, and optionally how many start per second and how many bytes
+    they move per second, with token buckets. See TokenBucket.py
     Options for a custom stop condition and progress bar.
+
+    run_async_many streams its inputs through a bounded queue to a fixed number of workers,
+    so inputs can be an async iterator (e.g. pages from an API) and are only pulled as fast as they're run.
+    A million inputs never become a million coroutines at once.
+
+    Example:
+    >>> limiter = Limiter(semaphore=8, requests_per_second=5, bytes_per_second=10 * 1024 * 1024, progress_bar=False)
+    >>> results = await limiter.run_async_many(inputs=repo_urls, func=clone_repo, enum=False)
+    >>> # Count each input's bytes against bytes_per_second before it starts:
+    >>> results = await limiter.run_async_many(inputs=files, func=upload, enum=False, get_size=lambda file: file.size)
+    >>> # Or one coroutine at a time, e.g. from asyncio.gather:
+    >>> result = await limiter.run_task_with_limit(clone_repo(url))
+    >>> # Count bytes once they're known, e.g. after a download:
+    >>> await limiter.throttle_bytes(len(data))
     """
-    def __init__(self, 
-                 semaphore: int, 
+    def __init__(self,
+                 semaphore: int,
                  stop_condition: Any = "stop_condition", # Replace with your specific stop condition
-                 progress_bar: bool=True
+                 progress_bar: bool=True,
+                 requests_per_second: Optional[float] = None,
+                 bytes_per_second: Optional[float] = None,
+                 burst: Optional[float] = None,
+                 max_queued: Optional[int] = None
                 ):
-        self.semaphore = asyncio.Semaphore(semaphore)
+        """
+        Args:
+            semaphore: Most coroutines running at the same time.
+            stop_condition: If a coroutine returns this, run_async_many stops starting new ones.
+            progress_bar: If True, show a tqdm progress bar in run_async_many, if tqdm is installed.
+            requests_per_second: If given, most coroutines started per second.
+            bytes_per_second: If given, most bytes per second passed to throttle_bytes, as run_task_with_limit's size,
+                or from run_async_many's get_size.
+            burst: Most coroutines started at once under requests_per_second. Defaults to one second's worth.
+            max_queued: Most inputs pulled from run_async_many's inputs, but not started yet. Defaults to twice semaphore.
+        """
+        self.max_concurrency = max(1, semaphore)
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
         self.stop_condition = stop_condition
         self.progress_bar = progress_bar
+        self.request_bucket = TokenBucket(requests_per_second, burst) if requests_per_second else None
+        self.byte_bucket = TokenBucket(bytes_per_second) if bytes_per_second else None
+        self.max_queued = max_queued or self.max_concurrency * 2
+        self.stopped = False
 
-    # Claude insisted that I include these for compatability/future use purposes.
-    # It's probably a good idea. 
     async def __aenter__(self):
         """
         Initialize the Limiter using a context manager.
@@ -35,63 +75,150 @@ class Limiter:
         """
         Exit the limiter using a context manager.
         """
-        pass
+        self.stop()
 
     @classmethod
-    def start(cls):
+    def start(cls, *args, **kwargs):
         """
         Initialize the Limiter using a factory method.
         """
-        instance = cls()
+        instance = cls(*args, **kwargs)
         return instance
 
-    def stop():
+    def stop(self):
         """
-        Exit the limiter.
+        Stop run_async_many from starting any more coroutines. Ones already running are finished.
         """
-        return
+        self.stopped = True
 
 
-    async def run_task_with_limit(self, task: Coroutine) -> Any:
+    async def throttle_bytes(self, size: int) -> float:
         """
-        Set up rate-limit-conscious functions
+        Wait until moving size more bytes stays under bytes_per_second. Does nothing without a bytes_per_second.
+
+        Returns:
+            How many seconds were spent waiting.
+        """
+        if self.byte_bucket is None or size <= 0:
+            return 0.0
+        return await self.byte_bucket.acquire(size)
+
+
+    async def run_task_with_limit(self, task: Coroutine, size: int = 0) -> Any:
+        """
+        Run a coroutine once there's a free slot, and it's within the rate limits.
+
+        Args:
+            task: The coroutine to run.
+            size: Bytes it will move, if known up front, for bytes_per_second.
         """
         async with self.semaphore:
+            if self.request_bucket is not None:
+                await self.request_bucket.acquire()
+            await self.throttle_bytes(size)
             result = await task
-            if result == self.stop_condition:  
-                global stop_signal
-                stop_signal = True
-            return result 
+            if result == self.stop_condition:
+                self.stop()
+            return result
 
 
-    async def run_async_many(self, 
-                             *args, 
-                             inputs: Any=None, 
+    async def run_async_many(self,
+                             *args,
+                             inputs: Iterable | AsyncIterable = None,
                              func: Callable=None,
                              enum: bool=True,
                              outer_task_name: str = "",
+                             return_exceptions: bool = False,
+                             get_size: Optional[Callable[[Any], int]] = None,
                              **kwargs
-                            ) -> asyncio.Future | Generator:
-        if not inputs:
-            raise ValueError("input_list was not input as a parameter")
+                            ) -> list:
+        """
+        Run func on every input, within the limits.
+
+        Args:
+            *args: Additional positional arguments for func.
+            inputs: A list, set, tuple, dict (its items), pandas DataFrame (its rows), or any other iterable
+                or async iterable. Inputs are pulled as workers become free, not all at once.
+            func: The coroutine function to run on each input.
+            enum: If True, call func(idx, input, ...), otherwise func(input, ...).
+            outer_task_name: Name for the worker tasks, e.g. to tell them apart in asyncio debug output.
+            return_exceptions: If True, exceptions are returned in place of results, like asyncio.gather.
+                Otherwise the first one stops every worker and is raised.
+            get_size: If given, called on each input to get the bytes its coroutine will move,
+                which wait for bytes_per_second before it starts.
+            **kwargs: Additional keyword arguments for func.
+
+        Returns:
+            The results, in the same order as the inputs. If the limiter was stopped, only the results
+            of the inputs that were started.
+        """
+        if inputs is None:
+            raise ValueError("inputs was not input as a parameter")
 
         if not func:
             raise ValueError("func was not input as a parameter")
 
-        # NOTE Adding an outer_task_name changes the tasks list from a list of Coroutines to a list of Tasks.
-        # However, running it through the limiter appears to change them back into Coroutines, so maybe it's fine???
-        if outer_task_name and self.progress_bar is False:
-            tasks = create_tasks_list_with_outer_task_name(inputs, func, enum, *args, **kwargs)
-        else:
-            tasks = create_tasks_list(inputs, func, enum, *args, **kwargs)
-
-        task_list = [
-            self.run_task_with_limit(task) for task in tasks
-        ]
-
-        if self.progress_bar:
-            for future in tqdmasyncio.tqdm.as_completed(task_list):
-                await future
-        else:
-            return await asyncio.gather(*task_list)
-
+        total = len(inputs) if hasattr(inputs, "__len__") else None
+        progress = tqdm(total=total) if self.progress_bar and tqdm is not None else None
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queued)
+        results: dict[int, Any] = {}
+        self.stopped = False
+
+        async def produce() -> None:
+            idx = 0
+            async for inp in _iterate(inputs):
+                if self.stopped:
+                    break
+                # Waits while the queue is full, so inputs are only pulled as fast as they're run.
+                await queue.put((idx, inp))
+                idx += 1
+            # One for each worker, so they all finish.
+            for _ in range(self.max_concurrency):
+                await queue.put(None)
+
+        async def work() -> None:
+            while (item := await queue.get()) is not None:
+                idx, inp = item
+                if self.stopped:
+                    continue
+                try:
+                    size = get_size(inp) if get_size is not None else 0
+                    coroutine = func(idx, inp, *args, **kwargs) if enum else func(inp, *args, **kwargs)
+                    results[idx] = await self.run_task_with_limit(coroutine, size)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[idx] = e
+                if progress is not None:
+                    progress.update(1)
+
+        workers = [asyncio.create_task(work(), name=outer_task_name or None) for _ in range(self.max_concurrency)]
+        producer = asyncio.create_task(produce(), name=outer_task_name or None)
+        try:
+            await asyncio.gather(producer, *workers)
+        except BaseException:
+            for task in [producer, *workers]:
+                task.cancel()
+            await asyncio.gather(producer, *workers, return_exceptions=True)
+            raise
+        finally:
+            if progress is not None:
+                progress.close()
+        return [results[idx] for idx in sorted(results)]
+
+
+async def _iterate(inputs: Any):
+    """Yield each input the way run_async_many passes it to func."""
+    if isinstance(inputs, dict):
+        inputs = inputs.items()
+    elif pd is not None and isinstance(inputs, pd.DataFrame):
+        inputs = inputs.itertuples()
+
+    if hasattr(inputs, "__aiter__"):
+        async for inp in inputs:
+            yield inp
+    elif hasattr(inputs, "__iter__") and not isinstance(inputs, (str, bytes)):
+        for inp in inputs:
+            yield inp
+    else:
+        raise ValueError(f"Argument 'inputs' has an unsupported type '{type(inputs)}'")
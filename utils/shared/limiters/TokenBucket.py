@@ -0,0 +1,63 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter for asyncio. Tokens refill at a steady rate, up to the bucket's capacity,
+    so short bursts are allowed but the average rate never goes over it.
+    Waiters are served in the order they arrived.
+
+    Taking more tokens than the bucket holds (e.g. a download bigger than a second's worth of bytes)
+    waits until the bucket is full, then leaves it in debt, so later callers wait for it to be paid back.
+
+    Example:
+    >>> bucket = TokenBucket(rate=10) # 10 requests per second, in bursts of up to 10.
+    >>> await bucket.acquire()
+    0.0
+    >>> bytes_bucket = TokenBucket(rate=5 * 1024 * 1024, capacity=1024 * 1024) # 5 MiB/s, in 1 MiB bursts.
+    >>> await bytes_bucket.acquire(len(chunk))
+    0.19
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        """
+        Args:
+            rate: Tokens added per second.
+            capacity: Most tokens the bucket holds, i.e. the biggest burst. Defaults to one second's worth.
+        """
+        if rate <= 0:
+            raise ValueError(f"rate must be positive, not {rate}")
+        self.rate: float = rate
+        self.capacity: float = capacity if capacity is not None else max(rate, 1)
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self._lock = asyncio.Lock()
+
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Wait until there are enough tokens, then take them.
+
+        Returns:
+            How many seconds were spent waiting.
+        """
+        waited = 0.0
+        # The lock is held while waiting, so callers are served first come, first served.
+        async with self._lock:
+            self._refill()
+            needed = min(tokens, self.capacity)
+            while self.tokens < needed:
+                delay = (needed - self.tokens) / self.rate
+                await asyncio.sleep(delay)
+                waited += delay
+                self._refill()
+            self.tokens -= tokens
+        return waited
@@ -1,6 +1,9 @@
 from typing import Any, Callable, Coroutine
 
-import pandas as pd
+try:
+    import pandas as pd
+except ImportError: # pandas is only needed for DataFrame inputs.
+    pd = None
 
 async def create_tasks_list(inputs: Any, func: Callable, enum: bool, *args, **kwargs) -> list[Coroutine[Any, Any, Any]]:
     """
@@ -32,7 +35,7 @@ async def create_tasks_list(inputs: Any, func: Callable, enum: bool, *args, **kw
         else:
             return [func((key, value), *args, **kwargs) for key, value in inputs.items()]
 
-    elif isinstance(inputs, pd.DataFrame):
+    elif pd is not None and isinstance(inputs, pd.DataFrame):
         if enum:
             return [func(idx, row, *args, **kwargs) for idx, row in enumerate(inputs.itertuples())]
         else:
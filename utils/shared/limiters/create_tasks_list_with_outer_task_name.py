@@ -1,7 +1,10 @@
 import asyncio
 from typing import Any, Coroutine
 
-import pandas as pd
+try:
+    import pandas as pd
+except ImportError: # pandas is only needed for DataFrame inputs.
+    pd = None
 
 def _list_set_tuple(inputs: list|set|tuple, func: Coroutine, enum: bool, outer_task_name: str, *args, **kwargs) -> list[asyncio.Task]:
     if enum:
@@ -35,7 +38,7 @@ def _dict(inputs: dict, func: Coroutine, enum: bool, outer_task_name: str, *args
                 ) for (key, value) in inputs.items()
             ]
 
-def _pd_dataframe(inputs: pd.DataFrame, func: Coroutine, enum: bool, outer_task_name: str, *args, **kwargs) -> list[asyncio.Task]:
+def _pd_dataframe(inputs: "pd.DataFrame", func: Coroutine, enum: bool, outer_task_name: str, *args, **kwargs) -> list[asyncio.Task]:
     if enum:
         return [
             asyncio.create_task(
@@ -82,7 +85,7 @@ async def create_tasks_list_with_outer_task_name(inputs: Any, func: Coroutine, e
         return _list_set_tuple(inputs, func, enum, outer_task_name, *args, **kwargs) 
     elif isinstance(inputs, dict):
         return _dict(inputs, func, enum, outer_task_name, *args, **kwargs) 
-    elif isinstance(inputs, pd.DataFrame):
+    elif pd is not None and isinstance(inputs, pd.DataFrame):
         return _pd_dataframe(inputs, func, enum, outer_task_name, *args, **kwargs)
     else:
         raise ValueError(f"Argument 'inputs' has an unsupported type '{type(inputs)}'")
\ No newline at end of file
@@ -0,0 +1,22 @@
+import hashlib
+
+def make_sha256_file_hash(filepath: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Generate a SHA-256 hash of a file's contents.
+
+    The file is read in chunks, so large files don't have to fit in memory.
+    Unlike make_sha256_hash, this hashes the bytes in the file, not the path string.
+
+    Args:
+        filepath: Path to the file to hash.
+        chunk_size: How many bytes to read at a time.
+
+    ## Example
+    >>> return make_sha256_file_hash("hello.txt") # File contains b"hello"
+    '2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824'
+    """
+    sha256 = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
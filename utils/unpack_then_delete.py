@@ -1,22 +1,37 @@
+import errno
 import os
 import shutil
+from typing import Callable
+
+
+from utils.fast_copy_file import fast_copy2
+
+
+IGNORED_NAMES = ('.git', '.gitignore')
 
 
 def unpack_then_delete(these_files: list[str], program_path: str) -> None:
     """
     Unpacks contents from specified folders to the program directory and then deletes the source folders.
-    It skips items that already exist in the destination, as well as .git and .gitignore files/directories.
+    It skips items that already exist in the destination, as well as .git and .gitignore files/directories
+    inside the unpacked directories.
+
+    The folders are inside the program directory, so items are moved with os.rename rather than copied:
+    unpacking takes as long as there are items, however big they are. Items are only copied if they're
+    on a different filesystem (e.g. a mount point inside the program directory).
+
+    Only the step-by-step build unpacks folders. The one-pass build plans the unpacked files' final paths,
+    so it writes them there straight away. See utils/plan_program.py
 
     Args:
         these_files (list[str]): A list of folder names to process.
         program_path (str): The path to the program directory where contents will be copied.
     """
-    ignore = shutil.ignore_patterns('.git', '.gitignore')
     program_name = os.path.basename(program_path)
 
     _unpack_then_delete = [
-        os.path.join(program_path, folder) 
-        for folder in these_files 
+        os.path.join(program_path, folder)
+        for folder in these_files
         if os.path.exists(os.path.join(program_path, folder))
     ]
 
@@ -26,18 +41,95 @@ def unpack_then_delete(these_files: list[str], program_path: str) -> None:
             destination_path = os.path.join(program_path, item)
 
             # Skip if the item already exists in the program directory
-            if os.path.exists(destination_path):
+            if os.path.lexists(destination_path):
                 print(f"{item} already exists in the program directory. Skipping...")
                 continue
 
-            # Copy over the file or directory
-            if os.path.isdir(source_path):
-                shutil.copytree(source_path, destination_path, ignore=ignore)
-                print(f"Copied directory {item} to {program_name}")
+            is_directory = os.path.isdir(source_path) and not os.path.islink(source_path)
+            try:
+                _move(source_path, destination_path)
+            except FileExistsError:
+                # Made by something else since we checked. _move never replaces it.
+                print(f"{item} already exists in the program directory. Skipping...")
+                continue
+
+            if is_directory:
+                _remove_ignored(destination_path)
+                print(f"Moved directory {item} to {program_name}")
             else:
-                shutil.copy2(source_path, destination_path)
-                print(f"Copied file {item} to {program_name}")
+                print(f"Moved file {item} to {program_name}")
 
-        # Remove the source folder once everything is copied.
+        # Remove the source folder, with anything that was skipped.
         shutil.rmtree(path)
         print(f"Removed {os.path.basename(path)} folder")
+
+
+def _move(source_path: str, destination_path: str) -> None:
+    """
+    Move a file, symlink or folder, raising FileExistsError instead of replacing anything at destination_path,
+    even something made after it was checked for. On POSIX, os.rename silently replaces files and empty folders,
+    so the name is taken first: files are hardlinked, and folders are made empty then renamed over.
+    """
+    try:
+        if os.name == "nt":
+            # Windows' rename never replaces anything.
+            os.rename(source_path, destination_path)
+        elif os.path.isdir(source_path) and not os.path.islink(source_path):
+            _rename_over_placeholder(source_path, destination_path, os.mkdir, os.rmdir)
+        else:
+            try:
+                os.link(source_path, destination_path, follow_symlinks=False)
+                os.unlink(source_path)
+            except FileExistsError:
+                raise
+            except OSError as e:
+                if e.errno == errno.EXDEV:
+                    raise
+                # No hardlinks on this filesystem.
+                _rename_over_placeholder(source_path, destination_path, _make_empty_file, os.remove)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Different filesystems, so it has to be copied. The source folder is removed afterwards anyway.
+        if os.path.islink(source_path):
+            os.symlink(os.readlink(source_path), destination_path)
+        elif os.path.isdir(source_path):
+            shutil.copytree(source_path, destination_path, symlinks=True,
+                            ignore=shutil.ignore_patterns(*IGNORED_NAMES), copy_function=fast_copy2)
+        else:
+            _make_empty_file(destination_path)
+            fast_copy2(source_path, destination_path)
+
+
+def _rename_over_placeholder(source_path: str, destination_path: str, make: Callable, remove: Callable) -> None:
+    """Take the name with an empty placeholder, which fails if it's taken, then rename over the placeholder."""
+    make(destination_path)
+    try:
+        os.rename(source_path, destination_path)
+    except OSError as e:
+        if e.errno in (errno.EEXIST, errno.ENOTEMPTY):
+            # Something was put in the placeholder folder in the meantime, so it's not ours to remove.
+            raise FileExistsError(errno.EEXIST, "Destination exists", destination_path) from e
+        remove(destination_path)
+        raise
+
+
+def _make_empty_file(path: str) -> None:
+    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+
+
+def _remove_ignored(directory: str) -> None:
+    """Remove .git and .gitignore files and folders from a moved directory, as copying it would have skipped them."""
+    for root, dirs, files in os.walk(directory):
+        for name in [name for name in dirs if name in IGNORED_NAMES]:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.remove(path)
+            else:
+                shutil.rmtree(path)
+            dirs.remove(name)
+        for name in files:
+            if name in IGNORED_NAMES:
+                os.remove(os.path.join(root, name))
@@ -1,11 +1,11 @@
 import os
 import shutil
-from pathlib import Path
 
 
 from logger.logger import Logger
 logger = Logger(logger_name=__name__)
 
+from utils.merge_trees import merge_trees
 from utils.remove_readonly import remove_readonly
 
 def unpack_utils_shared(chosen_modules: list, program_path: str) -> None:
@@ -14,10 +14,10 @@ def unpack_utils_shared(chosen_modules: list, program_path: str) -> None:
     
     This function performs the following tasks:
     1. Identifies 'utils/shared' directories in the chosen modules.
-    2. Creates a main 'utils/shared' directory if it doesn't exist.
-    3. Copies files and directories from each module's 'utils/shared' to the main 'utils/shared',
-       avoiding overwriting existing files.
-    4. Removes the individual 'utils/shared' directories from each module after consolidation.
+    2. Merges them all into the main 'utils/shared' directory at once, avoiding overwriting existing files.
+       The main 'utils/shared' (i.e. the utils module's own) wins, then modules in alphabetical order,
+       the same order utils/plan_program.py uses. Files that are the same in several modules are only copied once.
+    3. Removes the individual 'utils/shared' directories from each module after consolidation.
 
     Args:
         chosen_modules (list): A list of module names to process.
@@ -27,57 +27,36 @@ def unpack_utils_shared(chosen_modules: list, program_path: str) -> None:
         None
 
     Note:
-        - This function uses shutil to copy files and directories.
+        - This function uses utils/merge_trees.py, which walks each directory once and copies files in parallel.
         - It ignores '.git' and '.gitignore' files/directories during the copy process.
+        - Only the step-by-step build uses this. The one-pass build settles utils/shared collisions in
+          utils/plan_program.py, in the same order, and writes each file once.
     """
     logger.debug("Starting function...")
-    ignore = shutil.ignore_patterns('.git', '.gitignore')
-
-    for module in chosen_modules:
-        full_path = os.path.join(program_path, module, "utils", "shared")
-        logger.debug(f"Checking path: {full_path}")
-        logger.debug(f"Path exists: {os.path.exists(full_path)}")
 
     # Define the destination and source paths for utils.shared
     destination_path = os.path.join(program_path, "utils", "shared")
     utils_shared_sources = {
         module: os.path.join(program_path, module, "utils", "shared")
-        for module in chosen_modules
-        if os.path.exists(os.path.join(program_path, module, "utils", "shared"))
+        for module in sorted(chosen_modules)
+        if os.path.isdir(os.path.join(program_path, module, "utils", "shared"))
     }
+    logger.debug(f"utils.shared directories found: {utils_shared_sources}")
     if not utils_shared_sources:
         logger.info("No utils.shared directories found in chosen modules. Skipping...")
         return
 
-    for module, path in utils_shared_sources.items():
-        logger.info(f"Unpacking utils.shared from {module}...")
-        if os.path.exists(path):
-            # Copy over the files from the module's utils.shared to the main utils.shared
-            # if main utils.shared doesn't exist yet or if the file doesn't exist in main utils.shared.
-            if not os.path.exists(destination_path):
-                shutil.copytree(path, destination_path, ignore=ignore)
-                logger.info(f"Unpacked utils.shared for {module}")
-
-            else:
-                # Get all the files and directories in the module's utils.shared
-                for item in Path(utils_shared_sources).glob('**/*'):
-                    relative_path = item.relative_to(utils_shared_sources)
-                    destination_item = Path(destination_path) / relative_path
+    logger.info(f"Unpacking utils.shared from {', '.join(utils_shared_sources)}...")
+    result = merge_trees(utils_shared_sources, destination_path)
+    for item in result["deduplicated"]:
+        logger.info(f"Skipped {item['path']} from {item['module']}'s utils.shared, as it's the same as the one in main utils.shared")
+    for item in result["skipped"]:
+        logger.warning(f"Skipped {item['path']} from {item['module']}'s utils.shared: {item['reason']}")
+    logger.info(f"Copied {result['files']} files ({result['bytes']} bytes) to main utils.shared")
 
-                    if not destination_item.exists():
-                        if item.is_dir(): # Copy the directory and its contents
-                            shutil.copytree(item, destination_item, ignore=ignore)
-                        else: # Copy the file.
-                            shutil.copy2(item, destination_item)
-                        logger.info(f"Copied {relative_path} from {module}'s utils.shared to main utils.shared")
-                    else: # Don't overwrite files if they're already there.
-                        logger.info(f"Skipped {relative_path} from {module}'s utils.shared, as it already exists in main utils.shared")
-
-        # Remove each individual module's utils.shared folder
+    # Remove each individual module's utils.shared folder
+    for module, path in utils_shared_sources.items():
         # TODO This is what is throwing the error. Need to figure out why.
-        if os.path.exists(path):
-            shutil.rmtree(path, onexc=remove_readonly)
-            print(f"Removed {module}'s utils.shared folder")
-
-        logger.info(f"Finished processing {module}'s utils.shared folder.")
-    logger.info(f"All utils.shared unpacked. Ending unpack_utils_shared function.")
\ No newline at end of file
+        shutil.rmtree(path, onexc=remove_readonly)
+        print(f"Removed {module}'s utils.shared folder")
+    logger.info(f"All utils.shared unpacked. Ending unpack_utils_shared function.")
@@ -0,0 +1,166 @@
+import os
+
+
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.build_manifest import file_matches, load_build_manifest, make_file_entry, save_build_manifest
+
+
+def update_program(staging_path: str, program_path: str) -> dict[str, list[str]]:
+    """
+    Update an existing program in place from a fresh build of it, keeping the user's edits.
+
+    Each file is compared three ways: what was generated last time (the program's build manifest),
+    what is on disk now, and what the fresh build in staging_path generated.
+    - Files that didn't change upstream are left alone.
+    - Files that changed upstream are replaced, unless the user edited them.
+    - Files that are new upstream are added, unless the user already made a file at that path.
+    - Files that were removed upstream are deleted, unless the user edited them.
+    - Files the user deleted stay deleted.
+    Symlinks are handled the same way, comparing their targets instead of their contents.
+
+    Files are moved out of staging_path, so it should be a throwaway build on the same filesystem.
+    Only files that changed upstream are read from it, so files whose manifest entry has the same sha256
+    as last time don't have to be written there. See utils/execute_plan.py
+
+    Args:
+        staging_path: A fresh build of the program, with its own build manifest.
+        program_path: The existing program to update.
+
+    Returns:
+        Dictionary with the relative paths that were 'added', 'updated', 'removed',
+        and 'kept' (edited by the user, so left as they were).
+
+    Raises:
+        ValueError: If either directory has no build manifest.
+    """
+    old_manifest = load_build_manifest(program_path)
+    new_manifest = load_build_manifest(staging_path)
+    if old_manifest is None:
+        raise ValueError(f"No build manifest in {program_path}, so user edits can't be told apart from generated files.")
+    if new_manifest is None:
+        raise ValueError(f"No build manifest in {staging_path}")
+
+    old_files: dict[str, dict] = old_manifest["files"]
+    new_files: dict[str, dict] = new_manifest["files"]
+    summary = {"added": [], "updated": [], "removed": [], "kept": []}
+
+    for relative_path, new_entry in new_files.items():
+        old_entry = old_files.get(relative_path)
+        destination_path = os.path.join(program_path, *relative_path.split("/"))
+
+        if old_entry is not None and old_entry["sha256"] == new_entry["sha256"]:
+            # Unchanged upstream. If the file is also untouched on disk, record its real size and
+            # modification time, so the next check doesn't have to rehash it.
+            if file_matches(destination_path, old_entry):
+                new_files[relative_path] = {**new_entry, "size": old_entry["size"], "mtime_ns": old_entry["mtime_ns"]}
+            continue
+
+        exists = os.path.isfile(destination_path)
+        if old_entry is not None and not exists:
+            # The user deleted a generated file.
+            summary["kept"].append(relative_path)
+            continue
+
+        if exists:
+            if file_matches(destination_path, new_entry, rehash=True):
+                new_files[relative_path] = {**new_entry, **make_file_entry(destination_path)}
+                continue
+            if old_entry is None or not file_matches(destination_path, old_entry):
+                logger.warning(f"Keeping user edits to {relative_path}, which also changed upstream.")
+                summary["kept"].append(relative_path)
+                continue
+
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        os.replace(os.path.join(staging_path, *relative_path.split("/")), destination_path)
+        summary["updated" if exists else "added"].append(relative_path)
+
+    for relative_path, old_entry in old_files.items():
+        if relative_path in new_files:
+            continue
+        destination_path = os.path.join(program_path, *relative_path.split("/"))
+        if not os.path.isfile(destination_path):
+            continue
+        if not file_matches(destination_path, old_entry):
+            logger.warning(f"Keeping {relative_path}, which was removed upstream but edited by the user.")
+            summary["kept"].append(relative_path)
+            continue
+        os.remove(destination_path)
+        _remove_empty_parents(os.path.dirname(destination_path), program_path)
+        summary["removed"].append(relative_path)
+
+    _update_symlinks(old_manifest["symlinks"], new_manifest["symlinks"], staging_path, program_path, summary)
+
+    # The new manifest records what was generated, not what is on disk,
+    # so edits kept this time are still recognized as edits next time.
+    save_build_manifest(program_path, new_manifest)
+
+    logger.info(
+        f"Updated {program_path}: {len(summary['added'])} added, {len(summary['updated'])} updated, "
+        f"{len(summary['removed'])} removed, {len(summary['kept'])} kept"
+    )
+    return summary
+
+
+def _update_symlinks(old_symlinks: dict[str, dict],
+                     new_symlinks: dict[str, dict],
+                     staging_path: str,
+                     program_path: str,
+                     summary: dict[str, list[str]]
+                    ) -> None:
+    for relative_path, new_entry in new_symlinks.items():
+        old_entry = old_symlinks.get(relative_path)
+        if old_entry is not None and old_entry["target"] == new_entry["target"]:
+            continue
+        destination_path = os.path.join(program_path, *relative_path.split("/"))
+
+        exists = os.path.lexists(destination_path)
+        if old_entry is not None and not exists:
+            # The user deleted a generated symlink.
+            summary["kept"].append(relative_path)
+            continue
+
+        if exists:
+            target = _read_link(destination_path)
+            if target == new_entry["target"]:
+                continue
+            if old_entry is None or target != old_entry["target"]:
+                logger.warning(f"Keeping user edits to {relative_path}, which also changed upstream.")
+                summary["kept"].append(relative_path)
+                continue
+
+        os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+        os.replace(os.path.join(staging_path, *relative_path.split("/")), destination_path)
+        summary["updated" if exists else "added"].append(relative_path)
+
+    for relative_path, old_entry in old_symlinks.items():
+        if relative_path in new_symlinks:
+            continue
+        destination_path = os.path.join(program_path, *relative_path.split("/"))
+        if not os.path.lexists(destination_path):
+            continue
+        if _read_link(destination_path) != old_entry["target"]:
+            logger.warning(f"Keeping {relative_path}, which was removed upstream but edited by the user.")
+            summary["kept"].append(relative_path)
+            continue
+        os.remove(destination_path)
+        _remove_empty_parents(os.path.dirname(destination_path), program_path)
+        summary["removed"].append(relative_path)
+
+
+def _read_link(path: str) -> str | None:
+    """The target of a symlink, or None if the user replaced it with a file or folder."""
+    return os.readlink(path) if os.path.islink(path) else None
+
+
+def _remove_empty_parents(directory: str, program_path: str) -> None:
+    program_path = os.path.abspath(program_path)
+    directory = os.path.abspath(directory)
+    while directory != program_path and directory.startswith(program_path):
+        try:
+            os.rmdir(directory)
+        except OSError: # Not empty
+            return
+        directory = os.path.dirname(directory)
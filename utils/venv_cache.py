@@ -0,0 +1,283 @@
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import sysconfig
+import threading
+from typing import Optional
+
+
+from config.config import PROJECT_ROOT
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.fast_copy_file import fast_copy2
+from utils.shared.make_sha256_hash import make_sha256_hash
+from utils.wheelhouse import PROGRAM_WHEELS_FOLDER
+
+
+VENV_CACHE_PATH = os.path.join(PROJECT_ROOT, "cache", "venvs")
+
+# The venv folder install.sh and install.bat use, relative to the program directory.
+PROGRAM_VENV_FOLDER = "venv"
+
+# Where a venv keeps its scripts, whose shebangs and activate scripts have the venv's absolute path in them.
+SCRIPTS_FOLDER = "Scripts" if os.name == "nt" else "bin"
+
+# Written last when a cached venv is built, so a half-built one is never cloned.
+COMPLETE_MARKER = ".complete"
+
+# Written last when a program's venv is cloned, with the hash of the cached venv it was cloned from.
+CLONED_FROM_MARKER = ".cloned_from"
+
+# Files bigger than this are never rewritten, e.g. the interpreter itself on Windows.
+MAX_REWRITE_SIZE = 1024 * 1024
+
+
+class VenvCache:
+    """
+    A cache of virtual environments, one per set of requirements, so programs with the same requirements
+    don't each make a venv and install everything into it from scratch.
+
+    A program's venv is cloned from the cached one by hardlinking its files, so it's ready in seconds
+    and takes no extra disk space. Venvs aren't relocatable: their scripts, pyvenv.cfg and the packages'
+    RECORD files have the venv's absolute path in them, so those files are copied with the path changed
+    instead of hardlinked. Compiled bytecode (__pycache__) has the cached venv's paths in it too, so it isn't
+    cloned at all; Python compiles it again in the program's venv the first time each module is imported.
+
+    Cached files are made read-only, so their contents can't be changed through a hardlink by accident.
+    A hardlink is the same file as the cached one, though, so changing its permissions or modification time
+    (e.g. chmod, touch) changes the cached file too. Installing, upgrading or removing packages in a
+    program's venv replaces files rather than editing them, so it doesn't change the cache.
+
+    Example:
+    >>> venv_cache = VenvCache.shared()
+    >>> cached_path = venv_cache.get("/programs/my_program/requirements.txt")
+    >>> venv_cache.clone(cached_path, "/programs/my_program/venv")
+    {'files': 2312, 'linked': 2301, 'rewritten': 11, 'symlinks': 3, 'directories': 402}
+    """
+    _shared: dict[str, 'VenvCache'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, cache_path: str = VENV_CACHE_PATH, python: Optional[str] = None) -> None:
+        """
+        Args:
+            cache_path: Folder to keep the cached venvs in.
+            python: The Python to make venvs with. Defaults to the one running this.
+        """
+        self.cache_path: str = os.path.abspath(cache_path)
+        self.python: str = python or sys.executable
+        self._lock = threading.Lock()
+        os.makedirs(cache_path, exist_ok=True)
+
+
+    @classmethod
+    def shared(cls, cache_path: str = VENV_CACHE_PATH) -> 'VenvCache':
+        """
+        Get the cache for a path, creating it once per process, so a batch of programs shares it.
+        """
+        with cls._shared_lock:
+            if cache_path not in cls._shared:
+                cls._shared[cache_path] = cls(cache_path)
+            return cls._shared[cache_path]
+
+
+    def get_requirements_hash(self, requirements_path: str) -> str:
+        """Hash a requirements file, with the Python and platform the venv is made for."""
+        with open(requirements_path, "r") as f:
+            requirements = f.read()
+        return make_sha256_hash(self.python, sys.implementation.cache_tag, sysconfig.get_platform(), requirements)
+
+
+    def get(self, requirements_path: str, wheels_path: Optional[str] = None) -> str:
+        """
+        Get the cached venv for a requirements file, making it if there isn't one yet.
+
+        Args:
+            requirements_path: The requirements file. See steps/validated/concatenate_requirements.py
+            wheels_path: If given, install from this folder of wheels without the network,
+                e.g. a program's wheels from utils/wheelhouse.py
+
+        Returns:
+            The path to the cached venv.
+
+        Raises:
+            RuntimeError: If the venv can't be made, or the requirements can't be installed into it.
+        """
+        venv_path = os.path.join(self.cache_path, self.get_requirements_hash(requirements_path))
+        with self._lock:
+            if os.path.exists(os.path.join(venv_path, COMPLETE_MARKER)):
+                logger.info(f"Using cached venv {os.path.basename(venv_path)} for {requirements_path}")
+                return venv_path
+            if os.path.exists(venv_path):
+                logger.warning(f"Removing incomplete cached venv {venv_path}")
+                shutil.rmtree(venv_path)
+            try:
+                self._build(venv_path, requirements_path, wheels_path)
+            except BaseException:
+                shutil.rmtree(venv_path, ignore_errors=True)
+                raise
+        return venv_path
+
+
+    def _build(self, venv_path: str, requirements_path: str, wheels_path: Optional[str]) -> None:
+        # Made where it's kept, since a venv can't be moved once it's made.
+        logger.info(f"Making cached venv {os.path.basename(venv_path)} for {requirements_path}...")
+        python = os.path.join(venv_path, SCRIPTS_FOLDER, "python.exe" if os.name == "nt" else "python")
+        install = [python, "-m", "pip", "install", "--quiet", "--requirement", requirements_path]
+        if wheels_path is not None:
+            install += ["--no-index", "--find-links", wheels_path]
+        for command in ([self.python, "-m", "venv", venv_path], install):
+            result = subprocess.run(command, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Could not make a venv for {requirements_path} with '{' '.join(command)}':\n"
+                                   f"{result.stderr.strip()}")
+
+        # Stored files are read-only, so their contents can't be changed through a hardlink by accident.
+        for root, _, filenames in os.walk(venv_path):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if not os.path.islink(path):
+                    os.chmod(path, stat.S_IMODE(os.stat(path).st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+        with open(os.path.join(venv_path, COMPLETE_MARKER), "w"):
+            pass
+
+
+    def clone(self, cached_path: str, destination_path: str) -> dict[str, int]:
+        """
+        Make a venv at destination_path from a cached one, hardlinking every file that doesn't have
+        the cached venv's path in it. Files are copied where hardlinks aren't supported.
+        __pycache__ folders are left out. The hash of the cached venv is written to CLONED_FROM_MARKER last,
+        so add_cached_venv can tell which requirements the venv has.
+
+        Returns:
+            How many 'files' were cloned, how many of them were 'linked' and 'rewritten',
+            and how many 'symlinks' and 'directories' were made.
+
+        Raises:
+            FileExistsError: If destination_path already exists.
+        """
+        if os.path.lexists(destination_path):
+            raise FileExistsError(f"{destination_path} already exists")
+        destination_path = os.path.abspath(destination_path)
+        try:
+            return self._clone(cached_path, destination_path)
+        except BaseException:
+            # A half-cloned venv has no CLONED_FROM_MARKER, so it would be mistaken for one the user made.
+            shutil.rmtree(destination_path, ignore_errors=True)
+            raise
+
+
+    def _clone(self, cached_path: str, destination_path: str) -> dict[str, int]:
+        old_prefix, new_prefix = cached_path.encode(), destination_path.encode()
+        stats = {"files": 0, "linked": 0, "rewritten": 0, "symlinks": 0, "directories": 0}
+
+        for root, dirs, filenames in os.walk(cached_path):
+            relative_root = os.path.relpath(root, cached_path)
+            destination_root = os.path.normpath(os.path.join(destination_path, relative_root))
+            os.makedirs(destination_root)
+            stats["directories"] += 1
+            # Symlinked folders (e.g. lib64 -> lib) are recreated, not walked.
+            for name in [name for name in dirs if os.path.islink(os.path.join(root, name))]:
+                dirs.remove(name)
+                filenames.append(name)
+            if "__pycache__" in dirs:
+                dirs.remove("__pycache__")
+
+            for filename in filenames:
+                if relative_root == "." and filename == COMPLETE_MARKER:
+                    continue
+                source = os.path.join(root, filename)
+                destination = os.path.join(destination_root, filename)
+                if os.path.islink(source):
+                    target = os.readlink(source)
+                    if target.startswith(cached_path):
+                        target = destination_path + target[len(cached_path):]
+                    os.symlink(target, destination)
+                    stats["symlinks"] += 1
+                    continue
+
+                stats["files"] += 1
+                if self._rewrite(source, destination, relative_root, old_prefix, new_prefix):
+                    stats["rewritten"] += 1
+                    continue
+                try:
+                    os.link(source, destination)
+                    stats["linked"] += 1
+                except OSError as e:
+                    # Not supported on this filesystem, across filesystems, or too many links.
+                    logger.debug(f"Could not hardlink {destination}, copying it: {e}")
+                    fast_copy2(source, destination)
+
+        with open(os.path.join(destination_path, CLONED_FROM_MARKER), "w") as f:
+            f.write(os.path.basename(cached_path))
+        return stats
+
+
+    @staticmethod
+    def _rewrite(source: str, destination: str, relative_root: str, old_prefix: bytes, new_prefix: bytes) -> bool:
+        """Copy a script, pyvenv.cfg or RECORD file with the venv's path changed. False if the file doesn't need it."""
+        filename = os.path.basename(source)
+        if not (relative_root == SCRIPTS_FOLDER
+                or (relative_root == "." and filename == "pyvenv.cfg")
+                or (relative_root.endswith(".dist-info") and filename == "RECORD")):
+            return False
+        if os.path.getsize(source) > MAX_REWRITE_SIZE:
+            return False
+        with open(source, "rb") as f:
+            contents = f.read()
+        if old_prefix not in contents:
+            return False
+        with open(destination, "wb") as f:
+            f.write(contents.replace(old_prefix, new_prefix))
+        shutil.copymode(source, destination)
+        os.chmod(destination, stat.S_IMODE(os.stat(destination).st_mode) | stat.S_IWUSR)
+        return True
+
+
+def add_cached_venv(program_path: str, venv_cache: Optional[VenvCache] = None) -> Optional[str]:
+    """
+    Give a program a venv with its requirements installed, cloned from the venv cache.
+    If the program has a wheels folder (see utils/wheelhouse.py), a new cached venv is installed from it,
+    without the network.
+    If the program already has a venv cloned from the cache for other requirements, e.g. after an update,
+    it's replaced. A venv that's up to date, or that wasn't cloned from the cache, is left alone.
+
+    Args:
+        program_path: The program directory, at its final path, with its combined requirements.txt.
+        venv_cache: The cache to clone from. Defaults to the shared one.
+
+    Returns:
+        The path to the program's venv, or None if it already had one that's kept.
+    """
+    venv_path = os.path.join(program_path, PROGRAM_VENV_FOLDER)
+    requirements_path = os.path.join(program_path, "requirements.txt")
+    venv_cache = venv_cache or VenvCache.shared()
+    if os.path.lexists(venv_path):
+        cloned_from = _read_cloned_from(venv_path)
+        if cloned_from is None:
+            logger.info(f"{venv_path} already exists and wasn't cloned from the venv cache. Skipping...")
+            return None
+        if cloned_from == venv_cache.get_requirements_hash(requirements_path):
+            logger.info(f"{venv_path} is up to date with the program's requirements. Skipping...")
+            return None
+        logger.info(f"{venv_path} was cloned for other requirements. Cloning it again...")
+        # Not remove_readonly: making a hardlinked file writable would make the cached file writable too.
+        shutil.rmtree(venv_path)
+
+    wheels_path = os.path.join(program_path, PROGRAM_WHEELS_FOLDER)
+    cached_path = venv_cache.get(requirements_path, wheels_path=wheels_path if os.path.isdir(wheels_path) else None)
+    stats = venv_cache.clone(cached_path, venv_path)
+    print(f"Cloned venv for {os.path.basename(program_path)} from the cache "
+          f"({stats['linked']} files hardlinked, {stats['rewritten']} rewritten)")
+    return venv_path
+
+
+def _read_cloned_from(venv_path: str) -> Optional[str]:
+    try:
+        with open(os.path.join(venv_path, CLONED_FROM_MARKER), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
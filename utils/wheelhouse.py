@@ -0,0 +1,294 @@
+import json
+import os
+import stat
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import threading
+import time
+from typing import Optional
+
+
+from config.config import PROJECT_ROOT
+from logger.logger import Logger
+logger = Logger(logger_name=__name__)
+
+
+from utils.build_manifest import make_file_entry
+from utils.content_store import ContentStore
+from utils.shared.make_sha256_file_hash import make_sha256_file_hash
+from utils.shared.make_sha256_hash import make_sha256_hash
+
+
+WHEELHOUSE_PATH = os.path.join(PROJECT_ROOT, "cache", "wheelhouse")
+
+# Where a program's wheels go, relative to the program directory.
+PROGRAM_WHEELS_FOLDER = "wheels"
+
+# Wheels are never edited, so they can be hardlinked from the store.
+WHEEL_LINK_MODES = ("reflink", "hardlink", "copy")
+
+# How long a set of requirements stays resolved. Unpinned requirements (and the dependencies of pinned ones)
+# can resolve to newer versions after that.
+LOCK_MAX_AGE_IN_SECONDS = 24 * 60 * 60
+
+OFFLINE_INSTALL_SH = """#!/bin/bash
+
+echo "Setting up the environment from the wheels folder..."
+
+# Check if Python is installed
+if ! command -v python3 &> /dev/null
+then
+    echo "Python is not installed. Please install Python 3.7 or later and add it to your PATH."
+    exit 1
+fi
+
+# Check if the virtual environment already exists
+if [ -d "venv" ]; then
+    echo "Virtual environment already exists. Skipping creation."
+else
+    # Create a virtual environment if it doesn't exist
+    echo "Creating a virtual environment..."
+    python3 -m venv venv
+fi
+
+# Activate the virtual environment
+echo "Activating the virtual environment 'venv'..."
+source venv/bin/activate
+
+# Install required packages from the wheels folder, without going to the network.
+echo "Installing required packages..."
+pip install --no-index --find-links {wheels} -r requirements.txt
+
+echo "Setup complete!"
+""".replace("{wheels}", PROGRAM_WHEELS_FOLDER)
+
+OFFLINE_INSTALL_BAT = """@echo off
+echo Setting up the environment from the wheels folder...
+
+REM Check if Python is installed
+python --version >nul 2>&1
+if %errorlevel% neq 0 (
+    echo Python is not installed. Please install Python 3.7 or later and add it to your PATH.
+    exit /b 1
+)
+
+REM Check if the virtual environment already exists
+if exist venv (
+    echo Virtual environment already exists. Skipping creation.
+) else (
+    REM Create a virtual environment if it doesn't exist
+    echo Creating a virtual environment...
+    python -m venv venv
+)
+
+REM Activate the virtual environment
+echo Activating the virtual environment 'venv'...
+call venv\\Scripts\\activate.bat
+
+REM Install required packages from the wheels folder, without going to the network.
+echo Installing required packages...
+pip install --no-index --find-links {wheels} -r requirements.txt
+
+echo Setup complete!
+""".replace("{wheels}", PROGRAM_WHEELS_FOLDER)
+
+OFFLINE_INSTALL_SCRIPTS = {"install_offline.sh": OFFLINE_INSTALL_SH, "install_offline.bat": OFFLINE_INSTALL_BAT}
+
+
+class Wheelhouse:
+    """
+    A local, shared store of wheels for programs' requirements, so installing many programs
+    doesn't download the same wheels once per program, and they can be installed without a network.
+
+    Wheels are kept in a ContentStore, so each one is stored once however many requirements sets use it.
+    Each set of requirements is only resolved by pip once per lock_max_age: the wheels it resolved to
+    are recorded in a lock file named after the requirements' hash, so later programs with the same
+    requirements don't run pip at all. Once the lock file expires, the requirements are resolved again,
+    so new releases are picked up. New sets only download wheels that aren't in the wheelhouse yet.
+
+    The wheels are for the Python and platform that pip runs on, which is part of the hash.
+
+    Example:
+    >>> wheelhouse = Wheelhouse.shared()
+    >>> wheels = wheelhouse.resolve("/programs/my_program/requirements.txt")
+    >>> wheels
+    {'PyYAML-6.0.1-cp312-cp312-manylinux_2_17_x86_64.whl': '0fa1d6b9...'}
+    >>> wheelhouse.materialize(wheels, "/programs/my_program/wheels")
+    """
+    _shared: dict[str, 'Wheelhouse'] = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self,
+                 wheelhouse_path: str = WHEELHOUSE_PATH,
+                 pip_command: Optional[list[str]] = None,
+                 lock_max_age: float = LOCK_MAX_AGE_IN_SECONDS
+                ) -> None:
+        """
+        Args:
+            wheelhouse_path: Folder to keep the wheels, and the lock files of resolved requirements, in.
+            pip_command: The command to run pip with. Defaults to the pip of the Python running this.
+            lock_max_age: Seconds before a set of requirements is resolved again.
+        """
+        self.wheelhouse_path: str = wheelhouse_path
+        self.store = ContentStore(os.path.join(wheelhouse_path, "store"), link_modes=WHEEL_LINK_MODES)
+        # Every stored wheel under its own name, for pip's --find-links.
+        self.wheels_path: str = os.path.join(wheelhouse_path, "wheels")
+        self.locks_path: str = os.path.join(wheelhouse_path, "locks")
+        self.pip_command: list[str] = pip_command or [sys.executable, "-m", "pip"]
+        self.lock_max_age: float = lock_max_age
+        self._lock = threading.Lock()
+        os.makedirs(self.wheels_path, exist_ok=True)
+        os.makedirs(self.locks_path, exist_ok=True)
+
+
+    @classmethod
+    def shared(cls, wheelhouse_path: str = WHEELHOUSE_PATH) -> 'Wheelhouse':
+        """
+        Get the wheelhouse for a path, creating it once per process, so a batch of programs shares it.
+        """
+        with cls._shared_lock:
+            if wheelhouse_path not in cls._shared:
+                cls._shared[wheelhouse_path] = cls(wheelhouse_path)
+            return cls._shared[wheelhouse_path]
+
+
+    def get_requirements_hash(self, requirements_path: str) -> str:
+        """Hash a requirements file, with the Python and platform pip builds wheels for."""
+        with open(requirements_path, "r") as f:
+            requirements = f.read()
+        return make_sha256_hash(" ".join(self.pip_command), sys.implementation.cache_tag, sysconfig.get_platform(), requirements)
+
+
+    def resolve(self, requirements_path: str) -> dict[str, str]:
+        """
+        Get the wheels that install a requirements file, downloading or building the ones the wheelhouse doesn't have.
+
+        Returns:
+            Dictionary mapping each wheel's filename to its SHA-256 hex digest in the store.
+
+        Raises:
+            RuntimeError: If pip can't get a wheel for every requirement.
+        """
+        lock_path = os.path.join(self.locks_path, f"{self.get_requirements_hash(requirements_path)}.json")
+        with self._lock:
+            wheels = self._load_lock(lock_path)
+            if wheels is not None:
+                logger.info(f"Requirements in {requirements_path} were already resolved to {len(wheels)} wheels")
+                return wheels
+
+            with tempfile.TemporaryDirectory(dir=self.wheelhouse_path, prefix=".resolve-") as wheel_dir:
+                # Wheels already in the wheelhouse are used from there, rather than downloaded again.
+                command = [*self.pip_command, "wheel", "--quiet", "--requirement", requirements_path,
+                           "--wheel-dir", wheel_dir, "--find-links", self.wheels_path]
+                logger.info(f"Resolving {requirements_path} into the wheelhouse...")
+                result = subprocess.run(command, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"pip could not get wheels for {requirements_path}:\n{result.stderr.strip()}")
+
+                wheels = {}
+                for filename in sorted(os.listdir(wheel_dir)):
+                    if not filename.endswith(".whl"):
+                        continue
+                    digest = self.store.add(os.path.join(wheel_dir, filename))
+                    wheels[filename] = digest
+                    shared_path = os.path.join(self.wheels_path, filename)
+                    if os.path.lexists(shared_path) and not self._is_stored(shared_path, digest):
+                        # Same filename, different wheel, e.g. rebuilt from an sdist. pip should find the new one.
+                        os.remove(shared_path)
+                    if not os.path.exists(shared_path):
+                        self.store.materialize(digest, shared_path)
+            self._save_lock(lock_path, wheels)
+        logger.info(f"Resolved {requirements_path} to {len(wheels)} wheels")
+        return wheels
+
+
+    def materialize(self, wheels: dict[str, str], folder_path: str) -> dict[str, dict]:
+        """
+        Put wheels from the store in a folder, hardlinked where possible.
+
+        Args:
+            wheels: Dictionary mapping each wheel's filename to its digest, from resolve.
+            folder_path: The folder to put them in. Made if it doesn't exist.
+
+        Returns:
+            Build manifest entries for the wheels, keyed by filename.
+        """
+        os.makedirs(folder_path, exist_ok=True)
+        files = {}
+        for filename, digest in wheels.items():
+            destination_path = os.path.join(folder_path, filename)
+            if os.path.lexists(destination_path):
+                os.remove(destination_path)
+            self.store.materialize(digest, destination_path)
+            st = os.stat(destination_path)
+            files[filename] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        return files
+
+
+    def _is_stored(self, path: str, digest: str) -> bool:
+        """Check whether a file is the stored wheel with this digest, without reading it if it's hardlinked."""
+        object_path = self.store.object_path(digest)
+        if os.path.exists(object_path) and os.path.samefile(path, object_path):
+            return True
+        return make_sha256_file_hash(path) == digest
+
+
+    def _load_lock(self, lock_path: str) -> Optional[dict[str, str]]:
+        try:
+            with open(lock_path, "r") as f:
+                lock = json.load(f)
+            wheels, resolved_at = lock["wheels"], lock["resolved_at"]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Could not load wheelhouse lock file {lock_path}, resolving again: {e}")
+            return None
+        if time.time() - resolved_at > self.lock_max_age:
+            logger.debug(f"Wheelhouse lock file {lock_path} has expired, resolving again")
+            return None
+        # A wheel that's gone missing from the store means resolving again.
+        if all(os.path.exists(self.store.object_path(digest)) for digest in wheels.values()):
+            return wheels
+        return None
+
+
+    def _save_lock(self, lock_path: str, wheels: dict[str, str]) -> None:
+        # Write to a temporary file, then rename, so a crash never leaves half a lock file.
+        fd, temp_path = tempfile.mkstemp(dir=self.locks_path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"resolved_at": time.time(), "wheels": wheels}, f, indent=2)
+        os.replace(temp_path, lock_path)
+
+
+def add_offline_install(program_path: str, wheelhouse: Optional[Wheelhouse] = None) -> dict[str, dict]:
+    """
+    Put the wheels for a program's requirements.txt in its wheels folder, from the shared wheelhouse,
+    and write install_offline.sh and install_offline.bat, which install them with pip --no-index --find-links.
+    The program then installs at disk speed, without a network.
+
+    Args:
+        program_path: The program directory, with its combined requirements.txt.
+        wheelhouse: The wheelhouse to get the wheels from. Defaults to the shared one.
+
+    Returns:
+        Build manifest entries for the files that were written, keyed by their relative path.
+    """
+    wheelhouse = wheelhouse or Wheelhouse.shared()
+    wheels = wheelhouse.resolve(os.path.join(program_path, "requirements.txt"))
+    files = {
+        f"{PROGRAM_WHEELS_FOLDER}/{filename}": entry
+        for filename, entry in wheelhouse.materialize(wheels, os.path.join(program_path, PROGRAM_WHEELS_FOLDER)).items()
+    }
+
+    for filename, script in OFFLINE_INSTALL_SCRIPTS.items():
+        script_path = os.path.join(program_path, filename)
+        with open(script_path, "w", newline="\r\n" if filename.endswith(".bat") else "\n") as f:
+            f.write(script)
+        if filename.endswith(".sh"):
+            os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+        files[filename] = make_file_entry(script_path)
+
+    print(f"Added {len(wheels)} wheels and offline install scripts to {os.path.basename(program_path)}")
+    return files